@@ -16,6 +16,7 @@
 #ifdef MULTI_THREAD_KL_CALC
 #include <pthread.h>
 #include <time.h>
+#include <unistd.h>
 #endif
 
 extern "C"{
@@ -325,6 +326,112 @@ float real_multi_thread_kl_diversity_hist(int *data, float &width, const long lo
 
   return threshold;
 }
+
+// the kl of every candidate computed in the calling thread, so that
+// the batched version can spread whole histograms over threads instead
+float real_kl_diversity_hist_serial(int *data, float width, const long long N, const long long BINS) {
+  ASSERT(BINS==128 || BINS == 8);
+  const long long KL_NUM = N / BINS;
+  long long *hist = new long long[N];
+  float *kl = new float[KL_NUM];
+  long long count = 0;
+
+  for (long long i = 0; i < N; i++) {
+    hist[i] = data[i];
+    count += hist[i];
+  }
+
+  long long m = 0;
+  struct mul_thread_inputs args_input;
+  for (long long i = BINS; i < N + 1; i += BINS) {
+    kl[m] = 0.0;
+    args_input.hist  = hist;
+    args_input.kl    = &kl[m];
+    args_input.count = count;
+    args_input.i     = i;
+    args_input.N     = N;
+    args_input.BINS  = BINS;
+    kl_calc_thread((void *)&args_input);
+    m++;
+  }
+
+  long long m_min = the_min_index(kl, m);
+  float threshold = width * (m_min + 1) * BINS;
+
+  delete[] hist;
+  delete[] kl;
+
+  return threshold;
+}
+
+struct batch_thread_inputs{
+  int* data;
+  float* widths;
+  long long num;
+  long long N;
+  long long* dst_bins;
+  long long dst_num;
+  float* thresholds;
+  long long* next_task;
+};
+
+void* kl_batch_thread(void* args_input) {
+  struct batch_thread_inputs *args;
+  args = (struct batch_thread_inputs *)args_input;
+  long long total = args->num * args->dst_num;
+  while (true) {
+    long long task = __sync_fetch_and_add(args->next_task, 1LL);
+    if (task >= total) {
+      break;
+    }
+    long long d = task / args->num;
+    long long t = task % args->num;
+    args->thresholds[task] = real_kl_diversity_hist_serial(
+        args->data + t * args->N, args->widths[t], args->N, args->dst_bins[d]);
+  }
+  return NULL;
+}
+
+// data: [num, N] histograms, widths: [num], dst_bins: [dst_num]
+// thresholds: [dst_num, num]
+void real_multi_thread_kl_diversity_hist_batch(int *data, float *widths, long long num,
+                                               const long long N, long long *dst_bins,
+                                               long long dst_num, float *thresholds,
+                                               long long num_threads) {
+  long long total = num * dst_num;
+  if (total == 0) {
+    return;
+  }
+  if (num_threads <= 0) {
+    num_threads = sysconf(_SC_NPROCESSORS_ONLN);
+  }
+  if (num_threads > total) {
+    num_threads = total;
+  }
+  long long next_task = 0;
+  struct batch_thread_inputs args_input;
+  args_input.data       = data;
+  args_input.widths     = widths;
+  args_input.num        = num;
+  args_input.N          = N;
+  args_input.dst_bins   = dst_bins;
+  args_input.dst_num    = dst_num;
+  args_input.thresholds = thresholds;
+  args_input.next_task  = &next_task;
+
+  pthread_t *id = new pthread_t[num_threads];
+  for (long long m = 0; m < num_threads; m++) {
+    long long ret = pthread_create(&id[m], NULL, kl_batch_thread, (void *)&args_input);
+    if (ret) {
+      printf("Create No. %lld thread error!\n", m);
+      exit(1);
+    }
+  }
+  for (long long m = 0; m < num_threads; m++) {
+    pthread_join(id[m], NULL);
+  }
+  delete[] id;
+}
 #endif
 
 float kl_diversity(float *data, long long count, long long num_bins) {
@@ -338,4 +445,11 @@ float kl_diversity(float *data, long long count, long long num_bins) {
 float kl_diversity_hist(int *data, float width, long long num_bins, long long dst_bins) {
   return real_multi_thread_kl_diversity_hist(data, width, num_bins, dst_bins);
 }
+
+void kl_diversity_hist_batch(int *data, float *widths, long long num, long long num_bins,
+                             long long *dst_bins, long long dst_num, float *thresholds,
+                             long long num_threads) {
+  real_multi_thread_kl_diversity_hist_batch(data, widths, num, num_bins, dst_bins, dst_num,
+                                            thresholds, num_threads);
+}
 }
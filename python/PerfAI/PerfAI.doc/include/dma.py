@@ -5,6 +5,7 @@
 # @Project : PerfAI
 import os
 
+import numpy as np
 import pandas as pd
 from openpyxl import load_workbook
 from openpyxl.utils import get_column_letter
@@ -14,6 +15,18 @@ from definition.style import *
 from utils.utils import *
 
 
+def cdma_reg_values(attr, values):
+    if 'burst' in attr.lower() or 'width' in attr.lower():
+        return values
+    return [int(val) if val.isnumeric() else val for val in values]
+
+
+def dma_reg_values(attr, values):
+    if 'bandwidth' in attr.lower():
+        return [float(val) for val in values]
+    return cdma_reg_values(attr, values)
+
+
 class DmaNode:
     def __init__(self, reg):
         self.datasize = int(reg['DMA data size(B)'])
@@ -41,7 +54,7 @@ class Dma(object):
                         'mask_start_addr_h8', 'mask_start_addr_l32', 'mask_data_format', 'localmem_mask_h32',
                         'localmem_mask_l32',
                         'fill_constant_en', 'constant_value', 'index', 'cmd_short', 'intr_en', 'Msg Id', 'Sd\Wt Count']
-        self.reg_list = []
+        self.reg_df = pd.DataFrame(columns=self.columns)
         self.core_id = str(core_id)
         self.height = None
         self.width = len(self.columns)
@@ -67,99 +80,70 @@ class Dma(object):
         self.sheet_name = None
         self.sheet_color = None
         self.writer = writer
+        self.table_writer = None
         self.start_time = sys.maxsize
         self.end_time = 0
         self.dma_time = 0
 
-    def load(self, reg_info_file, dma_layer_map):
+    def read(self, reg_info_file, dma_layer_map):
+        """
+        Read the registers of all the engines in a tdma register info file, gdma and sdma share the file.
+        :param reg_info_file: file records register information, usually obtained by TPUPerf
+        :return: the chip arch dict and the register frame, None and an empty frame without the file
+        """
+        if os.path.exists(reg_info_file) and os.path.getsize(reg_info_file) != 0:
+            chip_arch_dict, reg_df = read_reg_info(reg_info_file, "__TDMA_REG_INFO__", self.columns, dma_reg_values)
+            set_layer_info(reg_df, dma_layer_map)
+            return chip_arch_dict, reg_df
+        return None, pd.DataFrame(columns=self.columns)
+
+    def load(self, reg_info_file, dma_layer_map, reg_info=None):
         """
         Load data from external file.
         :param reg_info_file: file records register information, usually obtained by TPUPerf
+        :param reg_info: the result of read for reg_info_file, if it is read already
         :return: None
         """
-        if os.path.exists(reg_info_file) and os.path.getsize(reg_info_file) != 0:
-            with open(reg_info_file) as f:
-                rows = f.readlines()
-                field_set = set()
-                reg_count = 0
-                for row in rows:
-                    if "__TDMA_REG_INFO__" in row:
-                        reg_count += 1
-                    if "\t" in row and reg_count > 0:
-                        attr = row.split(': ')[0][1:]
-                        field_set.add(attr)
-                reg_count = 0
-                field_list = list(field_set) if len(field_set) >= len(self.columns) else self.columns
-                reg_dict = dict.fromkeys(field_list, '')
-                idx = 0
-                for row in rows:
-                    if "__CHIP_ARCH_ARGS__" in row:
-                        self.chip_arch_dict = dict()
-                    elif "__TDMA_REG_INFO__" in row:
-                        reg_count += 1
-                        if idx != 0:
-                            k = int(reg_dict['Cmd Id'])
-                            if k in dma_layer_map.keys():
-                                layer_id_name = dma_layer_map[k]
-                            else:
-                                layer_id_name = ['-', '-']
-                            reg_dict['Layer Id'] = layer_id_name[0]
-                            reg_dict['Layer Name'] = layer_id_name[1]
-                            self.reg_list.append(reg_dict)
-                        reg_dict = dict.fromkeys(field_list, '')
-                    elif reg_count == 0:
-                        fields = row.split(': ')
-                        attr = fields[0][1:]
-                        val = fields[1][:-1]
-                        self.chip_arch_dict[attr] = val
-                        idx = 0
-                    else:
-                        fields = row.split(': ')
-                        attr = fields[0][1:]
-                        val = fields[1][:-1]
-                        if val.isnumeric() and 'burst' not in attr.lower() and 'width' not in attr.lower():
-                            val = int(val)
-                        elif 'bandwidth' in attr.lower():
-                            val = float(val)
-                        reg_dict[attr] = val
-                        idx += 1
-                self.reg_list.append(reg_dict)
-        self.height = len(self.reg_list)
+        self.chip_arch_dict, self.reg_df = reg_info if reg_info is not None else self.read(reg_info_file, dma_layer_map)
+        self.height = len(self.reg_df)
 
     def add_kpi_field(self):
         """
         Add some indicators which are convenient for performance analysis artificially.
         :return: None
         """
-        for i in range(len(self.reg_list)):
-            reg_dict = self.reg_list[i]
-            name_key = (int(reg_dict['cmd_type']))
-            if reg_dict['cmd_type'] == 6:
-                reg_dict['Data Type'] = 'None'
-                # dma_sys do not transfer data
-                reg_dict['Direction'] = '-'
-            self.dma_cycle += int(reg_dict['Asic Cycle'])
-            self.stall_cycle += int(reg_dict['Stall Cycle'])
-            if 'DDR' in reg_dict['Direction'] and isinstance(reg_dict['DMA data size(B)'], int):
-                self.ddr_total_datasize += reg_dict['DMA data size(B)']
-                self.ddr_total_cycle += reg_dict['Asic Cycle']
-                self.ddr_burst_length_sum += reg_dict['gmem_bl_sum']
-                self.ddr_xact_cnt += reg_dict['gmem_xact_cnt']
-            elif 'L2' in reg_dict['Direction'] and isinstance(reg_dict['DMA data size(B)'], int):
-                self.l2_total_datasize += reg_dict['DMA data size(B)']
-                self.l2_total_cycle += reg_dict['Asic Cycle']
-            if reg_dict['cmd_type'] == 6 and reg_dict['cmd_special_function'] == 4:
-                self.wait_msg_total_time += reg_dict['Asic Cycle']
-            if reg_dict['gmem_xact_cnt'] > 0:
-                reg_dict['AvgBurstLength'] = get_ratio_float_2f(reg_dict['gmem_bl_sum'], reg_dict['gmem_xact_cnt'])
-                reg_dict['Non32ByteRatio'] = get_ratio_float_2f(reg_dict['gmem_n32Ba_sa_cnt'], reg_dict['gmem_xact_cnt'])
-                reg_dict['MaskWriteRatio'] = get_ratio_float_2f(reg_dict['gmem_msk_wr_cnt'], reg_dict['gmem_xact_cnt'])
-            else:
-                reg_dict['AvgBurstLength'] = 0
-                reg_dict['Non32ByteRatio'] = 0
-                reg_dict['MaskWriteRatio'] = 0
-            self.start_time = min(self.start_time, get_time_by_cycle(reg_dict['Start Cycle'], self.chip_arch_dict['DMA Frequency(MHz)']))
-            self.end_time = max(self.start_time, get_time_by_cycle(reg_dict['End Cycle'], self.chip_arch_dict['DMA Frequency(MHz)']))
+        reg_df = self.reg_df
+        if len(reg_df) > 0:
+            sys_cmd = (reg_df['cmd_type'].astype(int) == 6).values
+            reg_df.loc[sys_cmd, 'Data Type'] = 'None'
+            # dma_sys do not transfer data
+            reg_df.loc[sys_cmd, 'Direction'] = '-'
+            asic_cycle = reg_df['Asic Cycle'].astype(int).values
+            self.dma_cycle += int(asic_cycle.sum())
+            self.stall_cycle += int(reg_df['Stall Cycle'].astype(int).sum())
+            # registers without data size do not count
+            datasize = pd.to_numeric(reg_df['DMA data size(B)'], errors='coerce').values
+            has_datasize = ~np.isnan(datasize)
+            direction = reg_df['Direction'].astype(str)
+            ddr = direction.str.contains('DDR', regex=False).values & has_datasize
+            l2 = direction.str.contains('L2', regex=False).values & has_datasize & ~ddr
+            self.ddr_total_datasize += int(datasize[ddr].sum())
+            self.ddr_total_cycle += int(asic_cycle[ddr].sum())
+            self.ddr_burst_length_sum += int(reg_df['gmem_bl_sum'].values[ddr].sum())
+            self.ddr_xact_cnt += int(reg_df['gmem_xact_cnt'].values[ddr].sum())
+            self.l2_total_datasize += int(datasize[l2].sum())
+            self.l2_total_cycle += int(asic_cycle[l2].sum())
+            wait_msg = sys_cmd & (reg_df['cmd_special_function'] == 4).values
+            self.wait_msg_total_time += int(asic_cycle[wait_msg].sum())
+            xact_cnt = reg_df['gmem_xact_cnt'].tolist()
+            for kpi, count in [('AvgBurstLength', 'gmem_bl_sum'), ('Non32ByteRatio', 'gmem_n32Ba_sa_cnt'),
+                               ('MaskWriteRatio', 'gmem_msk_wr_cnt')]:
+                reg_df[kpi] = [get_ratio_float_2f(x, y) if y > 0 else 0
+                               for x, y in zip(reg_df[count].tolist(), xact_cnt)]
+            frequency = int(self.chip_arch_dict['DMA Frequency(MHz)'])
+            start_cycle = reg_df['Start Cycle'].astype(int).values
+            self.start_time = min(self.start_time, int((start_cycle / frequency * 1000).astype(int).min()))
+            self.end_time = max(self.start_time, get_time_by_cycle(reg_df['End Cycle'].iloc[-1], frequency))
         self.dma_time = get_time_by_cycle(self.dma_cycle, self.chip_arch_dict['DMA Frequency(MHz)']) if self.chip_arch_dict else 0
         self.working_cycle = self.dma_cycle - self.wait_msg_total_time
         self.ddr_avg_bandwidth = get_ratio_float_2f(self.ddr_total_datasize,
@@ -184,7 +168,7 @@ class Dma(object):
 
     def pop_data(self):
         gdma_instance_map = dict()
-        for reg in self.reg_list:
+        for reg in self.reg_df.to_dict('records'):
             gdma_instance_map[int(reg['Cmd Id'])] = DmaNode(reg)
         return gdma_instance_map
 
@@ -193,7 +177,7 @@ class Dma(object):
         Write register information and kpi field to Excel.
         :return: None
         """
-        df = pd.DataFrame(self.reg_list)
+        df = self.reg_df
         new_df = pd.DataFrame()
         if len(df) > 0:
             for column in self.columns:
@@ -211,7 +195,11 @@ class Dma(object):
             pd.DataFrame(self.perf_dict).to_excel(self.writer, index=False, sheet_name=self.sheet_name, startrow=0,
                                                   startcol=2,
                                                   engine='xlsxwriter', float_format='%g')
-            df.to_excel(self.writer, index=False, sheet_name=self.sheet_name, startrow=5, engine='xlsxwriter', float_format='%g')
+            if self.table_writer is not None:
+                self.table_writer.write(df, self.sheet_name)
+            else:
+                df.to_excel(self.writer, index=False, sheet_name=self.sheet_name, startrow=5, engine='xlsxwriter',
+                            float_format='%g')
 
     @classmethod
     def set_style(cls, file_path, core_id, engine_type, sheet_color, chip_arch, frozen=True):
@@ -373,19 +361,15 @@ class Gdma(Dma):
         super().__init__(core_id, writer)
         self.sheet_name = sheet_name + '_' + str(core_id)
 
-    def load(self, reg_info_file, gdma_layer_map):
+    def load(self, reg_info_file, gdma_layer_map, reg_info=None):
         """
         Load gdma data from external file.
         :param gdma_layer_map:
         :param reg_info_file: file records DMA register information, usually obtained by TPUPerf
         :return: None
         """
-        super().load(reg_info_file, gdma_layer_map)
-        new_reg_list = []
-        for reg_dict in self.reg_list:
-            if reg_dict['Engine Id'] == 1:
-                new_reg_list.append(reg_dict)
-        self.reg_list = new_reg_list
+        super().load(reg_info_file, gdma_layer_map, reg_info)
+        self.reg_df = self.reg_df[self.reg_df['Engine Id'] == 1].reset_index(drop=True)
         return self.chip_arch_dict
 
     @classmethod
@@ -413,19 +397,15 @@ class Sdma(Dma):
         super().__init__(core_id, writer)
         self.sheet_name = sheet_name + '_' + str(core_id)
 
-    def load(self, reg_info_file, sdma_layer_map):
+    def load(self, reg_info_file, sdma_layer_map, reg_info=None):
         """
         Load data from external file.
         :param sdma_layer_map:
         :param reg_info_file: file records register information, usually obtained by TPUPerf
         :return: None
         """
-        super().load(reg_info_file, sdma_layer_map)
-        new_reg_list = []
-        for reg_dict in self.reg_list:
-            if reg_dict['Engine Id'] == 3:
-                new_reg_list.append(reg_dict)
-        self.reg_list = new_reg_list
+        super().load(reg_info_file, sdma_layer_map, reg_info)
+        self.reg_df = self.reg_df[self.reg_df['Engine Id'] == 3].reset_index(drop=True)
         return self.chip_arch_dict
 
     @classmethod
@@ -461,47 +441,10 @@ class Cdma(Dma):
         :return: None
         """
         if os.path.exists(reg_info_file) and os.path.getsize(reg_info_file) != 0:
-            with open(reg_info_file) as f:
-                rows = f.readlines()
-                field_set = set()
-                reg_count = 0
-                for row in rows:
-                    if "__CDMA_REG_INFO__" in row:
-                        reg_count += 1
-                    if "\t" in row and reg_count > 0:
-                        attr = row.split(': ')[0][1:]
-                        field_set.add(attr)
-                reg_count = 0
-                field_list = list(field_set) if len(field_set) >= len(self.columns) else self.columns
-                reg_dict = dict.fromkeys(field_list, '')
-                idx = 0
-                for row in rows:
-                    if "__CHIP_ARCH_ARGS__" in row:
-                        self.chip_arch_dict = dict()
-                    elif "__CDMA_REG_INFO__" in row:
-                        reg_count += 1
-                        if idx != 0:
-                            layer_id_name = ['-', '-']
-                            reg_dict['Layer Id'] = layer_id_name[0]
-                            reg_dict['Layer Name'] = layer_id_name[1]
-                            self.reg_list.append(reg_dict)
-                        reg_dict = dict.fromkeys(field_list, '')
-                    elif reg_count == 0:
-                        fields = row.split(': ')
-                        attr = fields[0][1:]
-                        val = fields[1][:-1]
-                        self.chip_arch_dict[attr] = val
-                        idx = 0
-                    else:
-                        fields = row.split(': ')
-                        attr = fields[0][1:]
-                        val = fields[1][:-1]
-                        if val.isnumeric() and 'burst' not in attr.lower() and 'width' not in attr.lower():
-                            val = int(val)
-                        reg_dict[attr] = val
-                        idx += 1
-                self.reg_list.append(reg_dict)
-        self.height = len(self.reg_list)
+            self.chip_arch_dict, self.reg_df = read_reg_info(reg_info_file, "__CDMA_REG_INFO__", self.columns,
+                                                             cdma_reg_values)
+            set_layer_info(self.reg_df, {})
+        self.height = len(self.reg_df)
         return self.chip_arch_dict
 
     @classmethod
@@ -10,18 +10,20 @@ from openpyxl import load_workbook
 class InstrWorld(object):
     sheet_name = 'Instr World'
 
-    def __init__(self, reg_list, columns, writer, split=False):
+    def __init__(self, reg_df, columns, writer, split=False, table_writer=None):
         """
         Initial an instr world object, equals to the instr world sheet in Excel.
-        :param reg_list: the list containing all engine registers information
+        :param reg_df: the frame containing all engine registers information
         :param columns: the union of all engine columns
         :param writer: the writer of output Excel to write
         :param split: whether generate a csv separately for instr world instead of putting it in Excel as a sheet
+        :param table_writer: a TableWriter to write instr world to instead, if not None
         """
-        self.reg_list = reg_list
+        self.reg_df = reg_df
         self.columns = columns
         self.writer = writer
         self.split = split
+        self.table_writer = table_writer
         self.index = 1
 
     def write(self, out_file):
@@ -30,8 +32,10 @@ class InstrWorld(object):
         :param out_file: the output Excel file path
         :return: None
         """
-        df = pd.DataFrame(self.reg_list, columns=self.columns, index=None)
-        if self.split:
+        df = self.reg_df[self.columns]
+        if self.table_writer is not None:
+            self.table_writer.write(df, self.sheet_name)
+        elif self.split:
             out_file = out_file.replace('xlsx', "csv")
             df.to_csv(out_file, index=False)
         else:
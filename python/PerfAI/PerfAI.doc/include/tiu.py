@@ -3,6 +3,7 @@
 # @Time    : 2023/7/18 10:39
 # @Author  : chongqing.zeng@sophgo.com
 # @Project : PerfAI
+import numpy as np
 import pandas as pd
 from openpyxl import load_workbook
 from openpyxl.utils import get_column_letter
@@ -12,6 +13,10 @@ from utils.utils import *
 from definition.style import *
 
 
+def tiu_reg_values(attr, values):
+    return [int(val) if val.isnumeric() else val for val in values]
+
+
 class TiuNode:
     def __init__(self, reg):
         self.alg_ops = int(reg['Alg Ops'])
@@ -34,6 +39,7 @@ class Tiu(object):
         :param writer: the writer of Excel to write
         """
         self.writer = writer
+        self.table_writer = None
         self.columns = ['Engine Id', 'Core Id', 'Cmd Id', 'Layer Id', 'Layer Name', 'Function Type', 'Function Name',
                         'Alg Cycle', 'Asic Cycle', 'Start Cycle', 'End Cycle', 'Avg Cycle Last 200', 'Alg Ops',
                         'uArch Ops', 'uArch Rate', 'Bank Conflict Ratio',
@@ -58,7 +64,7 @@ class Tiu(object):
                         'des_short_res0_str', 'des_short_opd1_str', 'des_sym_range', 'des_opt_rq', 'des_op_code',
                         'des_opt_kernel_rotate', 'des_res_op_x_str', 'des_res_op_y_str', 'des_opd0_x_ins0',
                         'des_tsk_opd_num', 'des_opd0_dn_pad', 'des_intr_en', 'des_opt_relu', 'des_pwr_step', 'Msg Id', 'Sd\Wt Count']
-        self.reg_list = []
+        self.reg_df = pd.DataFrame(columns=self.columns)
         self.perf_dict = dict()
         self.stati_list = []
         self.core_id = str(core_id)
@@ -119,66 +125,24 @@ class Tiu(object):
         """
         chip_arch_dict = None
         if os.path.exists(reg_info_file) and os.path.getsize(reg_info_file) != 0:
-            with open(reg_info_file) as f:
-                rows = f.readlines()
-                field_set = set()
-                reg_count = 0
-                for row in rows:
-                    if "__TIU_REG_INFO__" in row:
-                        reg_count += 1
-                    if "\t" in row and reg_count > 0:
-                        attr = row.split(': ')[0][1:]
-                        field_set.add(attr)
-                reg_count = 0
-                field_list = list(field_set) if len(field_set) >= len(self.columns) else self.columns
-                reg_dict = dict.fromkeys(field_list, '')
-                idx = 0
-                for row in rows:
-                    if "__CHIP_ARCH_ARGS__" in row:
-                        chip_arch_dict = dict()
-                    if "__TIU_REG_INFO__" in row:
-                        reg_count += 1
-                        if idx != 0:
-                            k = int(reg_dict['Cmd Id'])
-                            if k in tiu_layer_map.keys():
-                                layer_id_name = tiu_layer_map[k]
-                            else:
-                                layer_id_name = ['-', '-']
-                            reg_dict['Layer Id'] = layer_id_name[0]
-                            reg_dict['Layer Name'] = layer_id_name[1]
-                            self.reg_list.append(reg_dict)
-                        reg_dict = dict.fromkeys(field_list, '')
-                    elif "\t" not in row:
-                        reg_dict['Function Type'] = row[:-2]
-                    elif reg_count == 0:
-                        fields = row.split(': ')
-                        attr = fields[0][1:]
-                        val = fields[1][:-1]
-                        chip_arch_dict[attr] = val
-                        idx = 0
-                    else:
-                        fields = row.split(': ')
-                        attr = fields[0][1:]
-                        val = fields[1][:-1]
-                        val = int(val) if val.isnumeric() else val
-                        reg_dict[attr] = val
-                        idx += 1
-                if 'Platform' not in chip_arch_dict.keys():
-                    chip_arch_dict['Platform'] = 'pmu'
-                self.reg_list.append(reg_dict)
-                self.detail_spec = {
-                    'Platform': [chip_arch_dict['Platform']],
-                    'CHIP ARCH': [chip_arch_dict['Chip Arch']],
-                    'Core Num': [chip_arch_dict['Core Num']],
-                    'NPU Num': [chip_arch_dict['NPU Num']],
-                    'Cube IC Align(8bits)': [chip_arch_dict['Cube IC Align(8bits)']],
-                    'Cube OHOW Align': [chip_arch_dict['Cube OHOW Align']],
-                    'Vector OHOW Align(8bits)': [chip_arch_dict['Vector OHOW Align(8bits)']],
-                    'TIU Frequency(MHz)': [chip_arch_dict['TIU Frequency(MHz)']],
-                    'DMA Frequency(MHz)': [chip_arch_dict['DMA Frequency(MHz)']],
-                    'DDR Frequency(MHz)': [chip_arch_dict['DDR Frequency']],
-                    'TPU Lmem Size': [chip_arch_dict['Tpu Lmem Size']]}
-        self.height = len(self.reg_list)
+            chip_arch_dict, self.reg_df = read_reg_info(reg_info_file, "__TIU_REG_INFO__", self.columns,
+                                                        tiu_reg_values)
+            set_layer_info(self.reg_df, tiu_layer_map)
+            if 'Platform' not in chip_arch_dict.keys():
+                chip_arch_dict['Platform'] = 'pmu'
+            self.detail_spec = {
+                'Platform': [chip_arch_dict['Platform']],
+                'CHIP ARCH': [chip_arch_dict['Chip Arch']],
+                'Core Num': [chip_arch_dict['Core Num']],
+                'NPU Num': [chip_arch_dict['NPU Num']],
+                'Cube IC Align(8bits)': [chip_arch_dict['Cube IC Align(8bits)']],
+                'Cube OHOW Align': [chip_arch_dict['Cube OHOW Align']],
+                'Vector OHOW Align(8bits)': [chip_arch_dict['Vector OHOW Align(8bits)']],
+                'TIU Frequency(MHz)': [chip_arch_dict['TIU Frequency(MHz)']],
+                'DMA Frequency(MHz)': [chip_arch_dict['DMA Frequency(MHz)']],
+                'DDR Frequency(MHz)': [chip_arch_dict['DDR Frequency']],
+                'TPU Lmem Size': [chip_arch_dict['Tpu Lmem Size']]}
+        self.height = len(self.reg_df)
         self.chip_arch_dict = chip_arch_dict
         return chip_arch_dict
 
@@ -187,58 +151,57 @@ class Tiu(object):
         Add some indicators which are convenient for performance analysis artificially.
         :return: None
         """
-        for i in range(len(self.reg_list)):
-            reg_dict = self.reg_list[i]
+        reg_df = self.reg_df
+        if len(reg_df) > 0:
             continous_gap = 200
-            if i < continous_gap - 1:
-                reg_dict['Avg Cycle Last 200'] = round(int(reg_dict['End Cycle']) / int(reg_dict['Cmd Id']))
-            else:
-                reg_dict['Avg Cycle Last 200'] = round((reg_dict['End Cycle'] - self.reg_list[i-199]['Start Cycle']) / continous_gap)
-            if not (reg_dict['des_tsk_typ'] == 15 and reg_dict['des_tsk_eu_typ'] == 9):
-                # wait msg time do not add to tiu cycles
-                self.tiu_cycle += int(reg_dict['Asic Cycle'])
-            self.alg_total_cycle += int(reg_dict['Alg Cycle'])
-            self.alg_total_ops += int(reg_dict['Alg Ops'])
-            self.uArch_total_ops += int(reg_dict['uArch Ops'])
-            if isinstance(reg_dict['des_opt_opd0_prec'], int):
-                reg_dict['Data Type'] = data_type_dict[reg_dict['des_opt_opd0_prec']] + \
-                                        ' -> ' + data_type_dict[reg_dict['des_opt_res0_prec']]
-            else:
-                reg_dict['Data Type'] = data_type_dict[reg_dict['des_opt_res0_prec']] + \
-                                        ' -> ' + data_type_dict[reg_dict['des_opt_res0_prec']]
-            if int(reg_dict['des_tsk_typ']) == 15 and int(reg_dict['des_tsk_eu_typ']) == 9:
-                self.wait_msg_time += int(reg_dict['Asic Cycle'])
-            self.start_time = min(self.start_time, get_time_by_cycle(reg_dict['Start Cycle'], self.chip_arch_dict['TIU Frequency(MHz)']))
-            self.end_time = max(self.start_time, get_time_by_cycle(reg_dict['End Cycle'], self.chip_arch_dict['TIU Frequency(MHz)']))
-            if reg_dict['Function Type'] not in self.perf_dict.keys():
-                func_dict = {
-                    'Function Name': reg_dict['Function Type'],
-                    'Instr Num': 1,
-                    'Alg Ops': int(reg_dict['Alg Ops']),
+            start_cycle = reg_df['Start Cycle'].astype(int).values
+            end_cycle = reg_df['End Cycle'].astype(int).values
+            asic_cycle = reg_df['Asic Cycle'].astype(int).values
+            avg_cycle = end_cycle / reg_df['Cmd Id'].astype(int).values
+            # from the start of the command 199 before
+            gap_start = start_cycle[:max(len(reg_df) - continous_gap + 1, 0)]
+            avg_cycle[continous_gap - 1:] = (end_cycle[continous_gap - 1:] - gap_start) / continous_gap
+            reg_df['Avg Cycle Last 200'] = np.round(avg_cycle).astype(int)
+            wait_msg = ((reg_df['des_tsk_typ'] == 15) & (reg_df['des_tsk_eu_typ'] == 9)).values
+            # wait msg time do not add to tiu cycles
+            self.tiu_cycle += int(asic_cycle[~wait_msg].sum())
+            self.wait_msg_time += int(asic_cycle[wait_msg].sum())
+            self.alg_total_cycle += int(reg_df['Alg Cycle'].astype(int).sum())
+            self.alg_total_ops += int(reg_df['Alg Ops'].astype(int).sum())
+            self.uArch_total_ops += int(reg_df['uArch Ops'].astype(int).sum())
+            reg_df['Data Type'] = [
+                data_type_dict[opd0 if isinstance(opd0, int) else res0] + ' -> ' + data_type_dict[res0]
+                for opd0, res0 in zip(reg_df['des_opt_opd0_prec'], reg_df['des_opt_res0_prec'])]
+            frequency = int(self.chip_arch_dict['TIU Frequency(MHz)'])
+            self.start_time = min(self.start_time, int((start_cycle / frequency * 1000).astype(int).min()))
+            self.end_time = max(self.start_time, get_time_by_cycle(end_cycle[-1], frequency))
+            func_df = pd.DataFrame({
+                'Function Type': reg_df['Function Type'].values,
+                'Alg Ops': reg_df['Alg Ops'].astype(int).values,
+                'Alg Cycle': reg_df['Alg Cycle'].astype(int).values,
+                'uArch Ops': reg_df['uArch Ops'].astype(int).values,
+                'Asic Cycle': asic_cycle})
+            func_sum = func_df.groupby('Function Type', sort=False).agg(['size', 'sum'])
+            for func_type, func in func_sum.iterrows():
+                self.perf_dict[func_type] = {
+                    'Function Name': func_type,
+                    'Instr Num': int(func['Alg Ops', 'size']),
+                    'Alg Ops': int(func['Alg Ops', 'sum']),
                     'Alg Ops Ratio': 0,
-                    'Alg Cycle': int(reg_dict['Alg Cycle']),
+                    'Alg Cycle': int(func['Alg Cycle', 'sum']),
                     'Alg Cycle Ratio': 0,
-                    'uArch Ops': int(reg_dict['uArch Ops']),
+                    'uArch Ops': int(func['uArch Ops', 'sum']),
                     'uArch URate': 0,
                     'uArch Ops Ratio': 0,
-                    'Asic Cycle': int(reg_dict['Asic Cycle']),
+                    'Asic Cycle': int(func['Asic Cycle', 'sum']),
                     'Asic Cycle Ratio': 0
                 }
-                self.perf_dict[reg_dict['Function Type']] = func_dict
-            else:
-                func_dict = self.perf_dict[reg_dict['Function Type']]
-                func_dict['Instr Num'] += 1
-                func_dict['Alg Ops'] += int(reg_dict['Alg Ops'])
-                func_dict['uArch Ops'] += int(reg_dict['uArch Ops'])
-                func_dict['Alg Cycle'] += int(reg_dict['Alg Cycle'])
-                func_dict['Asic Cycle'] += int(reg_dict['Asic Cycle'])
-                self.perf_dict[reg_dict['Function Type']] = func_dict
-            self.total_instr += 1
+            self.total_instr += len(reg_df)
         self.tiu_time = get_time_by_cycle(self.tiu_cycle, self.chip_arch_dict['TIU Frequency(MHz)']) if self.chip_arch_dict else 0
 
     def pop_data(self):
         tiu_instance_map = dict()
-        for reg in self.reg_list:
+        for reg in self.reg_df.to_dict('records'):
             tiu_instance_map[int(reg['Cmd Id'])] = TiuNode(reg)
         return tiu_instance_map
 
@@ -247,13 +210,12 @@ class Tiu(object):
         Write register information and kpi field to Excel.
         :return: None
         """
-        df = pd.DataFrame(self.reg_list)
         new_cols = []
         for col in self.columns:
-            if col in df.columns.values.tolist():
+            if col in self.reg_df.columns:
                 new_cols.append(col)
         self.columns = new_cols
-        df = df[self.columns]
+        df = self.reg_df[self.columns].copy()
         for col in self.columns:
             if 'addr' in col or 'mask' in col:
                 df[col] = int2Hex(df[col].values)
@@ -308,9 +270,12 @@ class Tiu(object):
             pd.DataFrame(self.stati_list).to_excel(self.writer, index=False, sheet_name=self.sheet_name, startrow=5,
                                                    startcol=1,
                                                    engine='xlsxwriter', float_format='%g')
-            pd.DataFrame(df).to_excel(self.writer, index=False, sheet_name=self.sheet_name,
-                                      startrow=content_start_rows, startcol=0,
-                                      engine='xlsxwriter', float_format='%g')
+            if self.table_writer is not None:
+                self.table_writer.write(df, self.sheet_name)
+            else:
+                pd.DataFrame(df).to_excel(self.writer, index=False, sheet_name=self.sheet_name,
+                                          startrow=content_start_rows, startcol=0,
+                                          engine='xlsxwriter', float_format='%g')
 
     @classmethod
     def set_style(cls, file_path, core_id, frozen=False):
@@ -14,24 +14,29 @@ from src.generator.layer import generate_layer
 from src.generator.style import set_details_style, set_summary_style, set_layer_style, set_sim_summary_style
 from src.generator.summary import generate_summary
 from src.parser.global_profile_parser import GlobalProfileParser
+from utils.utils import TableWriter
 
-def run_doc(input, cores, output="PerAI_output.xlsx", style=0, speedup=1, split=0):
+def run_doc(input, cores, output="PerAI_output.xlsx", style=0, speedup=1, split=0, jobs=0, format='xlsx'):
     input_fold = input if input[-1] == '/' else input + '/'
     out_file = output if '/' in output else input_fold + output
+    # register tables in csv or parquet files, the Excel keeps the summaries
+    table_writer = TableWriter(os.path.join(input_fold, 'PerfDoc'), format) if format != 'xlsx' else None
     parser = GlobalProfileParser()
     global_info = parser.parse(input_fold)
     # PerfAI.doc do not support showing layer info without global.profile
     network = global_info.net_name if global_info and global_info.net_name else '--'
     with pd.ExcelWriter(out_file) as writer:
         tiu_instance_map, gdma_instance_map, chip_arch = generate_details(input_fold, out_file, global_info, writer,
-                                                            core_num=cores, split_instr_world=speedup)
+                                                            core_num=cores, split_instr_world=speedup, jobs=jobs,
+                                                            table_writer=table_writer)
         chip_arch['network'] = network
         if global_info is not None:
             layer_info_map = generate_layer(global_info, writer, out_file, tiu_instance_map, gdma_instance_map, chip_arch)
             generate_summary(layer_info_map, writer, chip_arch)
     if style:
         print('Setting style for ' + out_file)
-        set_details_style(out_file, cores, chip_arch)
+        if table_writer is None:
+            set_details_style(out_file, cores, chip_arch)
         set_sim_summary_style(out_file, cores, chip_arch)
         if global_info is not None:
             set_summary_style(out_file)
@@ -107,5 +112,19 @@ if __name__ == "__main__":
         default=0,
         help="If separate the sheets to different excels, which will reduce the size of output.",
     )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=0,
+        help="The number of processes loading the cores, 0 for the cpu count.",
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        default="xlsx",
+        choices=["xlsx"] + list(TableWriter.formats),
+        help="The format of the register tables and instr world, csv or parquet files are written to PerfDoc "
+             "and much faster than the Excel sheets.",
+    )
     args = parser.parse_args()
-    run_doc(args.input, args.cores, args.output, args.style, args.speedup, args.split)
\ No newline at end of file
+    run_doc(args.input, args.cores, args.output, args.style, args.speedup, args.split, args.jobs, args.format)
\ No newline at end of file
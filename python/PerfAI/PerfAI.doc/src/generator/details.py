@@ -4,6 +4,9 @@
 # @Author  : chongqing.zeng@sophgo.com
 # @Project: PerfAI
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 import pandas as pd
 from tqdm import tqdm
 
@@ -11,7 +14,7 @@ from include.dma import Gdma, Sdma, Cdma
 from include.instr_world import InstrWorld
 from include.asic_summary import AsicSummary
 from include.tiu import Tiu
-from utils.utils import get_instr_cols, get_instr_reg_list, get_active_cores
+from utils.utils import get_instr_cols, get_instr_reg_df, get_active_cores
 from include.summary import GlobalInfo
 
 
@@ -51,7 +54,46 @@ def get_engine_layer(g_info):
     return tiu_layer_map, gdma_layer_map
 
 
-def generate_details(input_fold, out_file, g_info, writer, core_num=8, split_instr_world=False):
+def load_core(input_fold, core_id, tiu_layer_map, gdma_layer_map):
+    """
+    Load the engines of a core and add their kpi fields, the instances have no writer, they are written by
+    the caller in the order of cores.
+    :return: the tiu, gdma, sdma and cdma instances, and the chip arch of the core
+    """
+    # tiu
+    tiu_instance = Tiu(core_id, None)
+    chip_arch = tiu_instance.load(input_fold + 'tiuRegInfo_' + str(core_id) + '.txt', tiu_layer_map)
+    tiu_instance.add_kpi_field()
+    # gdma
+    cur_dma_reg_file = input_fold + 'tdmaRegInfo_' + str(core_id) + '.txt'
+    gdma_instance = Gdma(core_id, None, 'GDMA')
+    # gdma and sdma registers are in the same file
+    dma_reg_info = gdma_instance.read(cur_dma_reg_file, gdma_layer_map)
+    tmp_chip_arch = gdma_instance.load(cur_dma_reg_file, gdma_layer_map, dma_reg_info)
+    chip_arch = chip_arch if chip_arch else tmp_chip_arch
+    gdma_instance.add_kpi_field()
+    # sdma
+    sdma_instance = Sdma(core_id, None, 'SDMA')
+    sdma_instance.load(cur_dma_reg_file, gdma_layer_map, dma_reg_info)
+    sdma_instance.add_kpi_field()
+    # cdma
+    cdma_instance = Cdma(core_id, None, 'CDMA')
+    cur_cdma_reg_file = input_fold + 'cdmaRegInfo_' + str(core_id) + '.txt'
+    if os.path.exists(cur_cdma_reg_file) and os.path.getsize(cur_cdma_reg_file):
+        tmp_chip_arch = cdma_instance.load(cur_cdma_reg_file)
+        chip_arch = chip_arch if chip_arch else tmp_chip_arch
+        cdma_instance.add_kpi_field()
+    return tiu_instance, gdma_instance, sdma_instance, cdma_instance, chip_arch
+
+
+def generate_details(input_fold, out_file, g_info, writer, core_num=8, split_instr_world=False, jobs=1,
+                     table_writer=None):
+    """
+    Write the engine sheets of all the cores, the instr world and the engine summary.
+    :param jobs: the number of processes loading the cores, 0 for the cpu count
+    :param table_writer: a TableWriter writing the register tables and the instr world to csv or parquet
+        files, instead of the Excel
+    """
     tiu_reg_file = 'tiuRegInfo'
     dma_reg_file = 'tdmaRegInfo'
     cdma_reg_file = 'cdmaRegInfo'
@@ -66,59 +108,45 @@ def generate_details(input_fold, out_file, g_info, writer, core_num=8, split_ins
         print('Error, No engine reg info file input! Please check your input.')
         exit(-1)
     print('Generating data for ' + out_file)
+    split_instr_world = split_instr_world or table_writer is not None
     palace_holder(writer, split_instr_world, g_info)
-    instr_cols, instr_reg_list, reg_list = [], [], []
+    instr_cols, reg_dfs = [], []
     tiu_instances, gdma_instances, sdma_instances, cdma_instances = [], [], [], []
     tiu_instance_map, gdma_instance_map = dict(), dict()
     tiu_layer_map, gdma_layer_map = get_engine_layer(g_info)
     chip_arch_act = None
-    for core_id in tqdm(range(act_core_num)):
-        # tiu
-        cur_tiu_reg_file = tiu_reg_file + '_' + str(core_id) + '.txt'
-        tiu_instance = Tiu(core_id, writer)
-        chip_arch = tiu_instance.load(cur_tiu_reg_file, tiu_layer_map)
+    jobs = min(jobs if jobs > 0 else os.cpu_count() or 1, act_core_num)
+    load = partial(load_core, input_fold, tiu_layer_map=tiu_layer_map, gdma_layer_map=gdma_layer_map)
+    if jobs > 1:
+        pool = ProcessPoolExecutor(max_workers=jobs)
+        cores = pool.map(load, range(act_core_num))
+    else:
+        pool = None
+        cores = map(load, range(act_core_num))
+    # the sheets are written in the order of cores, as soon as their core is loaded
+    for core_id, core in enumerate(tqdm(cores, total=act_core_num)):
+        tiu_instance, gdma_instance, sdma_instance, cdma_instance, chip_arch = core
         chip_arch_act = chip_arch_act if chip_arch_act else chip_arch
-        tiu_instance.add_kpi_field()
-        tiu_instance.write()
-        if str(core_id) == '0':
+        for instance in core[:4]:
+            instance.writer = writer
+            instance.table_writer = table_writer
+            instance.write()
+        if core_id == 0:
             tiu_instance_map = tiu_instance.pop_data()
-        # gdma
-        cur_dma_reg_file = dma_reg_file + '_' + str(core_id) + '.txt'
-        gdma_instance = Gdma(core_id, writer, 'GDMA')
-        tmp_chip_arch = gdma_instance.load(cur_dma_reg_file, gdma_layer_map)
-        chip_arch_act = chip_arch_act if chip_arch_act else tmp_chip_arch
-        gdma_instance.add_kpi_field()
-        gdma_instance.write()
-        if str(core_id) == '0':
             gdma_instance_map = gdma_instance.pop_data()
-        # sdma
-        cur_dma_reg_file = dma_reg_file + '_' + str(core_id) + '.txt'
-        sdma_instance = Sdma(core_id, writer, 'SDMA')
-        sdma_instance.load(cur_dma_reg_file, gdma_layer_map)
-        sdma_instance.add_kpi_field()
-        sdma_instance.write()
-        # cdma
-        cdma_instance = Cdma(core_id, writer, 'CDMA')
-        if act_core_num:
-            cur_cdma_reg_file = cdma_reg_file + '_' + str(core_id) + '.txt'
-            if os.path.exists(cur_cdma_reg_file) and os.path.getsize(cur_cdma_reg_file):
-                tmp_chip_arch = cdma_instance.load(cur_cdma_reg_file)
-                chip_arch_act = chip_arch_act if chip_arch_act else tmp_chip_arch
-                cdma_instance.add_kpi_field()
-                cdma_instance.write()
-            reg_list += tiu_instance.reg_list + gdma_instance.reg_list + sdma_instance.reg_list + cdma_instance.reg_list
-        else:
-            reg_list += tiu_instance.reg_list + gdma_instance.reg_list + sdma_instance.reg_list
+        reg_dfs += [tiu_instance.reg_df, gdma_instance.reg_df, sdma_instance.reg_df, cdma_instance.reg_df]
         instr_cols = get_instr_cols(tiu_instance.columns, gdma_instance.columns)
         tiu_instances.append(tiu_instance)
         gdma_instances.append(gdma_instance)
         sdma_instances.append(sdma_instance)
         cdma_instances.append(cdma_instance)
+    if pool is not None:
+        pool.shutdown()
 
     if act_core_num:
         # instr world
-        instr_reg_list = get_instr_reg_list(reg_list, instr_cols)
-        instr_instance = InstrWorld(instr_reg_list, instr_cols, writer, split_instr_world)
+        instr_reg_df = get_instr_reg_df(reg_dfs, instr_cols)
+        instr_instance = InstrWorld(instr_reg_df, instr_cols, writer, split_instr_world, table_writer)
         instr_instance.write(out_file)
         # summary
         summary_instance = AsicSummary(writer, tiu_instances, gdma_instances, sdma_instances, cdma_instances, act_core_num)
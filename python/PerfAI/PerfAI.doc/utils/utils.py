@@ -10,6 +10,9 @@ import sys
 import math
 from decimal import Decimal
 
+import numpy as np
+import pandas as pd
+
 from definition.bm1684x_defs import dma_func_name_dict, DataType
 
 
@@ -54,6 +57,104 @@ def get_active_cores(file_prefix, core_num):
     return active_core_num
 
 
+def set_reg_value(field_dict, attr, reg_num, val):
+    # the field of the last register, the registers before without the field have ''
+    values = field_dict.setdefault(attr, [])
+    if len(values) == reg_num:
+        values[-1] = val
+    else:
+        values.extend([''] * (reg_num - 1 - len(values)))
+        values.append(val)
+
+
+def read_reg_info(reg_info_file, reg_tag, columns, convert=None):
+    """
+    Read a register info file of TPUPerf in one pass, into the columns of a frame.
+    :param reg_info_file: file records register information, usually obtained by TPUPerf
+    :param reg_tag: the row starting a register, such as __TIU_REG_INFO__
+    :param columns: the fields every register has, if the file has fewer fields
+    :param convert: convert(attr, values) gives the column of a register field, the strings by default
+    :return: the chip arch dict, None without __CHIP_ARCH_ARGS__, and the register frame, a row per register
+    """
+    chip_arch_dict = None
+    # field name -> values in order of registers
+    field_dict = dict()
+    # a register is added with its first field
+    reg_num = 0
+    new_reg = False
+    func_type = None
+    with open(reg_info_file) as f:
+        for row in f:
+            if "\t" in row:
+                fields = row.split(': ')
+                attr = fields[0][1:]
+                val = fields[1][:-1]
+                if new_reg:
+                    # registers without fields are dropped
+                    reg_num += 1
+                    new_reg = False
+                    if func_type is not None:
+                        set_reg_value(field_dict, 'Function Type', reg_num, func_type)
+                elif reg_num == 0:
+                    chip_arch_dict[attr] = val
+                    continue
+                values = field_dict.get(attr)
+                if values is not None and len(values) == reg_num - 1:
+                    values.append(val)
+                else:
+                    set_reg_value(field_dict, attr, reg_num, val)
+            elif "__CHIP_ARCH_ARGS__" in row:
+                chip_arch_dict = dict()
+            elif reg_tag in row:
+                new_reg = True
+                func_type = None
+            elif new_reg:
+                # function type of a tiu register
+                func_type = row[:-2]
+            elif reg_num > 0:
+                set_reg_value(field_dict, 'Function Type', reg_num, row[:-2])
+    if len(field_dict) < len(columns):
+        for attr in columns:
+            field_dict.setdefault(attr, [])
+    for attr, values in field_dict.items():
+        values.extend([''] * (reg_num - len(values)))
+        if convert:
+            field_dict[attr] = convert(attr, values)
+    return chip_arch_dict, pd.DataFrame(field_dict)
+
+
+def set_layer_info(reg_df, layer_map):
+    layers = [layer_map.get(int(cmd_id), ['-', '-']) for cmd_id in reg_df['Cmd Id']]
+    reg_df['Layer Id'] = [layer[0] for layer in layers]
+    reg_df['Layer Name'] = [layer[1] for layer in layers]
+
+
+class TableWriter(object):
+    formats = ('csv', 'parquet')
+
+    def __init__(self, out_dir, fmt='csv'):
+        """
+        Write the register tables of the engines and the instr world to csv or parquet files,
+        one per sheet, instead of writing them to the Excel, which is the slow part of a report.
+        :param out_dir: the directory of the files
+        :param fmt: csv or parquet, parquet needs pyarrow
+        """
+        assert fmt in self.formats, fmt
+        self.out_dir = out_dir
+        self.fmt = fmt
+        os.makedirs(out_dir, exist_ok=True)
+
+    def write(self, df, sheet_name):
+        out_file = os.path.join(self.out_dir, sheet_name + '.' + self.fmt)
+        if self.fmt == 'parquet':
+            # columns mixing numbers and strings, such as the '' of missing fields
+            mixed = [col for col in df.columns if df[col].dtype == object]
+            df.astype({col: str for col in mixed}).to_parquet(out_file, index=False)
+        else:
+            df.to_csv(out_file, index=False)
+        return out_file
+
+
 def int2Hex(data_list):
     new_data_list = []
     for data in data_list:
@@ -173,15 +274,14 @@ def get_instr_cols(tiu_cols, dma_cols):
     return tiu_cols
 
 
-def get_instr_reg_list(reg_list, reg_cols):
-    instr_reg_list = []
-    for reg_dict in reg_list:
-        total_ref_dict = dict.fromkeys(reg_cols, '')
-        total_ref_dict.update(reg_dict)
-        instr_reg_list.append(total_ref_dict)
-    instr_reg_list.sort(
-        key=lambda x: (int(x['Start Cycle']), int(x['End Cycle']), int(x['Cmd Id']), int(x['Engine Id'])))
-    return instr_reg_list
+def get_instr_reg_df(reg_dfs, reg_cols):
+    instr_reg_df = pd.concat([reg_df.reindex(columns=reg_cols, fill_value='') for reg_df in reg_dfs],
+                             ignore_index=True)
+    if len(instr_reg_df) == 0:
+        return instr_reg_df
+    # sorted by start cycle, end cycle, cmd id and engine id, the order of cores for the same keys
+    keys = [instr_reg_df[col].astype(int).values for col in ['Engine Id', 'Cmd Id', 'End Cycle', 'Start Cycle']]
+    return instr_reg_df.take(np.lexsort(keys)).reset_index(drop=True)
 
 
 def load_module(filename, name=None):
@@ -165,29 +165,20 @@ class TIU:
             ['des_opd1_n', 'des_opd1_c', 'des_opd1_h', 'des_opd1_w', 'des_opt_opd1_prec', 'des_opd1_size']
         ]
         # 初始化新列
-        for _, _, _, _, _, new_col in groups:
-            tiuDf[new_col] = None
-        for idx, row in tiuDf.iterrows():
-            for n_col, c_col, h_col, w_col, prec_col, new_col in groups:
-                if prec_col not in tiuDf.columns or row[prec_col] not in data_size_dict:
-                    continue
-                byte_size = data_size_dict[row[prec_col]]
-                factors = []
-                for col in [n_col, c_col, h_col, w_col]:
-                    if col not in tiuDf.columns or row[col] in ['','0']:
+        columns = tiuDf.columns
+        for n_col, c_col, h_col, w_col, prec_col, new_col in groups:
+            sizes = [None] * len(tiuDf)
+            if prec_col in columns:
+                dims = [tiuDf[col].tolist() for col in [n_col, c_col, h_col, w_col] if col in columns]
+                for i, prec in enumerate(tiuDf[prec_col].tolist()):
+                    if prec not in data_size_dict:
                         continue
-                    val = pd.to_numeric(row[col])
-                    # if col == c_col:
-                    #     # print("col, c_col, val:", col, c_col, val)
-                    #     if val <= 64:
-                    #         val /= val
-                    #     else:
-                    #         val /= lane_num
-                    factors.append(val)
-                if not factors:
-                    continue
-                result = byte_size
-                for factor in factors:
-                    result *= factor
-                tiuDf.at[idx, new_col] = result
+                    factors = [pd.to_numeric(dim[i]) for dim in dims if dim[i] not in ['', '0']]
+                    if not factors:
+                        continue
+                    result = data_size_dict[prec]
+                    for factor in factors:
+                        result *= factor
+                    sizes[i] = result
+            tiuDf[new_col] = pd.Series(sizes, index=tiuDf.index, dtype=object)
         return tiuDf
\ No newline at end of file
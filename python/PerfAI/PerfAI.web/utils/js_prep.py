@@ -1,3 +1,4 @@
+import json
 import pandas as pd
 from decimal import Decimal
 from numpy import transpose
@@ -98,16 +99,15 @@ def generate_jsfile(dirpath, name, out_path):
         js.write(f'let lmem_partition = {lmem_partition}\n')
         js.write(f'let time_header = {time_header}\n')
         for lmem_op in lmem_op_dict.keys():
-            js_content = ""
-            for i, sublist in enumerate(lmem_op_dict[lmem_op]):
-                js_content += f"{sublist},\n"
-            js.write(f'window.{lmem_op} = [{js_content}]\n')
+            js.write(f'window.{lmem_op} = {records_to_json(lmem_op_dict[lmem_op])}\n')
 
         for keyname in cycle_data_dict.keys():
-            js_content = ""
-            for i, sublist in enumerate(cycle_data_dict[keyname]):
-                js_content += f"{sublist},\n"
-            js.write(f'window.{keyname} = [{js_content}]\n')
+            js.write(f'window.{keyname} = {records_to_json(cycle_data_dict[keyname])}\n')
+
+def records_to_json(records):
+    # a record per line, numpy scalars as numbers
+    return "[" + "".join(json.dumps(record, default=lambda x: x.item() if hasattr(x, 'item') else str(x)) + ",\n"
+                         for record in records) + "]"
 
 def generate_partition(lmem_size, lane_num, type_name):
     partition = []
@@ -160,63 +160,65 @@ def process_data(type, data, idx, ip_type, bwlist, lane_num, cycle_data_dict, lm
     lmem_temp = []
     if 'Bandwidth(GB/s)' in data:
         data['Bandwidth(GB/s)'] = data['Bandwidth(GB/s)'].apply(lambda x: str(x) if isinstance(x, Decimal) else x)
+    # the columns as lists, indexing a frame cell by cell is the slow part
+    col = {c: data[c].tolist() for c in data.columns}
     for i in range(len(data)):
-        uarch_rate = pd.to_numeric(data['uArch Rate'][i][:-1]) if 'uArch Rate' in data.columns else None
-        cmd = int(data['Cmd Id'][i])
-        if 'Bandwidth(GB/s)' in data:
-            if 'L2M' in data['Direction'][i]:
-                height = round(pd.to_numeric(data['Bandwidth(GB/s)'][i]) / bwlist[1], 2)
+        uarch_rate = pd.to_numeric(col['uArch Rate'][i][:-1]) if 'uArch Rate' in col else None
+        cmd = int(col['Cmd Id'][i])
+        if 'Bandwidth(GB/s)' in col:
+            if 'L2M' in col['Direction'][i]:
+                height = round(pd.to_numeric(col['Bandwidth(GB/s)'][i]) / bwlist[1], 2)
             else:
-                height = round(pd.to_numeric(data['Bandwidth(GB/s)'][i]) / bwlist[0], 2)
+                height = round(pd.to_numeric(col['Bandwidth(GB/s)'][i]) / bwlist[0], 2)
         else:
             height = round(uarch_rate/100, 2)
         tmp = [
             ip_type,
-            int(data['Start Cycle'][i]),
-            int(data['End Cycle'][i]),
-            int(data['End Cycle'][i]) - int(data['Start Cycle'][i]),
-            int(data['Stall Cycle'][i]) if 'Stall Cycle' in data and data['Stall Cycle'][i] is not None else '',
-            data['Function Type'][i] if 'Function Type' in data else '',
+            int(col['Start Cycle'][i]),
+            int(col['End Cycle'][i]),
+            int(col['End Cycle'][i]) - int(col['Start Cycle'][i]),
+            int(col['Stall Cycle'][i]) if 'Stall Cycle' in col and col['Stall Cycle'][i] is not None else '',
+            col['Function Type'][i] if 'Function Type' in col else '',
             height,
             cmd,
-            data['Function Name'][i],
-            data['Bandwidth(GB/s)'][i] if 'Bandwidth(GB/s)' in data else data['uArch Rate'][i],
-            data['Data Type'][i],
-            f"Direction:{data['Direction'][i]}" if 'Direction' in data else f"Bank Conflict Ratio:{data['Bank Conflict Ratio'][i]}",
-            data['Msg Id'][i],
-            data['Sd\Wt Count'][i],
+            col['Function Name'][i],
+            col['Bandwidth(GB/s)'][i] if 'Bandwidth(GB/s)' in col else col['uArch Rate'][i],
+            col['Data Type'][i],
+            f"Direction:{col['Direction'][i]}" if 'Direction' in col else f"Bank Conflict Ratio:{col['Bank Conflict Ratio'][i]}",
+            col['Msg Id'][i],
+            col['Sd\Wt Count'][i],
         ]
         cycle_data_dict[f'time_data{idx}'].append(tmp)
 
         ## prepare the data for the mem graph
-        if 'Direction' in data: #
-            direction = data['Direction'][i]
-            src = data['src_start_addr'][i]
-            dst = data['dst_start_addr'][i]
-            datasize = pd.to_numeric(data['DMA data size(B)'][i])
+        if 'Direction' in col: #
+            direction = col['Direction'][i]
+            src = col['src_start_addr'][i]
+            dst = col['dst_start_addr'][i]
+            datasize = pd.to_numeric(col['DMA data size(B)'][i])
             op_type = 0 if direction in read_directions else 1
             if direction in read_directions:
                 size = datasize / lane_num  #c维除以lane_num
-                info = f'dma:cmdId={cmd},physical start addr:{dst}<br>{direction},{data["dst_shape"][i]}'
-                lmem_temp.append([int(data['Start Cycle'][i]), int(data['End Cycle'][i]), op_type, dst, size, info])
+                info = f'dma:cmdId={cmd},physical start addr:{dst}<br>{direction},{col["dst_shape"][i]}'
+                lmem_temp.append([int(col['Start Cycle'][i]), int(col['End Cycle'][i]), op_type, dst, size, info])
             elif direction in write_directions:
                 size = datasize / lane_num #c维除以lane num
-                info = f'dma:cmdId={cmd},physical start addr:{src}<br>{direction},{data["src_shape"][i]}'
-                lmem_temp.append([int(data['Start Cycle'][i]), int(data['End Cycle'][i]), op_type, src, size, info])
+                info = f'dma:cmdId={cmd},physical start addr:{src}<br>{direction},{col["src_shape"][i]}'
+                lmem_temp.append([int(col['Start Cycle'][i]), int(col['End Cycle'][i]), op_type, src, size, info])
         # import pdb; pdb.set_trace()
-        if 'des_res0_c' in data and data['des_res0_c'][i] and int(data['des_res0_c'][i]) < lane_num:
-            worklane = int(data['des_res0_c'][i])
+        if 'des_res0_c' in col and col['des_res0_c'][i] and int(col['des_res0_c'][i]) < lane_num:
+            worklane = int(col['des_res0_c'][i])
         else:
             worklane = lane_num
-        if 'des_res0_size' in data and data['des_res0_size'][i] is not None:
+        if 'des_res0_size' in col and col['des_res0_size'][i] is not None:
             #the memory address reads the result tensor: op=0
-            size = data['des_res0_size'][i] / worklane
-            info = f'tiu:cmdId={cmd},physical start addr:{data["des_res0_addr"][i]}'
-            lmem_temp.append([int(data['Start Cycle'][i]), int(data['End Cycle'][i]), 0, data['des_res0_addr'][i], size, info])
-        if 'des_opd0_size' in data and data['des_opd0_size'][i] is not None:
-            size = (data['des_opd0_size'][i]+data['des_opd1_size'][i] if data['des_opd1_size'][i] is not None else data['des_opd0_size'][i]) / worklane
-            info = f'tiu:cmdId={cmd},physical start addr:{data["des_opd0_addr"][i]}'
-            lmem_temp.append([int(data['Start Cycle'][i]), int(data['End Cycle'][i]), 1, data['des_opd0_addr'][i], size, info])
+            size = col['des_res0_size'][i] / worklane
+            info = f'tiu:cmdId={cmd},physical start addr:{col["des_res0_addr"][i]}'
+            lmem_temp.append([int(col['Start Cycle'][i]), int(col['End Cycle'][i]), 0, col['des_res0_addr'][i], size, info])
+        if 'des_opd0_size' in col and col['des_opd0_size'][i] is not None:
+            size = (col['des_opd0_size'][i]+col['des_opd1_size'][i] if col['des_opd1_size'][i] is not None else col['des_opd0_size'][i]) / worklane
+            info = f'tiu:cmdId={cmd},physical start addr:{col["des_opd0_addr"][i]}'
+            lmem_temp.append([int(col['Start Cycle'][i]), int(col['End Cycle'][i]), 1, col['des_opd0_addr'][i], size, info])
     process_lmem = processAddr(lmem_temp, lane_size) if len(lmem_temp) > 0 else lmem_temp
     lmem_op_dict[f'lmem_op_record{idx}'].extend(process_lmem)
     lmem_op_dict[f'lmem_op_record{idx}'] = deduplicate_ordered_list(lmem_op_dict[f'lmem_op_record{idx}'])
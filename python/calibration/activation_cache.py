@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# ==============================================================================
+#
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+
+import os
+import re
+import time
+import hashlib
+import tempfile
+import numpy as np
+
+# layout of the cache directory:
+# <cache_dir>/<model_key>/<sample_key>/<tensor_key>.npy
+# model_key:  hash of the mlir file and its weight file
+# sample_key: hash of the contents of the input files of one sample
+# tensor_key: hash of the tensor name
+
+
+def hash_file(md, file: str, chunk_size=1 << 20):
+    with open(file, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            md.update(chunk)
+    return md
+
+
+def hash_str(s: str):
+    return hashlib.md5(s.encode()).hexdigest()
+
+
+class ActivationCache:
+    """Content-addressed on-disk cache of fp32 activations.
+
+    Activations are stored as plain .npy files and memory-mapped back
+    copy-on-write (callers like cosine_sim patch nans in place, which must
+    not reach the file), so a hit costs no inference and no copy. The
+    directory is shared by different runs and tools, and max_size bounds the
+    whole directory, not only the activations of this model: once it grows
+    beyond max_size bytes, the least recently used activations of all the
+    models are evicted down to 80% of it.
+
+    Sizes and mtimes are kept in an index, built by a walk of the directory
+    and walked again after each 10% of max_size written by this process;
+    files written by other processes in between are only counted then.
+    """
+
+    def __init__(self, cache_dir: str, mlir_file: str, max_size: float = 20 * 1024**3):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.model_key = self.hash_model(mlir_file)
+        self.model_dir = os.path.join(cache_dir, self.model_key)
+        os.makedirs(self.model_dir, exist_ok=True)
+        self.sample_keys = {}
+        self.rescan()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def hash_model(mlir_file: str):
+        md = hash_file(hashlib.md5(), mlir_file)
+        with open(mlir_file, "r") as f:
+            header = f.read(4096)
+        weight = re.search(r'module\.weight_file\s*=\s*"([^"]+)"', header)
+        if weight:
+            weight_file = os.path.join(os.path.dirname(os.path.abspath(mlir_file)), weight.group(1))
+            if not os.path.exists(weight_file):
+                weight_file = weight.group(1)
+            if os.path.exists(weight_file):
+                hash_file(md, weight_file)
+        return md.hexdigest()
+
+    def sample_key(self, files: list):
+        """key of one sample, from the contents of the input files it is made of"""
+        k = tuple(files)
+        if k not in self.sample_keys:
+            md = hashlib.md5()
+            for data in files:
+                for file in data.split(','):
+                    hash_file(md, file.strip())
+            self.sample_keys[k] = md.hexdigest()
+        return self.sample_keys[k]
+
+    def tensor_path(self, sample_key: str, name: str):
+        return os.path.join(self.model_dir, sample_key, hash_str(name) + ".npy")
+
+    def get(self, sample_key: str, name: str):
+        path = self.tensor_path(sample_key, name)
+        try:
+            data = np.load(path, mmap_mode='c')
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        # mtime is the lru clock
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        if path in self.index:
+            self.index[path] = (time.time(), self.index[path][1])
+        self.hits += 1
+        return data
+
+    def put(self, sample_key: str, name: str, data):
+        path = self.tensor_path(sample_key, name)
+        if os.path.exists(path):
+            return
+        sample_dir = os.path.dirname(path)
+        os.makedirs(sample_dir, exist_ok=True)
+        # write to a temp file and rename, readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=sample_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.ascontiguousarray(data, dtype=np.float32))
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        size = os.path.getsize(path)
+        self.index[path] = (time.time(), size)
+        self.total_size += size
+        self.written += size
+        if self.written >= self.max_size * 0.1:
+            self.rescan()
+        if self.total_size > self.max_size:
+            self.evict()
+
+    def scan(self):
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for n in names:
+                if not n.endswith(".npy"):
+                    continue
+                path = os.path.join(root, n)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        return files
+
+    def rescan(self):
+        self.index = {path: (mtime, size) for mtime, size, path in self.scan()}
+        self.total_size = sum(size for _, size in self.index.values())
+        self.written = 0
+
+    def evict(self):
+        # drop the least recently used activations down to 80% of max_size,
+        # the whole directory is shared by all the models in it
+        target = self.max_size * 0.8
+        for path, (_, size) in sorted(self.index.items(), key=lambda x: x[1][0]):
+            if self.total_size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # already evicted by another process
+                pass
+            del self.index[path]
+            self.total_size -= size
+
+    def summary(self):
+        return "activation cache {}: {} hits, {} misses, {:.2f} GB".format(
+            self.model_dir, self.hits, self.misses, self.total_size / 1024**3)
+
+
+class CachedModule:
+    """Stand-in of a pymlir.module for hooks that only call get_tensor.
+
+    set_sample maps all the tensors of a sample from the cache at once, so an
+    eviction by another process can only turn the whole sample into a miss.
+    On a hit get_tensor returns the mapped tensors; on a miss the module has to
+    be invoked, get_tensor reads it and stores the tensor for later runs.
+    """
+
+    def __init__(self, module, cache: ActivationCache):
+        self.module = module
+        self.cache = cache
+        self.key = None
+        self.tensors = None
+
+    def set_sample(self, key: str, names: list):
+        self.key = key
+        self.tensors = {}
+        for name in names:
+            data = self.cache.get(key, name)
+            if data is None:
+                self.tensors = None
+                break
+            self.tensors[name] = data
+        return self.tensors is not None
+
+    def get_tensor(self, name: str):
+        if self.tensors is not None:
+            return self.tensors[name]
+        data = self.module.get_tensor(name)
+        self.cache.put(self.key, name, data)
+        return data
+
+
+def create_activation_cache(args, mlir_file: str):
+    cache_dir = getattr(args, 'activation_cache', None)
+    if not cache_dir:
+        return None
+    max_size = getattr(args, 'activation_cache_size', 20) * 1024**3
+    return ActivationCache(cache_dir, mlir_file, max_size)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# ==============================================================================
+#
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+
+import os
+import copy
+import collections
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from calibration.data_selector import DataSelector
+
+
+def load_item(task):
+    kind, files, payload = task
+    if kind == 'image':
+        # payload: [(ppa, 'a.jpg,b.jpg,...')] of each input
+        inputs = {}
+        for ppa, batched in payload:
+            # run() keeps per call state in the preprocess, work on a copy
+            ppa = copy.copy(ppa)
+            inputs[ppa.input_name] = ppa.run(batched)
+        return files, inputs
+    if kind == 'npy':
+        # payload: [(input name, npy file)]
+        return files, {name: np.load(npy) for name, npy in payload}
+    # npz, read all the arrays here instead of lazily in the consumer
+    with np.load(payload) as x:
+        return files, {name: x[name] for name in x.files}
+
+
+class InputLoader:
+    """Iterate the inputs of a DataSelector, loaded by a pool of workers.
+
+    Each item is (files, {input name: array}), yielded in the order of the
+    data list while up to `prefetch` items are decoded ahead in the pool:
+    image items are batched by batch_size and preprocessed by ppa_list (a
+    trailing partial batch is dropped, callers pad the list beforehand),
+    npy items are one line of the list, npz items are one file with all
+    its arrays. Stopping the iteration early cancels the pending items.
+    """
+
+    def __init__(self,
+                 ds: DataSelector,
+                 ppa_list: list,
+                 input_names: list,
+                 batch_size: int,
+                 data_list: list = None,
+                 workers: int = 0,
+                 prefetch: int = 0,
+                 use_process: bool = False):
+        self.ds = ds
+        self.ppa_list = ppa_list
+        self.input_names = input_names
+        self.batch_size = batch_size
+        self.data_list = ds.data_list if data_list is None else data_list
+        self.workers = workers if workers > 0 else min(8, os.cpu_count() or 1)
+        self.prefetch = prefetch if prefetch > 0 else 2 * self.workers
+        self.use_process = use_process
+
+    def tasks(self):
+        if self.ds.all_image:
+            batch = []
+            for data in self.data_list:
+                batch.append(data)
+                if len(batch) < self.batch_size:
+                    continue
+                columns = [[s.strip() for s in d.split(',')] for d in batch]
+                for inputs in columns:
+                    assert (len(inputs) == len(self.ppa_list))
+                payload = [(ppa, ','.join(c[i] for c in columns))
+                           for i, ppa in enumerate(self.ppa_list)]
+                yield ('image', batch, payload)
+                batch = []
+        elif self.ds.all_npz:
+            for data in self.data_list:
+                yield ('npz', [data], data)
+        else:
+            for data in self.data_list:
+                inputs = [s.strip() for s in data.split(',')]
+                assert (len(inputs) == len(self.input_names))
+                yield ('npy', [data], list(zip(self.input_names, inputs)))
+
+    def __iter__(self):
+        if self.workers <= 1:
+            for task in self.tasks():
+                yield load_item(task)
+            return
+        Executor = ProcessPoolExecutor if self.use_process else ThreadPoolExecutor
+        pool = Executor(max_workers=self.workers)
+        pending = collections.deque()
+        try:
+            for task in self.tasks():
+                pending.append(pool.submit(load_item, task))
+                if len(pending) >= self.prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for f in pending:
+                f.cancel()
+            pool.shutdown(wait=True)
+
+    def __len__(self):
+        if self.ds.all_image:
+            return len(self.data_list) // self.batch_size
+        return len(self.data_list)
@@ -14,6 +14,7 @@ import gc
 import re
 import time
 import copy
+import multiprocessing
 import numpy as np
 import pymlir
 from ctypes import *
@@ -26,39 +27,125 @@ from utils.misc import *
 #import graphviz as gz
 from math import *
 from scipy import spatial
+from concurrent.futures import ThreadPoolExecutor
 from calibration.data_selector import DataSelector
+from calibration.data_loader import InputLoader
+from calibration.activation_cache import CachedModule, create_activation_cache
 
 cur_dir_path = os.path.join(os.path.dirname(__file__))
 calibration_math_path = os.path.join("/".join(cur_dir_path.split("/")[:-2]), "lib/calibration_math.so")
 if not os.path.exists(calibration_math_path):
     calibration_math_path = "calibration_math.so"
 
+def histogram(ndarray, abs_max, bin_num):
+    t = np.abs(ndarray.flatten())
+    t = t[t != 0]
+    width = abs_max / (bin_num - 1)
+    if t.size > 0:
+        hist, _ = np.histogram(np.floor(t / width + 0.5),
+                               bins=bin_num,
+                               range=(0, bin_num - 1),
+                               density=False)
+    else:
+        hist = np.zeros(bin_num)
+    hist = hist.astype(np.int32)
+    return hist, width
+
+
+def kl_diversity_hist_numpy(hists, widths, bin_num, dst_bins, num_threads=0):
+    """Numpy version of kl_diversity_hist in calibration_math.cpp.
+
+    All the histograms in hists ([num, bin_num]) are searched together, one
+    candidate threshold at a time; chunks of histograms run in a thread pool.
+    """
+    hists = np.asarray(hists).reshape(-1, bin_num).astype(np.int64)
+    widths = np.asarray(widths, dtype=np.float32)
+    kl_num = bin_num // dst_bins
+
+    @np.errstate(divide='ignore', invalid='ignore')
+    def search(rows):
+        h = hists[rows]
+        num = h.shape[0]
+        count = h.sum(axis=1).astype(np.float32)[:, None]
+        kl = np.zeros((num, kl_num))
+        for m in range(kl_num):
+            i = (m + 1) * dst_bins
+            head = h[:, :i].astype(np.float32)
+            # P distribution, the tail outside of i is clipped into the last bin
+            p = head.copy()
+            p[:, -1] += h[:, i:].sum(axis=1)
+            p /= count
+            # Q distribution, i bins merged into dst_bins and expanded back over non-zeros
+            chunks = head.reshape(num, dst_bins, i // dst_bins)
+            positive = np.maximum((chunks > 0).sum(axis=2), 1).astype(np.float32)
+            q_base = chunks.sum(axis=2) / positive / head.sum(axis=1)[:, None]
+            q = np.where(chunks > 0, q_base[:, :, None], 0).reshape(num, i)
+            p = p.astype(np.float64)
+            kl[:, m] = (p * (np.log10(p + 1e-30) - np.log10(q + 1e-30))).sum(axis=1)
+        # a nan is never taken as the minimum, unless it is the first candidate
+        nan = np.isnan(kl)
+        m_min = np.argmin(np.where(nan, np.inf, kl), axis=1)
+        m_min[nan[:, 0]] = 0
+        return widths[rows] * (m_min + 1) * dst_bins
+
+    num_threads = num_threads if num_threads > 0 else (os.cpu_count() or 1)
+    chunk = max(1, (hists.shape[0] + num_threads - 1) // num_threads)
+    slices = [slice(i, i + chunk) for i in range(0, hists.shape[0], chunk)]
+    if len(slices) <= 1:
+        return search(slice(None)).astype(np.float32)
+    with ThreadPoolExecutor(max_workers=len(slices)) as executor:
+        parts = list(executor.map(search, slices))
+    return np.concatenate(parts).astype(np.float32)
+
+
 class BaseKldCalibrator:
 
     def __init__(self, math_lib_path=calibration_math_path):
-        self.calib_lib = CDLL(math_lib_path)
+        self.calib_lib = None
+        try:
+            self.calib_lib = CDLL(math_lib_path)
+        except OSError:
+            print("WARNING: can not load {}, kld threshold runs in numpy".format(math_lib_path))
+            return
         self.calib_lib.kl_diversity.restype = c_float
         self.calib_lib.kl_diversity_hist.restype = c_float
+        if hasattr(self.calib_lib, 'kl_diversity_hist_batch'):
+            self.calib_lib.kl_diversity_hist_batch.restype = None
 
     def histogram(self, ndarray, abs_max, bin_num):
-        t = np.abs(ndarray.flatten())
-        t = t[t != 0]
-        width = abs_max / (bin_num - 1)
-        if t.size > 0:
-            hist, _ = np.histogram(np.floor(t / width + 0.5),
-                                   bins=bin_num,
-                                   range=(0, bin_num - 1),
-                                   density=False)
-        else:
-            hist = np.zeros(bin_num)
-        hist = hist.astype(np.int32)
-        return hist, width
+        return histogram(ndarray, abs_max, bin_num)
 
     def kld_threshold(self, hist, width, bin_num, dst_bins):
+        if self.calib_lib is None:
+            return float(self.kld_threshold_batch(hist, [width], bin_num, [dst_bins])[0][0])
         threshold = self.calib_lib.kl_diversity_hist(hist.ctypes.data_as(POINTER(c_int)),
                                                      c_float(width), c_longlong(bin_num), c_longlong(dst_bins))
         return threshold
 
+    def kld_threshold_batch(self, hists, widths, bin_num, dst_bins_list, num_threads=0):
+        """Thresholds of stacked [num_tensors, bin_num] histograms for every dst_bins.
+
+        Returns a float32 array of shape [len(dst_bins_list), num_tensors].
+        """
+        hists = np.ascontiguousarray(hists, dtype=np.int32).reshape(-1, bin_num)
+        widths = np.ascontiguousarray(widths, dtype=np.float32)
+        num = hists.shape[0]
+        if self.calib_lib is None or not hasattr(self.calib_lib, 'kl_diversity_hist_batch'):
+            return np.stack([
+                kl_diversity_hist_numpy(hists, widths, bin_num, dst_bins, num_threads)
+                for dst_bins in dst_bins_list
+            ]).reshape(len(dst_bins_list), num)
+        dst = np.ascontiguousarray(dst_bins_list, dtype=np.int64)
+        thresholds = np.zeros((len(dst), num), dtype=np.float32)
+        self.calib_lib.kl_diversity_hist_batch(hists.ctypes.data_as(POINTER(c_int)),
+                                               widths.ctypes.data_as(POINTER(c_float)),
+                                               c_longlong(num), c_longlong(bin_num),
+                                               dst.ctypes.data_as(POINTER(c_longlong)),
+                                               c_longlong(len(dst)),
+                                               thresholds.ctypes.data_as(POINTER(c_float)),
+                                               c_longlong(num_threads))
+        return thresholds
+
 
 class CalibrationTable:
 
@@ -151,6 +238,213 @@ def cosine_sim(x, y):
     return cosine_similarity
 
 
+def percentile_length(num, tensor_size, per):
+    return int(num * tensor_size * (1 - per / 100)) + 1
+
+
+def interp_percentile(res, total, per):
+    # res holds the sorted top res_length absolute values of all samples
+    inter = total - 1
+    idx = int((per / 100) * inter)
+    ratio = (per / 100) * inter - idx
+    return res[0] + ratio * (res[1] - res[0]) if len(res) != 1 else res[0]
+
+
+class PercentileAccumulator:
+    """Exact top-k of the absolute values of a tensor, merged across samples.
+
+    Only the k largest values seen so far are kept; the smallest of them is
+    the bound a new value has to exceed, like the root of a min-heap. k is
+    the res_length of the percentile, so the memory is bounded by k no
+    matter how many samples are folded in.
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self.count = 0
+        self.top = np.zeros(0, dtype=np.float32)
+
+    def push(self, values):
+        if self.top.size >= self.k:
+            values = values[values > self.top[0]]
+            if values.size == 0:
+                return
+        merged = np.concatenate([self.top, values])
+        if merged.size > self.k:
+            merged = np.partition(merged, merged.size - self.k)[-self.k:]
+        # keep the smallest kept value at the front as the eviction bound
+        self.top = np.partition(merged, 0) if merged.size > 1 else merged
+
+    def update(self, activation):
+        values = np.abs(activation.flatten())
+        self.count += values.size
+        if values.size > self.k:
+            values = np.partition(values, values.size - self.k)[-self.k:]
+        self.push(values)
+
+    def merge(self, other):
+        self.count += other.count
+        self.push(other.top)
+
+    def percentile(self, per, total=None):
+        res = np.sort(self.top).astype(np.float64)
+        return interp_percentile(res, self.count if total is None else total, per)
+
+
+class ActivationStatistics:
+    """Running per-tensor statistics, folded from one activation at a time.
+
+    Nothing here references the activation after update_* returns, so
+    a whole sample can be dropped as soon as its hooks have run.
+    """
+
+    def __init__(self):
+        self.min_map = {}
+        self.max_map = {}
+        self.topk_map = {}
+        self.hist_map = {}
+        self.width_map = {}
+
+    def update_range(self, name, activation):
+        self.min_map[name] = min(np.min(activation), self.min_map.get(name, inf))
+        self.max_map[name] = max(np.max(activation), self.max_map.get(name, -inf))
+
+    def update_topk(self, name, activation, res_length):
+        if name not in self.topk_map:
+            self.topk_map[name] = PercentileAccumulator(res_length)
+        self.topk_map[name].update(activation)
+
+    def percentile(self, name, per):
+        return self.topk_map[name].percentile(per)
+
+    def update_hist(self, name, activation, abs_value, bin_num):
+        hist, width = histogram(activation, abs_value, bin_num)
+        if name not in self.hist_map:
+            self.hist_map[name] = hist
+            self.width_map[name] = width
+        else:
+            self.hist_map[name] += hist
+
+    def merge(self, other):
+        for name, v in other.min_map.items():
+            self.min_map[name] = min(v, self.min_map.get(name, inf))
+        for name, v in other.max_map.items():
+            self.max_map[name] = max(v, self.max_map.get(name, -inf))
+        for name, acc in other.topk_map.items():
+            if name not in self.topk_map:
+                self.topk_map[name] = acc
+            else:
+                self.topk_map[name].merge(acc)
+        for name, hist in other.hist_map.items():
+            if name not in self.hist_map:
+                self.hist_map[name] = hist
+                self.width_map[name] = other.width_map[name]
+            else:
+                self.hist_map[name] += hist
+
+    def range_hook(self, module, plan, num, use_percentile):
+        def hook(layer_name):
+            if layer_name not in plan:
+                return
+            tensors, per = plan[layer_name]
+            for out in tensors:
+                activation = module.get_tensor(out)
+                self.update_range(out, activation)
+                if use_percentile:
+                    self.update_topk(out, activation, percentile_length(num, activation.size, per))
+        return hook
+
+    def hist_hook(self, module, plan, abs_map, bin_num):
+        def hook(layer_name):
+            if layer_name not in plan:
+                return
+            for out in plan[layer_name][0]:
+                self.update_hist(out, module.get_tensor(out), abs_map[out], bin_num)
+        return hook
+
+
+def invoke_samples(module, samples, hook, cached=None, plan=None):
+    # samples: [(cache key, {input name: data})]. With an activation cache the
+    # hook reads through cached, and a sample fully in the cache is replayed
+    # op by op without invoking the module.
+    if cached is not None:
+        names = [out for tensors, _ in plan.values() for out in tensors]
+    for key, inputs in samples:
+        if cached is not None and cached.set_sample(key, names):
+            for layer_name in plan:
+                hook(layer_name)
+            continue
+        for name, data in inputs.items():
+            module.set_tensor(name, data)
+        module.after_invoke(hook)
+        module.invoke()
+        module.clear_hooks()
+
+
+def collect_statistics_worker(task):
+    mlir_file, samples, plan, num, use_percentile, abs_map, bin_num, cache = task
+    module = pymlir.module()
+    module.load(mlir_file)
+    cached = None if cache is None else CachedModule(module, cache)
+    source = module if cached is None else cached
+    stats = ActivationStatistics()
+    if abs_map is None:
+        hook = stats.range_hook(source, plan, num, use_percentile)
+    else:
+        hook = stats.hist_hook(source, plan, abs_map, bin_num)
+    invoke_samples(module, samples, hook, cached, plan)
+    return stats
+
+
+def threshold_metrics(outputs, ref):
+    # distance (l2 of the diff over l1 of ref) and cosine similarity of each
+    # row of outputs [num_thresholds, size] to ref [size], as calc_distance
+    outputs[np.isnan(outputs)] = 0.0
+    ref = np.where(np.isnan(ref), 0.0, ref).astype(np.float32)
+    norm_2 = np.linalg.norm(ref[None, :] - outputs, axis=1)
+    norm_1 = np.linalg.norm(ref, ord=1)
+    dot = outputs.astype(np.float64) @ ref.astype(np.float64)
+    norms = np.linalg.norm(outputs.astype(np.float64), axis=1) * np.linalg.norm(ref.astype(np.float64))
+    return norm_2 / norm_1, dot / norms
+
+
+def threshold_distances(module, evaled_op, samples, thresholds):
+    """Sums over the samples of the distance and cosine similarity of evaled_op
+    to its fp32 reference, with its inputs quantized by each threshold.
+
+    samples is a list of (inputs, ref), inputs mapping the input names of
+    evaled_op to their data.
+    """
+    distance = np.zeros(len(thresholds))
+    cos_sim = np.zeros(len(thresholds))
+    for inputs, ref in samples:
+        outputs = np.empty((len(thresholds), ref.size), dtype=np.float32)
+        for t, threshold in enumerate(thresholds):
+            for name, value in inputs.items():
+                module.set_tensor(name, import_quant_bias(value, threshold))
+            outputs[t] = module.invoke_at(evaled_op).flatten()
+        d, c = threshold_metrics(outputs, ref.flatten())
+        distance += d
+        cos_sim += c
+    return distance, cos_sim
+
+
+tune_module = None
+
+
+def init_tune_worker(mlir_file):
+    # each worker of the tuner loads the fake quant module once
+    global tune_module
+    tune_module = pymlir.module()
+    tune_module.load(mlir_file)
+    tune_module.fake_quant_weight()
+
+
+def tune_distance_worker(task):
+    evaled_op, samples, thresholds = task
+    return threshold_distances(tune_module, evaled_op, samples, thresholds)
+
+
 class SimpleTuner:
 
     def __init__(self, args, ds: DataSelector, ppa_list, abs_max_dict):
@@ -173,8 +467,10 @@ class SimpleTuner:
         self.module = pymlir.module()
         self.module.load(args.mlir_file)
         self.parser = MlirParser(args.mlir_file)
-        for op_name in self.parser.get_op_name_list():
+        self.op_no = {}
+        for i, op_name in enumerate(self.parser.get_op_name_list()):
             fuseop_list_append(op_name,self.fuseop_list)
+            self.op_no.setdefault(op_name, i)
         self.batch_size = self.parser.get_batch_size()
         self.input_num = self.parser.get_input_num()
         self.ds = ds
@@ -193,6 +489,10 @@ class SimpleTuner:
         self.module_dq = pymlir.module()
         self.module_dq.load(args.mlir_file)
         self.module_dq.fake_quant_weight()
+        # the thresholds tried for an op are shared out to a pool of fake quant modules
+        self.workers = getattr(args, 'workers', 1)
+        self.pool = None
+        self.act_cache = create_activation_cache(args, args.mlir_file)
         self.load_net_input()
         self.dot = None
         #self.dot = gz.Digraph()
@@ -214,25 +514,26 @@ class SimpleTuner:
         for input in self.module.input_names:
             inp_ref_dict[input] = self.parser.get_use_count_by_op_name(input)
 
-        if self.ds.all_image:
-            batched_inputs = self.input_num * ['']
-        else:
-            batched_inputs = {}
+        batched_inputs = {}
 
-        idx, tune_idx = 0, 0
+        tune_idx = 0
         self.dq_activations[tune_idx] = {}
         self.ref_activations[tune_idx] = {}
         only_one = len(self.module.input_names) == 1
         print(f'prepare data from {len(self.data_list)}')
-        for data in self.data_list:
+        self.sample_files = {}
+        pending_files = []
+        loader = InputLoader(self.ds, self.ppa_list, self.module.input_names, self.batch_size,
+                             self.data_list)
+        for files, x in loader:
             if len(self.ref_activations) > self.args.tune_num + 1:
                 break
+            pending_files.extend(files)
             if self.ds.all_npz:
-                x = np.load(data)
                 if only_one:
-                    assert (len(x.files) == 1)
+                    assert (len(x) == 1)
                     n0 = self.module.input_names[0]
-                    n1 = x.files[0]
+                    n1 = list(x)[0]
                     if x[n1].shape[0] > 1:
                         self.dq_activations[tune_idx][n0] = [x[n1], inp_ref_dict[n0]]
                         self.ref_activations[tune_idx][n0] = [x[n1], inp_ref_dict[n0]]
@@ -274,33 +575,15 @@ class SimpleTuner:
 
                     if batch_size < self.batch_size:
                         continue
-            elif self.ds.all_image:
-                idx += 1
-                inputs = data.split(',')
-                inputs = [s.strip() for s in inputs]
-                assert (self.input_num == len(inputs))
-                for i in range(self.input_num):
-                    batched_inputs[i] += '{},'.format(inputs[i])
-                    if idx == self.batch_size:
-                        x = self.ppa_list[i].run(batched_inputs[i][:-1])
-                        name = self.ppa_list[i].input_name
-                        self.dq_activations[tune_idx][name] = [x, inp_ref_dict[name]]
-                        self.ref_activations[tune_idx][name] = [x, inp_ref_dict[name]]
-                if idx == self.batch_size:
-                    idx = 0
-                    batched_inputs = self.input_num * ['']
-                else:
-                    continue
             else:
+                # image batches and npy lines come ready from the loader
                 self.dq_activations[tune_idx] = {}
                 self.ref_activations[tune_idx] = {}
-                inputs = data.split(',')
-                inputs = [s.strip() for s in inputs]
-                assert (self.input_num == len(inputs))
-                for name, input in zip(self.module.input_names, inputs):
-                    x = np.load(input)
-                    self.dq_activations[tune_idx][name] = [x, inp_ref_dict[name]]
-                    self.ref_activations[tune_idx][name] = [x, inp_ref_dict[name]]
+                for name, data in x.items():
+                    self.dq_activations[tune_idx][name] = [data, inp_ref_dict[name]]
+                    self.ref_activations[tune_idx][name] = [data, inp_ref_dict[name]]
+            self.sample_files[tune_idx] = pending_files
+            pending_files = []
             tune_idx += 1
             self.dq_activations[tune_idx] = {}
             self.ref_activations[tune_idx] = {}
@@ -412,15 +695,23 @@ class SimpleTuner:
             fused_op_name = self.fuseop_list[op_name]
             input_ops = self.parser.get_pre_op_by_op_name(fused_op_name)
         # print(op_name, input_ops)
+        value = None
+        if self.act_cache is not None and len(input_ops) > 0:
+            key = self.act_cache.sample_key(self.sample_files[i])
+            value = self.act_cache.get(key, op_name)
         for input_op in input_ops:
             data = self.ref_activations[i][input_op][0]
             refcount = self.ref_activations[i][input_op][1]
             if i == 0:
                 tmp += '\nits input:{}, refcount:{}'.format(input_op, refcount)
 
-            self.module.set_tensor(input_op, data)
+            if value is None:
+                self.module.set_tensor(input_op, data)
         if len(input_ops) > 0:
-            value = self.module.invoke_at(op_name)
+            if value is None:
+                value = self.module.invoke_at(op_name)
+                if self.act_cache is not None:
+                    self.act_cache.put(key, op_name, value)
             outputs = self.parser.get_outputs_by_op_name(op_name)
             if outputs is None and op_name in self.fuseop_list:
                 fused_op_name = self.fuseop_list[op_name]
@@ -436,42 +727,61 @@ class SimpleTuner:
         if i == 0:
             node_label[0] += '\n{}'.format(tmp)
 
-    def calc_distance(self, evaled_op, threshold):
-        distance = 0
-        total_cosine_similarity = 0
+    def distance_samples(self, evaled_op):
+        # (inputs, fp32 ref) of evaled_op for each sample, None if a tensor is missing
+        samples = []
         for idx in range(self.args.tune_num):
+            inputs = {}
             for input in self.parser.get_pre_op_by_op_name(evaled_op):
-                if idx == 0:
-                    self.print_dbg('{}\'s input:{} import_quant_bias, th:{}'.format(
-                        evaled_op, input, threshold))
                 if 'not_use_fp32_tensor_as_ref' in self.debug_cmd:
                     value = self.get_input_tensor(idx, input)
                 else:
                     value = self.get_ref_tensor(idx, input)
                 if value is None:
                     print('error, calc_distance get tensor fail')
-                    return None, None
-                value = import_quant_bias(value, threshold)
-                self.module_dq.set_tensor(input, value)
-            target_activations = self.module_dq.invoke_at(evaled_op)
-            target_fp32_activations = self.get_ref_tensor(idx, evaled_op)
-            total_cosine_similarity += cosine_sim(target_activations, target_fp32_activations)
-            diff = target_fp32_activations.flatten() - target_activations.flatten()
-            norm_2 = np.linalg.norm(diff)
-            norm_1 = np.linalg.norm(target_fp32_activations.flatten(), ord=1)
-            distance += norm_2 / norm_1
-        return distance / self.args.tune_num, total_cosine_similarity / self.args.tune_num
+                    return None
+                inputs[input] = value
+            samples.append((inputs, self.get_ref_tensor(idx, evaled_op)))
+        return samples
+
+    def calc_distances(self, evaled_op, samples, thresholds):
+        """mean distance and cosine similarity of evaled_op for each threshold"""
+        self.print_dbg('{}\'s inputs:{} import_quant_bias, th:{}'.format(
+            evaled_op, self.parser.get_pre_op_by_op_name(evaled_op), thresholds))
+        workers = min(self.workers, len(thresholds))
+        if workers <= 1:
+            distance, cos_sim = threshold_distances(self.module_dq, evaled_op, samples, thresholds)
+        else:
+            if self.pool is None:
+                self.pool = multiprocessing.Pool(self.workers, init_tune_worker,
+                                                 (self.args.mlir_file, ))
+            shard = (len(thresholds) + workers - 1) // workers
+            tasks = [(evaled_op, samples, thresholds[i:i + shard])
+                     for i in range(0, len(thresholds), shard)]
+            parts = self.pool.map(tune_distance_worker, tasks)
+            distance = np.concatenate([d for d, _ in parts])
+            cos_sim = np.concatenate([c for _, c in parts])
+        return distance / self.args.tune_num, cos_sim / self.args.tune_num
+
+    def calc_distance(self, evaled_op, threshold):
+        samples = self.distance_samples(evaled_op)
+        if samples is None:
+            return None, None
+        distance, cos_sim = self.calc_distances(evaled_op, samples, [threshold])
+        return distance[0], cos_sim[0]
+
+    def close_pool(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
 
     def find_better_threshold(self, evaled_op, tuned_op, node_label):
         prev_distance = -1
         threshold = self.initial_threshold[tuned_op][0]
         # abs_max = max(map(abs, self.initial_threshold[tuned_op][1:]))
         abs_max = self.abs_max_dict[tuned_op]
-        #op_no = self.module.all_tensor_names.index(tuned_op)
-        if tuned_op in self.parser.get_op_name_list():
-            op_no = self.parser.get_op_name_list().index(tuned_op)
-        else:
-            op_no = 0
+        op_no = self.op_no.get(tuned_op, 0)
         self.print_dbg('>>>tuned_op_idx:', op_no, ', tuned_op:', tuned_op, ', threshold:',
                        threshold, 'abs_max:', abs_max, ', evaled_op:', evaled_op)
         if threshold > abs_max:
@@ -497,6 +807,12 @@ class SimpleTuner:
         step = (abs_max - th_min) / self.tune_steps
         ranges = range(self.tune_steps + 1)
         if step > 0 and diff > min_tuned_diff:
+            # the references are gathered once, and each threshold is evaluated
+            # once for both passes, all the thresholds of a pass in one batch
+            samples = self.distance_samples(evaled_op)
+            if samples is None:
+                return False
+            evaluated = {}
             for n in range(2):
                 if n == 1 and 'find_lower_th' in self.debug_cmd:
                     th_min = best_threshold - step
@@ -506,11 +822,13 @@ class SimpleTuner:
                     step = (th_max - th_min) / times
                     ranges = range(times + 1)[1:-1]
                     #print(f'find_lower_th enable,tuned_op:{tuned_op},best_threshold:{best_threshold},step:{step},th_min:{th_min},th_max:{th_max}, times:{times}')
-                for i in ranges:
-                    cur_threshold = th_min + step * i
-                    cur_distance, cur_cos_sim = self.calc_distance(evaled_op, cur_threshold)
-                    if cur_distance is None and cur_cos_sim is None:
-                        return False
+                thresholds = [th_min + step * i for i in ranges]
+                pending = [th for th in dict.fromkeys(thresholds) if th not in evaluated]
+                if pending:
+                    distances, cos_sims = self.calc_distances(evaled_op, samples, pending)
+                    evaluated.update(zip(pending, zip(distances, cos_sims)))
+                for i, cur_threshold in zip(ranges, thresholds):
+                    cur_distance, cur_cos_sim = evaluated[cur_threshold]
                     if prev_distance == -1:
                         self.print_dbg("### tuning i:{}, tuned_op_idx:{}, tuned_op:{}, threshold:"
                                        "{:5f}, distance: {}".format(i, op_no, tuned_op,
@@ -623,6 +941,7 @@ class SimpleTuner:
             if self.dot is not None:
                 self.dot.node(evaled_op, node_label[0], shape='box')
         pbar.close()
+        self.close_pool()
         print('auto tune end, run time:{}'.format(time.time() - self.start_time))
 
         if 'print_debug_info' in self.debug_cmd:
@@ -720,6 +1039,9 @@ class ActivationCalibrator(BaseKldCalibrator):
         log_level = "DEBUG" if 'debug_log' in self.debug_cmd else "INFO"
         self.logger = setup_logger('auto_tune', log_level=log_level)
         self.histogram_bin_num = args.histogram_bin_num
+        self.workers = getattr(args, 'workers', 1)
+        self.act_cache = create_activation_cache(args, args.mlir_file)
+        self.cached_module = None
         self.tune_steps = 20
         self.num_samples = self.args.input_num
         if 'tune_steps' in self.debug_cmd:
@@ -737,21 +1059,22 @@ class ActivationCalibrator(BaseKldCalibrator):
         for input in self.module.input_names:
             inp_ref_dict[input] = self.parser.get_use_count_by_op_name(input)
 
-        if self.ds.all_image:
-            batched_inputs = self.input_num * ['']
-        else:
-            batched_inputs = {}
-        idx, tune_idx = 0, 0
+        batched_inputs = {}
+        tune_idx = 0
         self.dq_activations[tune_idx] = {}
         self.ref_activations[tune_idx] = {}
         only_one = len(self.module.input_names) == 1
-        for data in self.data_list:
+        self.sample_files = {}
+        pending_files = []
+        loader = InputLoader(self.ds, self.ppa_list, self.module.input_names, self.batch_size,
+                             self.data_list)
+        for files, x in loader:
+            pending_files.extend(files)
             if self.ds.all_npz:
-                x = np.load(data)
                 if only_one:
-                    assert (len(x.files) == 1)
+                    assert (len(x) == 1)
                     n0 = self.module.input_names[0]
-                    n1 = x.files[0]
+                    n1 = list(x)[0]
                     if x[n1].shape[0] > 1:
                         self.dq_activations[tune_idx][n0] = [x[n1], inp_ref_dict[n0]]
                         self.ref_activations[tune_idx][n0] = [x[n1], inp_ref_dict[n0]]
@@ -794,33 +1117,15 @@ class ActivationCalibrator(BaseKldCalibrator):
                     if batch_size < self.batch_size:
                         continue
 
-            elif self.ds.all_image:
-                idx += 1
-                inputs = data.split(',')
-                inputs = [s.strip() for s in inputs]
-                assert (self.input_num == len(inputs))
-                for i in range(self.input_num):
-                    batched_inputs[i] += '{},'.format(inputs[i])
-                    if idx == self.batch_size:
-                        x = self.ppa_list[i].run(batched_inputs[i][:-1])
-                        name = self.ppa_list[i].input_name
-                        self.dq_activations[tune_idx][name] = [x, inp_ref_dict[name]]
-                        self.ref_activations[tune_idx][name] = [x, inp_ref_dict[name]]
-                if idx == self.batch_size:
-                    idx = 0
-                    batched_inputs = self.input_num * ['']
-                else:
-                    continue
             else:
+                # image batches and npy lines come ready from the loader
                 self.dq_activations[tune_idx] = {}
                 self.ref_activations[tune_idx] = {}
-                inputs = data.split(',')
-                inputs = [s.strip() for s in inputs]
-                assert (self.input_num == len(inputs))
-                for name, input in zip(self.module.input_names, inputs):
-                    x = np.load(input)
-                    self.dq_activations[tune_idx][name] = [x, inp_ref_dict[name]]
-                    self.ref_activations[tune_idx][name] = [x, inp_ref_dict[name]]
+                for name, data in x.items():
+                    self.dq_activations[tune_idx][name] = [data, inp_ref_dict[name]]
+                    self.ref_activations[tune_idx][name] = [data, inp_ref_dict[name]]
+            self.sample_files[tune_idx] = pending_files
+            pending_files = []
             tune_idx += 1
             self.dq_activations[tune_idx] = {}
             self.ref_activations[tune_idx] = {}
@@ -851,10 +1156,39 @@ class ActivationCalibrator(BaseKldCalibrator):
         print('error, idx:{} evaled_op:{} not in ref_activations'.format(i, evaled_op))
         return None
 
+    def ref_tensor_outputs(self, op_name):
+        # [(tensor, use count)] kept in ref_activations after op_name is invoked
+        ret = [(op_name, self.parser.get_use_count_by_op_name(op_name))]
+        outputs = self.parser.get_outputs_by_op_name(op_name)
+        if outputs is None and op_name in self.fuseop_list:
+            fused_op_name = self.fuseop_list[op_name]
+            outputs = self.parser.get_outputs_by_op_name(fused_op_name)
+        for output in outputs or []:
+            if output == op_name:
+                continue
+            count = self.parser.get_use_count_by_op_name(output)
+            if count > 0:
+                ret.append((output, count))
+        return ret
+
+    def load_cached_ref_tensor(self, i, op_name):
+        key = self.sample_key(i)
+        tensors = {}
+        for output, count in self.ref_tensor_outputs(op_name):
+            data = self.act_cache.get(key, output)
+            if data is None:
+                # evicted, the op is invoked again
+                return False
+            tensors[output] = [data, count]
+        self.ref_activations[i].update(tensors)
+        return True
+
     def gen_ref_tensor(self, i, op_name):
         op_name = split_fuseop(op_name)
         if op_name in self.ref_activations[i]:
             return
+        if self.act_cache is not None and self.load_cached_ref_tensor(i, op_name):
+            return
         def set_func(layer_name):
             if layer_name==op_name:
                 input_ops = self.parser.get_pre_op_by_op_name(op_name)
@@ -864,43 +1198,34 @@ class ActivationCalibrator(BaseKldCalibrator):
                         self.module.set_tensor(input_op, data)
         def get_func(layer_name):
             if layer_name==op_name:
-                count = self.parser.get_use_count_by_op_name(op_name)
-                self.ref_activations[i][op_name] = [self.module.get_tensor(layer_name).copy(), count]
-                outputs = self.parser.get_outputs_by_op_name(op_name)
-                if outputs is not None:
-                    for output in outputs:
-                        if output == op_name:
-                            continue
-                        count = self.parser.get_use_count_by_op_name(output)
-                        if count > 0:
-                            self.ref_activations[i][output] = [self.module.get_tensor(output).copy(), count]
-                elif outputs is None and op_name in self.fuseop_list:
-                    fused_op_name = self.fuseop_list[op_name]
-                    outputs = self.parser.get_outputs_by_op_name(fused_op_name)
-                    for output in outputs:
-                        if output == op_name:
-                            continue
-                        count = self.parser.get_use_count_by_op_name(output)
-                        if count > 0:
-                            self.ref_activations[i][output] = [self.module.get_tensor(output).copy(), count]
+                for output, count in self.ref_tensor_outputs(op_name):
+                    self.ref_activations[i][output] = [self.module.get_tensor(output).copy(), count]
+                    if self.act_cache is not None:
+                        self.act_cache.put(self.sample_key(i), output, self.ref_activations[i][output][0])
         self.module.before_invoke(set_func)
         self.module.after_invoke(get_func)
         if len(self.parser.get_pre_op_by_op_name(op_name)) > 0 or op_name in self.fuseop_list:
             self.module.invoke_at(op_name)
         self.module.clear_hooks()
+
     def find_threshold(self, histogram_data_map, histogram_width_map, dst_bins=128):
-        thresholds = {}
-        num = len(histogram_data_map)
-        pbar = tqdm(range(num), total=num, position=0, leave=True)
-        for item in histogram_data_map:
-            pbar.set_description("[{}] threshold: {}".format(self.histogram_bin_num, item))
-            pbar.update(1)
-            thresholds[item] = self.kld_threshold(histogram_data_map[item],
-                                                  histogram_width_map[item], self.histogram_bin_num, dst_bins)
-        pbar.close()
-        return thresholds
+        return self.find_thresholds(histogram_data_map, histogram_width_map, [dst_bins])[0]
+
+    def find_thresholds(self, histogram_data_map, histogram_width_map, dst_bins_list):
+        # all the tensors and dst_bins are searched in one batched call
+        names = list(histogram_data_map.keys())
+        if len(names) == 0:
+            return [{} for _ in dst_bins_list]
+        print("[{}] threshold of {} tensors, dst_bins: {}".format(self.histogram_bin_num,
+                                                                   len(names), dst_bins_list))
+        hists = np.stack([histogram_data_map[name] for name in names])
+        widths = [histogram_width_map[name] for name in names]
+        results = self.kld_threshold_batch(hists, widths, self.histogram_bin_num, dst_bins_list)
+        return [{name: float(th) for name, th in zip(names, ths)} for ths in results]
 
     def activation_collect_and_calc_th(self):
+        if 'use_streaming' in self.debug_cmd or self.workers > 1:
+            return self.activation_collect_and_calc_th_streaming()
         histogram_data_map = {}
         histogram_width_map = {}
         self.activations_statistics = {}
@@ -931,11 +1256,9 @@ class ActivationCalibrator(BaseKldCalibrator):
                 if tensor is None:
                     continue
                 tensor_size = (self.get_ref_tensor(0, out)).size
-                all_data = np.zeros(tensor_size * self.args.input_num, dtype = np.float32)
                 num = self.args.input_num
                 per = 99.99 + i * step
-                res_length = int(num * tensor_size * (1 - per / 100)) + 1
-                all_data_test = np.zeros(self.args.input_num * res_length)
+                topk = PercentileAccumulator(percentile_length(num, tensor_size, per))
 
                 for idx in range(self.args.input_num):
                     activation = self.get_ref_tensor(idx, out)
@@ -949,39 +1272,17 @@ class ActivationCalibrator(BaseKldCalibrator):
                         max_value = max(np.max(activation), max_value)
                         abs_value = max(abs(min_value), abs(max_value))
                         if 'use_percentile9999' in self.debug_cmd:
-                            all_data[idx * tensor_size : (idx + 1) * tensor_size] = activation.flatten()
-                            tmp = np.abs(activation.flatten())
-                            tmp = sort_distr(tmp, res_length)
-                            all_data_test[idx * res_length : (idx + 1) * res_length] = tmp
+                            topk.update(activation)
                         elif 'use_max' in self.debug_cmd:
                             max_abs_value = max(np.max(np.abs(activation)), max_abs_value)
 
                 if 'use_percentile9999' in self.debug_cmd:
-                    # t0 = time.time()
-                    # time1 = time.time()
-                    # abs_value = np.percentile(np.abs(all_data), 99.99 + i * step)
-                    # time2 = time.time()
-                    res = np.sort(all_data_test)[-res_length:]
-                    inter = num * tensor_size - 1
-                    idx = int((per / 100) * inter)
-                    ratio = (per / 100) * inter - idx
-                    abs_value = res[0] + ratio * (res[1] - res[0]) if res_length != 1 else res[0]
-                    # time3 = time.time()
-                    # print(abs_value)
-                    # print(abs_value_test)
-                    # print("并行方法时间： {}s".format(time3 - time2))
-                    # print("numpy percentile方法时间： {}s".format(time2 - time1))
+                    abs_value = topk.percentile(per, num * tensor_size)
                 elif 'use_max' in self.debug_cmd:
                     #t0 = time.time()
                     abs_value = max_abs_value
-                if abs_value != None and abs_value <= 1e-5:
-                    # if op's outputs are all close to zero, change it to 1e-5 for them.
-                    min_value = -1e-5 if min_value < 0 else 0
-                    max_value = 1e-5
-                    abs_value = 1e-5
-                    print("WARNING: layer {} is all zeros. Please check the "
-                          "input data correctness.".format(out))
-                self.activations_statistics[out] = (min_value, max_value, abs_value)
+                min_value, max_value, abs_value = self.set_activation_statistics(
+                    out, min_value, max_value, abs_value)
 
                 if 'use_torch_observer_for_cali' not in self.debug_cmd:
                     for idx in range(self.args.input_num):
@@ -994,36 +1295,202 @@ class ActivationCalibrator(BaseKldCalibrator):
                         else:
                             histogram_data_map[out] += hist
                 else:
-                    qmin, qmax = -128, 127
-                    scale, zp = self.torchObserver_dict[out].calculate_qparams()
-                    threshold = float(scale * max(-(qmin-zp), (qmax-zp)))
-                    threshold = 1e-5 if (threshold <= 1e-5) else threshold  # fix me
-                    thresholds_map[out] = threshold
-                    thresholds_map_absmax[out] = threshold
-                    thresholds_map_scale[out] = scale.numpy()[0]
-                    thresholds_map_zp[out] = zp.numpy()[0]
+                    self.set_observer_thresholds(out, thresholds_map, thresholds_map_absmax,
+                                                 thresholds_map_scale, thresholds_map_zp)
 
                 for idx in range(self.args.input_num):
                     self.clear_ref_tensor(idx, out)
         pbar.close()
 
         if 'use_torch_observer_for_cali' not in self.debug_cmd:
-            thresholds_map = self.find_threshold(histogram_data_map, histogram_width_map, 128)
-            thresholds_map4 = self.find_threshold(histogram_data_map, histogram_width_map, 8)
-            for k, v in self.activations_statistics.items():
-                _, _, abs_val = v
-                thresholds_map_absmax[k] = abs_val
-                if thresholds_map[k] > abs_val:
-                    thresholds_map[k] = abs_val
-                    thresholds_map4[k] = abs_val
-                if 'use_percentile9999' in self.debug_cmd:
-                    thresholds_map[k] = abs_val
-                    thresholds_map4[k] = abs_val
-                elif 'use_max' in self.debug_cmd:
-                    thresholds_map[k] = abs_val
-                    thresholds_map4[k] = abs_val
+            thresholds_map, thresholds_map4 = self.calc_thresholds(histogram_data_map,
+                                                                   histogram_width_map,
+                                                                   thresholds_map_absmax)
         return thresholds_map, thresholds_map_absmax, thresholds_map_scale, thresholds_map_zp, thresholds_map4, thresholds_map_absmax4, thresholds_map_scale4, thresholds_map_zp4
 
+    def need_kld(self):
+        return 'use_percentile9999' not in self.debug_cmd and 'use_max' not in self.debug_cmd
+
+    def set_activation_statistics(self, out, min_value, max_value, abs_value):
+        if abs_value != None and abs_value <= 1e-5:
+            # if op's outputs are all close to zero, change it to 1e-5 for them.
+            min_value = -1e-5 if min_value < 0 else 0
+            max_value = 1e-5
+            abs_value = 1e-5
+            print("WARNING: layer {} is all zeros. Please check the "
+                  "input data correctness.".format(out))
+        self.activations_statistics[out] = (min_value, max_value, abs_value)
+        return min_value, max_value, abs_value
+
+    def set_observer_thresholds(self, out, thresholds_map, thresholds_map_absmax,
+                                thresholds_map_scale, thresholds_map_zp):
+        qmin, qmax = -128, 127
+        scale, zp = self.torchObserver_dict[out].calculate_qparams()
+        threshold = float(scale * max(-(qmin-zp), (qmax-zp)))
+        threshold = 1e-5 if (threshold <= 1e-5) else threshold  # fix me
+        thresholds_map[out] = threshold
+        thresholds_map_absmax[out] = threshold
+        thresholds_map_scale[out] = scale.numpy()[0]
+        thresholds_map_zp[out] = zp.numpy()[0]
+
+    def calc_thresholds(self, histogram_data_map, histogram_width_map, thresholds_map_absmax):
+        # use_max/use_percentile9999 take abs_val directly, so the kld search
+        # is skipped when the histograms were not collected
+        thresholds_map, thresholds_map4 = {}, {}
+        if len(histogram_data_map) > 0:
+            thresholds_map, thresholds_map4 = self.find_thresholds(histogram_data_map,
+                                                                   histogram_width_map, [128, 8])
+        for k, v in self.activations_statistics.items():
+            _, _, abs_val = v
+            thresholds_map_absmax[k] = abs_val
+            if k not in thresholds_map or thresholds_map[k] > abs_val:
+                thresholds_map[k] = abs_val
+                thresholds_map4[k] = abs_val
+            if 'use_percentile9999' in self.debug_cmd:
+                thresholds_map[k] = abs_val
+                thresholds_map4[k] = abs_val
+            elif 'use_max' in self.debug_cmd:
+                thresholds_map[k] = abs_val
+                thresholds_map4[k] = abs_val
+        return thresholds_map, thresholds_map4
+
+    def get_stream_plan(self):
+        # hook name -> (tensors to collect, percentile of the op)
+        plan = {}
+        all_tensors = self.parser.get_op_name_list()
+        step = (99.999999 - 99.99) / len(all_tensors)
+        for i, op_name in enumerate(all_tensors):
+            name = split_fuseop(op_name)
+            tensors = []
+            for out in self.parser.get_outputs_by_op_name(op_name):
+                if out != name and self.parser.get_use_count_by_op_name(out) == 0:
+                    continue
+                tensors.append(out)
+            plan[name] = (tensors, 99.99 + i * step)
+        return plan
+
+    def get_samples(self):
+        samples = []
+        for idx in range(self.args.input_num):
+            key = None if self.act_cache is None else self.sample_key(idx)
+            inputs = {name: data for name, (data, _) in self.ref_activations[idx].items()}
+            samples.append((key, inputs))
+        return samples
+
+    def sample_key(self, i):
+        return self.act_cache.sample_key(self.sample_files[i])
+
+    def stream_source(self):
+        if self.act_cache is None:
+            return self.module
+        if self.cached_module is None:
+            self.cached_module = CachedModule(self.module, self.act_cache)
+        return self.cached_module
+
+    def stream_invoke(self, hook, desc, plan):
+        cached = None if self.act_cache is None else self.stream_source()
+        pbar = tqdm(range(self.args.input_num), total=self.args.input_num, position=0, leave=True)
+        pbar.set_description(desc)
+        for sample in self.get_samples():
+            invoke_samples(self.module, [sample], hook, cached, plan)
+            pbar.update(1)
+        pbar.close()
+
+    def parallel_collect(self, plan, use_percentile, abs_map=None):
+        # each worker loads its own module and runs a contiguous shard of samples,
+        # all the partial statistics are order independent when merged
+        samples = self.get_samples()
+        workers = min(self.workers, len(samples))
+        shard = (len(samples) + workers - 1) // workers
+        tasks = [(self.args.mlir_file, samples[i:i + shard], plan, self.args.input_num,
+                  use_percentile, abs_map, self.histogram_bin_num, self.act_cache)
+                 for i in range(0, len(samples), shard)]
+        stats = ActivationStatistics()
+        desc = "activation_collect_and_calc_th: {} with {} workers".format(
+            "range" if abs_map is None else "histogram", workers)
+        pbar = tqdm(range(len(tasks)), total=len(tasks), position=0, leave=True)
+        pbar.set_description(desc)
+        with multiprocessing.Pool(workers) as pool:
+            for part in pool.imap_unordered(collect_statistics_worker, tasks):
+                stats.merge(part)
+                pbar.update(1)
+        pbar.close()
+        return stats
+
+    def activation_collect_and_calc_th_streaming(self):
+        """Collect statistics with one full invoke per sample.
+
+        Every activation is folded into ActivationStatistics inside an
+        after_invoke hook and released right away, so memory stays bounded
+        by a single sample. A second pass builds the histograms once the
+        abs_max of each tensor is known. With --workers the samples are
+        sharded over processes and the partial statistics are merged.
+        """
+        self.activations_statistics = {}
+        thresholds_map = {}
+        thresholds_map_absmax = {}
+        thresholds_map_scale = {}
+        thresholds_map_zp = {}
+        thresholds_map4 = {}
+        use_observer = 'use_torch_observer_for_cali' in self.debug_cmd
+        use_percentile = 'use_percentile9999' in self.debug_cmd
+        num = self.args.input_num
+        plan = self.get_stream_plan()
+        parallel = self.workers > 1 and not use_observer
+        if self.workers > 1 and use_observer:
+            print("WARNING: torch observer can not be merged across workers, run in one process")
+
+        if use_observer:
+            source = self.stream_source()
+
+            def observer_hook(layer_name):
+                if layer_name not in plan:
+                    return
+                from torch import Tensor
+                for out in plan[layer_name][0]:
+                    activation = source.get_tensor(out)
+                    self.torchObserver_dict[out](Tensor(activation.astype(np.float32)))
+
+            self.stream_invoke(observer_hook, "activation_collect_and_calc_th: observer", plan)
+            for tensors, _ in plan.values():
+                for out in tensors:
+                    self.set_observer_thresholds(out, thresholds_map, thresholds_map_absmax,
+                                                 thresholds_map_scale, thresholds_map_zp)
+            return thresholds_map, thresholds_map_absmax, thresholds_map_scale, thresholds_map_zp, thresholds_map4, {}, {}, {}
+
+        if parallel:
+            stats = self.parallel_collect(plan, use_percentile)
+        else:
+            stats = ActivationStatistics()
+            self.stream_invoke(stats.range_hook(self.stream_source(), plan, num, use_percentile),
+                               "activation_collect_and_calc_th: range", plan)
+
+        for tensors, per in plan.values():
+            # same as the op-by-op path, the range accumulates over all outputs of an op
+            min_value, max_value = inf, -inf
+            for out in tensors:
+                if out not in stats.min_map:
+                    continue
+                min_value = min(stats.min_map[out], min_value)
+                max_value = max(stats.max_map[out], max_value)
+                abs_value = max(abs(min_value), abs(max_value))
+                if use_percentile:
+                    abs_value = stats.percentile(out, per)
+                min_value, max_value, abs_value = self.set_activation_statistics(
+                    out, min_value, max_value, abs_value)
+
+        if self.need_kld():
+            abs_map = {k: v[2] for k, v in self.activations_statistics.items()}
+            if parallel:
+                stats = self.parallel_collect(plan, use_percentile, abs_map)
+            else:
+                self.stream_invoke(
+                    stats.hist_hook(self.stream_source(), plan, abs_map, self.histogram_bin_num),
+                    "activation_collect_and_calc_th: histogram", plan)
+        thresholds_map, thresholds_map4 = self.calc_thresholds(stats.hist_map, stats.width_map,
+                                                               thresholds_map_absmax)
+        return thresholds_map, thresholds_map_absmax, thresholds_map_scale, thresholds_map_zp, thresholds_map4, {}, {}, {}
+
     def run(self):
         layer_name_list = []
         thresholds_map_list = []
@@ -17,12 +17,17 @@ import sys
 import copy
 import time
 import datetime
+import multiprocessing
+from itertools import chain
 from tqdm import tqdm
 from utils.mlir_shell import mlir_lowering
 from utils.mlir_parser import MlirParser
+from utils.build_cache import mlir_files, create_build_cache
 from utils.misc import parse_debug_cmd
 from utils.preprocess import preprocess
 from calibration.data_selector import DataSelector
+from calibration.data_loader import InputLoader
+from calibration.activation_cache import create_activation_cache
 from utils.misc import cos_sim, seed_all
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
@@ -74,8 +79,63 @@ def find_all_pre_layers(all_pre_layers, op_name, parser, exist_ref_layers=None):
             all_pre_layers.append(op_name)
 
 
+def invoke_from(module, top_op_name, input_data_dict: dict, extra_input_data_dict: dict, casts: dict,
+                global_compare_layers: list = None):
+    # set the inputs of top_op_name and run their casts, then the ops from top_op_name on
+    for k, v in chain(input_data_dict.items(), extra_input_data_dict.items()):
+        module.set_tensor_from_int(k, v)
+        for cast in casts.get(k, []):
+            print(f'invoke_at CastOp:{cast}')
+            module.invoke_at(cast)
+    print(f'invoke_from {top_op_name}')
+    module.invoke_from(top_op_name)
+    outputs = {}
+    if global_compare_layers is None:
+        for name in module.output_names:
+            outputs[name] = module.get_tensor(name).copy()
+    else:
+        for name in global_compare_layers:
+            outputs[name] = module.get_tensor(name).copy()
+    return outputs
+
+
+def mix_trial_sample(module, op_name, input_data_dict, extra_input_data_dict, casts, replaced,
+                     global_compare_layers):
+    outputs = invoke_from(module, op_name, input_data_dict, extra_input_data_dict, casts, global_compare_layers)
+    mix_layer_out = module.get_fp32_tensor(op_name)
+    replacements = {}
+    for name, cast in replaced.items():
+        replacements[name] = (module.get_tensor(cast).copy(), module.get_fp32_tensor(cast))
+    return outputs, mix_layer_out, replacements
+
+
+mix_trial_module = None
+mix_trial_id = None
+
+
+def init_mix_trial_worker():
+    global mix_trial_module, mix_trial_id
+    mix_trial_module, mix_trial_id = None, None
+
+
+def mix_trial_worker(task):
+    # the worker lives for the whole search, and loads the mix model of a trial once
+    global mix_trial_module, mix_trial_id
+    trial_id, mlir_file, op_name, casts, replaced, global_compare_layers, samples = task
+    if trial_id != mix_trial_id:
+        mix_trial_module = None
+        module = pymlir.module()
+        module.load(mlir_file)
+        mix_trial_module, mix_trial_id = module, trial_id
+    return [
+        mix_trial_sample(mix_trial_module, op_name, inputs, extra_inputs, casts, replaced,
+                         global_compare_layers) for inputs, extra_inputs in samples
+    ]
+
+
 class MixQuantModel:
-    def __init__(self, fp32_mlir, chip: str, calib_table: str = None, mix_table: str = None, fp_type: str = 'auto'):
+    def __init__(self, fp32_mlir, chip: str, calib_table: str = None, mix_table: str = None, fp_type: str = 'auto',
+                 build_cache=None):
         self.fp32_mlir = fp32_mlir
         self.chip = chip
         self.calib_table = None
@@ -94,8 +154,20 @@ class MixQuantModel:
                     exit(1)
 
         self.quanted_mlir_file = '{}.{}.tune.mlir'.format(fp32_mlir, 'mix' if mix_table else self.mode)
-        mlir_lowering(self.fp32_mlir, self.quanted_mlir_file, self.mode, self.chip, 1, 1,
-                      self.calib_table, False, self.mix_table)
+
+        def run():
+            mlir_lowering(self.fp32_mlir, self.quanted_mlir_file, self.mode, self.chip, 1, 1,
+                          self.calib_table, False, self.mix_table)
+
+        if build_cache is None:
+            run()
+        else:
+            # a candidate mix table already tried, here or in another search, is not lowered again
+            build_cache.run_stage("lowering",
+                                  mlir_files(self.fp32_mlir) + [self.calib_table, self.mix_table],
+                                  {"lowering": [self.mode, self.chip, 1, 1, False]},
+                                  [self.quanted_mlir_file], run,
+                                  lambda: mlir_files(self.quanted_mlir_file)[1:])
         self.module = pymlir.module()
         self.module.load(self.quanted_mlir_file)
         self.parser = MlirParser(self.quanted_mlir_file)
@@ -114,40 +186,18 @@ class MixQuantModel:
                 outputs[name] = self.module.get_tensor(name).copy()
         return outputs
 
+    def cast_users(self, name):
+        # the casts converting tensor name for its users in another precision
+        return [
+            next_op for next_op in self.parser.get_next_op_by_op_name(name)
+            if self.parser.get_op_by_op_name(next_op).type == "tpu.Cast"
+        ]
+
     def infer_from(self, top_op_name, input_data_dict: dict, extra_input_data_dict: dict,
                    global_compare_layers: list = None):
-        # print('mix model op list:', self.parser.get_op_name_list())
-        for k in input_data_dict:
-            self.module.set_tensor_from_int(k, input_data_dict[k])
-            print(f'infer_from set_tensor:{k}')
-            # print('set value:', input_data_dict[k].flatten()[:32])
-            next_ops = self.parser.get_next_op_by_op_name(k)
-            print(f'infer_from {k}\'s next_ops:{next_ops}')
-            for next_op in next_ops:
-                op = self.parser.get_op_by_op_name(next_op)
-                if op.type == "tpu.Cast":
-                    print(f'invoke_at CastOp:{next_op}')
-                    self.module.invoke_at(next_op)
-        for k in extra_input_data_dict:
-            print(f'infer_from set_extra_tensor:{k}')
-            self.module.set_tensor_from_int(k, extra_input_data_dict[k])
-            next_ops = self.parser.get_next_op_by_op_name(k)
-            print(f'infer_from {k}\'s next_ops:{next_ops}')
-            for next_op in next_ops:
-                op = self.parser.get_op_by_op_name(next_op)
-                if op.type == "tpu.Cast":
-                    print(f'invoke_at CastOp:{next_op}')
-                    self.module.invoke_at(next_op)
-        print(f'invoke_from {top_op_name}')
-        self.module.invoke_from(top_op_name)
-        outputs = {}
-        if global_compare_layers is None:
-            for name in self.module.output_names:
-                outputs[name] = self.module.get_tensor(name).copy()
-        else:
-            for name in global_compare_layers:
-                outputs[name] = self.module.get_tensor(name).copy()
-        return outputs
+        casts = {k: self.cast_users(k) for k in chain(input_data_dict, extra_input_data_dict)}
+        return invoke_from(self.module, top_op_name, input_data_dict, extra_input_data_dict, casts,
+                           global_compare_layers)
 
     def clean(self):
         try:
@@ -158,6 +208,193 @@ class MixQuantModel:
             pass
 
 
+class MixPrecModule:
+    """A top mlir with its int8 and float models, lowered and loaded once,
+    run op by op with each op in the precision chosen for it.
+
+    set_precision and set_threshold switch a top op between int8 and float,
+    or give it another threshold, by name at runtime. A tensor crossing
+    precisions is set into the tpu op using it by set_tensor, which quantizes
+    it as the cast of a mix lowering would.
+
+    This is an emulation on the pymlir module api, the lowered models are not
+    changed: an int8 op with its own threshold runs in float and its outputs
+    are quantized on the int8 grid of the new threshold, signed or unsigned
+    as the type of the int8 model. Its int8 users, and the ops passing its
+    quant type on (Reshape, Permute, ...), read the tensor on that grid as a
+    lowering with the new threshold would: they also run in float, and their
+    outputs are quantized on their own int8 grid. The values differ from a
+    model lowered again only by the quantization of the weights of these ops.
+
+    The fp32 activations of all the ops of each sample are kept, and an infer
+    after some switches runs again only the switched ops and the ops after
+    them. The samples are kept up to max_cache_size bytes, the others run
+    from the inputs at each infer.
+    """
+
+    def __init__(self, fp32_mlir, int8_model: MixQuantModel, float_model: MixQuantModel,
+                 max_cache_size: float = 20 * 1024**3):
+        self.parser = MlirParser(fp32_mlir)
+        self.models = {"int8": int8_model, "float": float_model}
+        self.input_names = [op.name for op in self.parser.inputs]
+        self.output_names = list(self.parser.get_output_op_names_n_shapes())
+        self.top_tensors = set(self.parser.get_op_output_name_list())
+        self.segments = {mode: {} for mode in self.models}
+        self.qinfos = {}
+        self.precisions = {}
+        self.thresholds = {}
+        # activations of each sample index, with the states they are of
+        self.samples = {}
+        self.max_cache_size = max_cache_size
+        self.cache_size = 0
+
+    def segment(self, mode, op):
+        # the tpu ops lowered from op, in order, and the top tensors they read
+        if op.name in self.segments[mode]:
+            return self.segments[mode][op.name]
+        parser = self.models[mode].parser
+        ops, inputs, visited = [], [], set()
+
+        def visit(tensor):
+            if tensor in visited:
+                return
+            visited.add(tensor)
+            producer = parser.get_producer_by_tensor_name(tensor)
+            if producer is None:
+                # weight
+                return
+            for opd in producer.opds:
+                if opd in self.top_tensors:
+                    if opd not in inputs:
+                        inputs.append(opd)
+                else:
+                    visit(opd)
+            if producer.name not in ops:
+                ops.append(producer.name)
+
+        for output in op.outputs:
+            if parser.get_producer_by_tensor_name(output) is None:
+                ops = None
+                break
+            visit(output)
+        self.segments[mode][op.name] = (ops, inputs)
+        return ops, inputs
+
+    def qinfo(self, name):
+        # (scale, zero point, qmin, qmax) of the tensor in the int8 model, None if not int8
+        if name not in self.qinfos:
+            q = self.models["int8"].module.get_tensor_qinfo(name)
+            if q.dtype == "I8":
+                self.qinfos[name] = (q.scale, q.zp, -128, 127)
+            elif q.dtype == "U8":
+                self.qinfos[name] = (q.scale, q.zp, 0, 255)
+            else:
+                self.qinfos[name] = None
+        return self.qinfos[name]
+
+    def grids(self):
+        # the int8 grids changed by the thresholds, by tensor name
+        grids = {}
+        for op in self.parser.ops:
+            if self.precision(op.name) != "int8":
+                continue
+            threshold = self.thresholds.get(op.name)
+            for name in op.outputs:
+                q = self.qinfo(name)
+                if q is None:
+                    continue
+                scale, zp, qmin, qmax = q
+                if threshold is not None:
+                    # as getScale of the lowering
+                    grids[name] = (threshold / (127.0 if qmin < 0 else 255.0), zp, qmin, qmax)
+                    continue
+                for opd in op.opds:
+                    # the lowering gives the output the type of the input
+                    if opd in grids and self.qinfo(opd) == q:
+                        grids[name] = grids[opd]
+                        break
+        return grids
+
+    def precision(self, op_name):
+        return self.precisions.get(op_name, "int8")
+
+    def set_precision(self, op_name, mode):
+        assert mode in self.models, mode
+        self.precisions[op_name] = mode
+
+    def set_mix_layers(self, fp_layer_list):
+        # fp_layer_list in float, the other ops in int8
+        self.precisions = {op.name: "int8" for op in self.parser.ops}
+        for op_name in fp_layer_list:
+            self.precisions[op_name] = "float"
+
+    def set_threshold(self, op_name, threshold):
+        self.thresholds[op_name] = float(threshold)
+
+    def reset_threshold(self, op_name):
+        self.thresholds.pop(op_name, None)
+
+    def state(self, op_name):
+        return self.precision(op_name), self.thresholds.get(op_name)
+
+    def run_op(self, op, activations, grids):
+        mode = self.precision(op.name)
+        requant = mode == "int8" and any(name in grids for name in chain(op.opds, op.outputs))
+        if requant:
+            mode = "float"
+        ops, inputs = self.segment(mode, op)
+        if ops is None:
+            # folded by the lowering of this precision
+            mode = "float" if mode == "int8" else "int8"
+            ops, inputs = self.segment(mode, op)
+            if ops is None:
+                raise RuntimeError("op {} not found in the lowered mlir".format(op.name))
+            requant = False
+        module = self.models[mode].module
+        for name in inputs:
+            module.set_tensor(name, activations[name])
+        for name in ops:
+            module.invoke_at(name)
+        for name in op.outputs:
+            data = np.array(module.get_fp32_tensor(name), dtype=np.float32)
+            q = grids.get(name, self.qinfo(name)) if requant else None
+            if q is not None:
+                scale, zp, qmin, qmax = q
+                # rounding half away from zero, as to_int8 of the interpreter
+                d = data / scale + zp
+                data = (np.clip(np.trunc(d + np.copysign(0.5, d)), qmin, qmax) - zp) * scale
+            activations[name] = data.astype(np.float32)
+
+    def infer(self, data: list, global_compare_layers: list = None, sample: int = None):
+        # sample: index of the inputs, to run again only the changed ops of the
+        # activations kept of the previous infer of it
+        activations, states = self.samples.get(sample, ({}, {}))
+        changed = set()
+        for op in self.parser.ops:
+            if op.name not in changed and states.get(op.name) != self.state(op.name):
+                changed.update(self.parser.get_all_next_ops_by_op_name(op.name))
+        grids = self.grids()
+        for name, d in zip(self.input_names, data):
+            activations[name] = np.array(d, dtype=np.float32)
+        for op in self.parser.ops:
+            if op.name not in changed:
+                continue
+            if op.type != "top.Input":
+                self.run_op(op, activations, grids)
+            states[op.name] = self.state(op.name)
+        if sample is not None and sample not in self.samples:
+            size = sum(a.nbytes for a in activations.values())
+            if self.cache_size + size <= self.max_cache_size:
+                self.samples[sample] = (activations, states)
+                self.cache_size += size
+        names = self.output_names if global_compare_layers is None else global_compare_layers
+        return {name: activations[name].copy() for name in names}
+
+    def clean(self):
+        self.samples.clear()
+        self.cache_size = 0
+
+
 class MixPrecSearcher:
     def __init__(self, args):
         self.args = args
@@ -175,6 +412,11 @@ class MixPrecSearcher:
                 exit(1)
 
         self.parser = MlirParser(args.mlir_file)
+        # processes running the samples of a candidate mix model
+        self.workers = getattr(args, 'workers', 1)
+        self.pool = None
+        self.trial_id = 0
+        self.build_cache = create_build_cache(args)
         self.batch_size = self.parser.get_batch_size()
         self.input_num = self.parser.get_input_num()
         self.num_sample = 0
@@ -213,6 +455,8 @@ class MixPrecSearcher:
 
     def _init_inputs(self, args):
         self.ref_activations = {}
+        # input files of each sample, to key the activation cache
+        self.sample_files = {}
         tune_idx = 0
         self.ref_activations[tune_idx] = {}
         input_names = [op.name for op in self.parser.inputs]
@@ -228,50 +472,18 @@ class MixPrecSearcher:
                 for i in range(self.batch_size - n):
                     ds.data_list.append(ds.data_list[-1])
             self.num_sample = len(ds.data_list) // self.batch_size
-            batched_idx = 0
-            batched_inputs = self.input_num * ['']
-            for data in ds.data_list:
-                inputs = data.split(',')
-                inputs = [s.strip() for s in inputs]
-                assert (len(inputs) == self.input_num)
-                batched_idx += 1
-                for i, input in enumerate(input_names):
-                    batched_inputs[i] += '{},'.format(inputs[i])
-                    if batched_idx == self.batch_size:
-                        x = ppa_list[i].run(batched_inputs[i][:-1])
-                        count = self.parser.get_user_count_by_op_name(input)
-                        self.ref_activations[tune_idx][input] = [x, count]
-                if batched_idx == self.batch_size:
-                    tune_idx += 1
-                    batched_idx = 0
-                    batched_inputs = self.input_num * ['']
-                    self.ref_activations[tune_idx] = {}
-        elif ds.all_npy:
-            self.num_sample = len(ds.data_list)
-            self.input_data_buffer = [[] for i in range(self.num_sample)]
-            for data in ds.data_list:
-                inputs = data.split(',')
-                inputs = [s.strip() for s in inputs]
-                assert (len(inputs) == self.input_num)
-                for name, npy in zip(input_names, inputs):
-                    x = np.load(npy)
-                    count = self.parser.get_user_count_by_op_name(name)
-                    self.ref_activations[tune_idx][name] = [x, count]
-                tune_idx += 1
-                self.ref_activations[tune_idx] = {}
-        elif ds.all_npz:
+        elif ds.all_npy or ds.all_npz:
             self.num_sample = len(ds.data_list)
             self.input_data_buffer = [[] for i in range(self.num_sample)]
-            input_names = [op.name for op in self.parser.inputs]
-            for data in ds.data_list:
-                npz = np.load(data)
-                for name in input_names:
-                    count = self.parser.get_user_count_by_op_name(name)
-                    self.ref_activations[tune_idx][name] = [npz[name], count]
-                tune_idx += 1
-                self.ref_activations[tune_idx] = {}
         else:
             raise RuntimeError("dataset is uncorrect")
+        for files, inputs in InputLoader(ds, ppa_list, input_names, self.batch_size):
+            for name in input_names:
+                count = self.parser.get_user_count_by_op_name(name)
+                self.ref_activations[tune_idx][name] = [inputs[name], count]
+            self.sample_files[tune_idx] = files
+            tune_idx += 1
+            self.ref_activations[tune_idx] = {}
         self.int8_activations = copy.deepcopy(self.ref_activations)
 
     def _gen_mix_table(self, mix_ops):
@@ -400,17 +612,29 @@ class MixPrecSearcher:
         if op_name in data_dict[i]:
             return False
         input_ops = model.parser.get_pre_op_by_op_name(op_name)
+        # only the float activations are worth caching, int8 ones need the
+        # fp32 tensor of the module as well
+        cache = None if is_int8_data else self.get_activation_cache(model)
+        value = None
+        if cache is not None and len(input_ops) > 0:
+            key = cache.sample_key(self.sample_files[i])
+            value = cache.get(key, op_name)
         for input_op in input_ops:
             data = data_dict[i][input_op][0]
             if data is None:
                 raise Exception(f"{op_name} \'s input:{input_op} not exist")
+            if value is not None:
+                continue
             if is_int8_data:
                 model.module.set_tensor_from_int(input_op, data)
             else:
                 model.module.set_tensor(input_op, data)
         if len(input_ops) > 0:
-            value = model.module.invoke_at(op_name).copy()
-            self.logger.print_dbg(f'invoke_at {op_name}')
+            if value is None:
+                value = model.module.invoke_at(op_name).copy()
+                self.logger.print_dbg(f'invoke_at {op_name}')
+                if cache is not None:
+                    cache.put(key, op_name, value)
             fp32_v = None
             if is_int8_data:
                 fp32_v = model.module.get_fp32_tensor(op_name)
@@ -421,6 +645,12 @@ class MixPrecSearcher:
                 data_dict[i][op_name] = [value.copy(), count, fp32_v]
         return True
 
+    def get_activation_cache(self, model):
+        # one cache per lowered model, keyed by the content of its mlir file
+        if not hasattr(model, 'act_cache'):
+            model.act_cache = create_activation_cache(self.args, model.quanted_mlir_file)
+        return model.act_cache
+
     def visual_tensor_diff(self, name, cos, int8_out, fp32_out):
         data_size = fp32_out.size
         max_sampling = 10000
@@ -586,7 +816,10 @@ class MixPrecSearcher:
             data = []
             for name in list(self.ref_activations[idx].keys()):
                 data.append(self.ref_activations[idx][name][0])
-            outputs = model.infer(data, global_compare_layers)
+            if isinstance(model, MixPrecModule):
+                outputs = model.infer(data, global_compare_layers, idx)
+            else:
+                outputs = model.infer(data, global_compare_layers)
             if self.post_process_path:
                 module_path = self.post_process_path
                 module_name = self.post_process_name
@@ -688,8 +921,10 @@ class MixPrecSearcher:
         self.dot_log.add_node_label(op.name, f'cos too low, set {self.mix_mode} to {op.name} and next_top_ops:{tmp}')
         fp_layer_list.extend(next_top_ops)
         mix_table = self._gen_mix_table(fp_layer_list)
-        mix_model = MixQuantModel(self.fp32_mlir, self.chip, self.calib_table, mix_table, self.args.fp_type)
+        mix_model = MixQuantModel(self.fp32_mlir, self.chip, self.calib_table, mix_table, self.args.fp_type,
+                                  self.build_cache)
         extra_input = self.get_extra_input_tensor(op.name, self.parser)
+        samples = []
         for idx in range(self.num_sample):
             input_data_dict, extra_input_data_dict = self.collect_op_input_tensor(idx, op.name, extra_input,
                                                                                   fp_layer_list)
@@ -698,8 +933,16 @@ class MixPrecSearcher:
                 list(extra_input_data_dict.keys()))
             if idx == 0:
                 self.dot_log.add_node_label(op.name, f'input_data_dict:{tmp1}{tmp2}, call infer_from')
-            outputs = mix_model.infer_from(op.name, input_data_dict, extra_input_data_dict, global_compare_layers)
-            mix_layer_out = mix_model.module.get_fp32_tensor(op.name)
+            samples.append((input_data_dict, extra_input_data_dict))
+        casts = {k: mix_model.cast_users(k) for k in chain(*samples[0])} if samples else {}
+        # the int8 activations of the next ops are replaced by their casts in the mix model
+        replaced = {}
+        for next_top_op in next_top_ops:
+            for next_op in mix_model.cast_users(next_top_op):
+                self.dot_log.add_node_label(op.name, f'use {next_op} to replace {next_top_op}')
+                replaced[next_top_op] = next_op
+        results = self.run_mix_trial(mix_model, op.name, samples, casts, replaced, global_compare_layers)
+        for idx, (outputs, mix_layer_out, replacements) in enumerate(results):
             fp32_out = self.get_input_fp32_tensor(idx, op.name)
             cos = cos_sim(mix_layer_out.reshape(-1), fp32_out.reshape(-1))
             if idx == 0:
@@ -708,17 +951,36 @@ class MixPrecSearcher:
             for next_top_op in next_top_ops:
                 count = self.parser.get_user_count_by_op_name(next_top_op)
                 self.int8_activations[idx][next_top_op] = [None, count, None]
-                next_ops = mix_model.parser.get_next_op_by_op_name(next_top_op)
-                print(f'{next_top_op}\'s next_ops:', ','.join(next_ops))
-                for next_op in next_ops:
-                    if mix_model.parser.get_op_by_op_name(next_op).type == "tpu.Cast":
-                        if idx == 0:
-                            self.dot_log.add_node_label(op.name, f'use {next_op} to replace {next_top_op}')
-                        self.int8_activations[idx][next_top_op][0] = mix_model.module.get_tensor(next_op).copy()
-                        self.int8_activations[idx][next_top_op][2] = mix_model.module.get_fp32_tensor(next_op)
+                if next_top_op in replacements:
+                    data, fp32_data = replacements[next_top_op]
+                    self.int8_activations[idx][next_top_op][0] = data
+                    self.int8_activations[idx][next_top_op][2] = fp32_data
         outputs_cos = outputs_cos / self.num_sample
         return outputs_cos, mix_model
 
+    def run_mix_trial(self, mix_model, op_name, samples, casts, replaced, global_compare_layers):
+        # only the ops from op_name on run, from the cached activations of its inputs; with
+        # workers, the samples are sharded over the processes of the search
+        self.trial_id += 1
+        workers = min(self.workers, len(samples))
+        if workers <= 1:
+            return [
+                mix_trial_sample(mix_model.module, op_name, inputs, extra_inputs, casts, replaced,
+                                 global_compare_layers) for inputs, extra_inputs in samples
+            ]
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers, initializer=init_mix_trial_worker)
+        shard = (len(samples) + workers - 1) // workers
+        tasks = [(self.trial_id, mix_model.quanted_mlir_file, op_name, casts, replaced,
+                  global_compare_layers, samples[i:i + shard]) for i in range(0, len(samples), shard)]
+        return list(chain(*self.pool.map(mix_trial_worker, tasks, chunksize=1)))
+
+    def close_pool(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
     def search_mix_layer(self, float_model, int8_model, layer_cos_list, predictions_gt, fp_layer_list,
                       global_compare_layers, layers_rate, all_pre_layers, all_int8_cos):
         outputs_cos = 0
@@ -728,7 +990,6 @@ class MixPrecSearcher:
         max_fp32_layer_num = len(top_op_names) // 4
         fp_op_names = float_model.parser.get_op_name_list()
         top_ops = {op.name: op for op in self.parser.ops}
-        int8_model = MixQuantModel(self.fp32_mlir, self.chip, self.calib_table)
         int8_op_names = int8_model.parser.get_op_name_list()
         full_op_list = self.get_full_op_list(float_model, int8_model, fp_op_names, int8_op_names)
         try:
@@ -770,6 +1031,7 @@ class MixPrecSearcher:
         except Exception as err:
             self.logger.print_info('An exception happened: ' + str(err))
             pass
+        self.close_pool()
         self.dot_log.gen_dot_graph()
         int8_model.clean()
         float_model.clean()
@@ -807,10 +1069,10 @@ class MixPrecSearcher:
         layer_cos_list, predictions_gt, fp_layer_list = [], [], []
         os.system('rm -rf tensor_diff_fp32_vs_int8;mkdir -p tensor_diff_fp32_vs_int8/')
         global_compare_layers, layers_rate, all_pre_layers = self.extract_global_layers()
-        float_model = MixQuantModel(self.fp32_mlir, self.chip)
+        float_model = MixQuantModel(self.fp32_mlir, self.chip, build_cache=self.build_cache)
         _ = self.run_model(float_model, True, global_compare_layers, layers_rate, predictions_gt)
 
-        int8_model = MixQuantModel(self.fp32_mlir, self.chip, self.calib_table)
+        int8_model = MixQuantModel(self.fp32_mlir, self.chip, self.calib_table, build_cache=self.build_cache)
         outputs_cos = self.run_model(int8_model, False, global_compare_layers, layers_rate, predictions_gt)
         if outputs_cos > self.args.expected_cos:
             float_model.clean()
@@ -11,6 +11,7 @@ import logging
 from utils.mlir_parser import *
 from calibration.mix_precision import MixQuantModel
 from calibration.mix_precision import MixPrecSearcher
+from calibration.mix_precision import MixPrecModule
 from calibration.kld_calibrator import CalibrationTable, ActivationCalibrator, SimpleTuner
 from pathlib import Path
 from utils.net_dot_log import net_dot_log
@@ -131,8 +132,24 @@ class SensitiveLayer:
         return new_cali_table_name
 
 
+    def run_trial(self, mix_module, layer_name, threshold, new_cali_table_name, mix_table, global_compare_layers, layers_rate, predictions_gt):
+        if mix_module is None:
+            model = MixQuantModel(self.fp32_mlir, self.chip, new_cali_table_name, mix_table)
+        else:
+            # only layer_name and the layers after it run again
+            mix_module.set_threshold(layer_name, threshold)
+            model = mix_module
+        return 1 - self.mix_prec.run_model(model, False, global_compare_layers, layers_rate, predictions_gt)
+
     def search_sensitve_layer(self, layer_names, quantize_method_list, float_model, int8_model, layer_th_dicts, global_compare_layers, layers_rate, predictions_gt):
         num_quantize_method = len(quantize_method_list)
+        mix_module = None
+        if getattr(self.args, 'partial_infer', False):
+            if float_model.mode != self.mix_prec.mix_mode:
+                float_model = MixQuantModel(self.fp32_mlir, self.chip, fp_type=self.mix_prec.mix_mode)
+            max_cache_size = getattr(self.args, 'partial_infer_cache_size', 20) * 1024**3
+            mix_module = MixPrecModule(self.fp32_mlir, int8_model, float_model, max_cache_size)
+            mix_module.set_mix_layers(layer_names)
         fp_layer_list = []
         for op_name in layer_names:
             fp_layer_list.append(op_name)
@@ -144,6 +161,8 @@ class SensitiveLayer:
             self.mix_prec.logger.print_info("start to handle layer: {}, type: {}".format(layer_name, layer_type))
             fp_layer_list.remove(layer_name)
             mix_table = self.mix_prec._gen_mix_table(fp_layer_list)
+            if mix_module is not None:
+                mix_module.set_precision(layer_name, "int8")
             ret = False
             while not ret:
                 if layer_name not in modified_layers:
@@ -154,8 +173,7 @@ class SensitiveLayer:
                     new_cali_table_name = self.set_layer_new_th(int8_model, layer_name, new_th)
                     last_tried_method = method
                     self.mix_prec.logger.print_info("adjust layer {} th, with method {}, and threshlod {}".format(layer_name, method, new_th))
-                    mixmodel = MixQuantModel(self.fp32_mlir, self.chip, new_cali_table_name, mix_table)
-                    outputs_cos = 1 - self.mix_prec.run_model(mixmodel, False, global_compare_layers, layers_rate, predictions_gt)
+                    outputs_cos = self.run_trial(mix_module, layer_name, new_th, new_cali_table_name, mix_table, global_compare_layers, layers_rate, predictions_gt)
                     self.mix_prec.logger.print_info("outputs_cos_los = {}".format(outputs_cos))
                 elif modified_layers[layer_name][0] < num_quantize_method:
                     method_idx = modified_layers[layer_name][0]
@@ -169,8 +187,7 @@ class SensitiveLayer:
                     last_tried_method = method
                     self.mix_prec.logger.print_info("adjust layer {} th, with method {}, and threshlod {}".format(layer_name, method, new_th))
                     modified_layers[layer_name][0] += 1
-                    mixmodel = MixQuantModel(self.fp32_mlir, self.chip, new_cali_table_name, mix_table)
-                    outputs_cos = 1 - self.mix_prec.run_model(mixmodel, False, global_compare_layers, layers_rate, predictions_gt)
+                    outputs_cos = self.run_trial(mix_module, layer_name, new_th, new_cali_table_name, mix_table, global_compare_layers, layers_rate, predictions_gt)
                     self.mix_prec.logger.print_info("outputs_cos_los = {}".format(outputs_cos))
                 elif modified_layers[layer_name][0] == num_quantize_method:
                     if outputs_cos < modified_layers[layer_name][1]:
@@ -185,7 +202,12 @@ class SensitiveLayer:
                     sensitive_layer_analysis_dict[layer_name] = [modified_layers[layer_name][1], layer_type]
                     ret = True
 
+            if mix_module is not None:
+                mix_module.set_precision(layer_name, "float")
+                mix_module.reset_threshold(layer_name)
             fp_layer_list.append(layer_name)
+        if mix_module is not None:
+            mix_module.clean()
         return sensitive_layer_analysis_dict, new_cali_table_name
 
     def analysis_sensitive_layers(self, sensitive_layer_analysis_dict):
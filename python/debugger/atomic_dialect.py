@@ -9,7 +9,8 @@
 
 from enum import Enum
 from typing import Any, List, Tuple
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from bisect import bisect_right
 from .disassembler import (
     BModel,
     Net,
@@ -69,6 +70,118 @@ def decode_cmdgroup(
     return cmdgroup
 
 
+class CmdGroupList:
+    """
+    Command groups of a subnet, decoded when accessed. Only the last
+    cache_size decoded groups are kept: the registers of a command are a view
+    of the bmodel binary, so a group decoded again sees the edits done before.
+    """
+
+    def __init__(self, context: BModelContext, cmd_groups, cache_size=8):
+        # cmd_groups: [(CmdGroup, subnet_id, core_id)]
+        self.context = context
+        self.cmd_groups = cmd_groups
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.cmd_groups)
+
+    def __getitem__(self, index) -> StaticCmdGroup:
+        if isinstance(index, slice):
+            return [self[i] for i in range(len(self))[index]]
+        if index < 0:
+            index += len(self)
+        if index in self.cache:
+            self.cache.move_to_end(index)
+            return self.cache[index]
+        cmd_group, subnet_id, core_id = self.cmd_groups[index]
+        group = decode_cmdgroup(self.context, cmd_group, subnet_id, core_id)
+        self.cache[index] = group
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return group
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class LazyCmdList:
+    """
+    Commands of all the groups of a CmdGroupList, as one list. The number of
+    commands of a group is only known after decoding it (system commands are
+    dropped by merge_instruction), so groups are decoded in order up to the
+    index asked, and their sizes kept.
+    """
+
+    def __init__(self, groups: CmdGroupList):
+        self.groups = groups
+        # starts[i]: index of the first command of group i
+        self.starts = [0]
+
+    def _count(self, group_id):
+        while len(self.starts) <= group_id + 1 and len(self.starts) <= len(self.groups):
+            i = len(self.starts) - 1
+            self.starts.append(self.starts[-1] + len(self.groups[i].all))
+
+    def __len__(self):
+        self._count(len(self.groups))
+        return self.starts[-1]
+
+    def _locate(self, index):
+        while self.starts[-1] <= index and len(self.starts) <= len(self.groups):
+            self._count(len(self.starts) - 1)
+        group_id = bisect_right(self.starts, index) - 1
+        if index < 0 or group_id >= len(self.groups):
+            raise IndexError("cmd index out of range")
+        return group_id, index - self.starts[group_id]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(len(self))[index]]
+        if index < 0:
+            index += len(self)
+        group_id, offset = self._locate(index)
+        return self.groups[group_id].all[offset]
+
+    def __iter__(self):
+        for group in self.groups:
+            yield from group.all
+
+
+class ChainCmdList:
+    # the operations of several blocks, as one list
+    def __init__(self, cmd_lists):
+        self.cmd_lists = cmd_lists
+        self.starts = None
+
+    def _index(self):
+        if self.starts is None:
+            self.starts = [0]
+            for x in self.cmd_lists:
+                self.starts.append(self.starts[-1] + len(x))
+
+    def __len__(self):
+        self._index()
+        return self.starts[-1]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(len(self))[index]]
+        self._index()
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("cmd index out of range")
+        list_id = bisect_right(self.starts, index) - 1
+        return self.cmd_lists[list_id][index - self.starts[list_id]]
+
+    def __iter__(self):
+        for x in self.cmd_lists:
+            yield from x
+
+
 class _AtomicContext:
     def __call__(self, bmodel_net: BModel, bmodel_context: BModelContext) -> Any:
         self.bmodel_net = bmodel_net
@@ -212,20 +325,17 @@ class Block(Node):
                     self.operations.extend(msgcore.sys_cmds)
                 return
 
+            # single core, decoded when used
             if subnet.cmd_group:
-                self.cmds = [
-                    decode_cmdgroup(context, x, self.subnet_id)
-                    for x in subnet.cmd_group
-                ]
+                cmd_groups = [(x, self.subnet_id, 0) for x in subnet.cmd_group]
             else:
-                self.cmds = [
-                    decode_cmdgroup(context, cmd, self.subnet_id, core_id)
+                cmd_groups = [
+                    (cmd, self.subnet_id, core_id)
                     for core_id, x in enumerate(subnet.core_commands)
                     for cmd in x.gdma_tiu_commands
                 ]
-
-            for x in self.cmds:
-                self.operations.extend(x.all)
+            self.cmds = CmdGroupList(context, cmd_groups)
+            self.operations = LazyCmdList(self.cmds)
 
     @functools.lru_cache()
     def __str__(self):
@@ -344,12 +454,14 @@ class MlirModule(Node):
         self.functions = [Function(x, 1) for x in self.bmodel.net]
 
     def create_cmdlist(self) -> List[BaseTpuCmd]:
-        res = []
-        for func in self.functions:
-            for region in func.regions:
-                for block in region.blocks:
-                    res.extend(block.operations)
-        return res
+        return ChainCmdList(
+            [
+                block.operations
+                for func in self.functions
+                for region in func.regions
+                for block in region.blocks
+            ]
+        )
 
     def dump_head(self):
         attrs = f'attributes {{chip = "{self.chip}", version = {self.version}}}'
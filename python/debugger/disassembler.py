@@ -6,6 +6,8 @@
 # third-party components.
 #
 # ==============================================================================
+import os
+import mmap
 import numpy as np
 from enum import Enum
 from pprint import pformat
@@ -30,7 +32,13 @@ class StaticCmdGroup(NamedTuple):
 
 
 class _BModelContext:
+    def __init__(self):
+        self.bmodel_net = None
+        self.outer = []
+
     def __call__(self, bmodel_net: "BModel"):
+        # nested when lazy items are created while loading another bmodel
+        self.outer.append(self.bmodel_net)
         self.bmodel_net = bmodel_net
         return self
 
@@ -38,7 +46,7 @@ class _BModelContext:
         pass
 
     def __exit__(self, *exc_info):
-        self.bmodel_net = None
+        self.bmodel_net = self.outer.pop()
 
 
 bmodel_context = _BModelContext()
@@ -46,26 +54,42 @@ bmodel_context = _BModelContext()
 
 class FBSArray:
     # flatbuffer array adapter, act like a list.
+    # items are created when first accessed, so only the parts of a bmodel
+    # that are used get parsed.
     def __init__(self, fbs, field, *args):
         self.field_name, self.field_cls = field
         name = self.field_name
 
         self.fbs = fbs
         assert hasattr(fbs, name + "Length"), name + "Length"
-        items = []
-        for s in range(getattr(fbs, name + "Length")()):
-            cmd = getattr(fbs, name)(s)
-            items.append(self.field_cls(cmd, *args))
-        self.items = items
+        self.args = args
+        self.bmodel_net = bmodel_context.bmodel_net
+        self.items = [None] * getattr(fbs, name + "Length")()
+
+    def _item(self, index):
+        item = self.items[index]
+        if item is None:
+            with bmodel_context(self.bmodel_net):
+                cmd = getattr(self.fbs, self.field_name)(index)
+                item = self.field_cls(cmd, *self.args)
+            self.items[index] = item
+        return item
 
     def __getitem__(self, index):
-        return self.items[index]
+        if isinstance(index, slice):
+            return [self._item(i) for i in range(len(self.items))[index]]
+        if index < 0:
+            index += len(self.items)
+        if not 0 <= index < len(self.items):
+            raise IndexError("FBSArray index out of range")
+        return self._item(index)
 
     def __len__(self):
         return len(self.items)
 
     def __iter__(self):
-        return self.items.__iter__()
+        for i in range(len(self.items)):
+            yield self._item(i)
 
     def serialize(self, builder, save_binary_fun):
         if self:
@@ -74,9 +98,9 @@ class FBSArray:
                 getattr(self.fbs, f"Start{self.field_name}Vector")(
                     builder, len(self.items)
                 )
-                [t.serialize(builder, save_binary_fun) for t in self.items]
+                [t.serialize(builder, save_binary_fun) for t in self]
                 return builder.EndVector()
-            array = [t.serialize(builder, save_binary_fun) for t in self.items]
+            array = [t.serialize(builder, save_binary_fun) for t in self]
             getattr(self.fbs, f"Start{self.field_name}Vector")(builder, len(self.items))
             for t in reversed(array):
                 builder.PrependUOffsetTRelative(t)
@@ -87,7 +111,7 @@ class FBSArray:
         return len(self) != 0
 
     def __repr__(self):
-        return pformat(self.items)
+        return pformat(list(self))
 
 
 class FBSOptional:
@@ -627,21 +651,33 @@ bmodel_header_type = np.dtype(
 
 
 class BModel:
-    def __init__(self, bmodel_file):
+    """
+    The file is memory-mapped: the binary section (commands, coeff, ...) is
+    paged in when used instead of being read at load. By default the map is
+    copy-on-write, so commands can be edited in place and saved by serialize
+    without touching the file; read_only maps it read-only for the tools that
+    never edit it.
+    """
+
+    def __init__(self, bmodel_file, read_only=False):
         with bmodel_context(self):
             self.head = None
             binary_desc = None
             binary = None
             self.file_name = bmodel_file
+            self.read_only = read_only
+            access = mmap.ACCESS_READ if read_only else mmap.ACCESS_COPY
             with open(bmodel_file, "rb") as file_obj:
-                file_obj.seek(0, 0)
-                self.head = np.frombuffer(
-                    file_obj.read(bmodel_header_type.itemsize), dtype=bmodel_header_type
-                )
-                binary_desc = file_obj.read(self.head["flatbuffers_size"][0])
-                binary = memoryview(
-                    bytearray(file_obj.read(self.head["binary_size"][0]))
-                )
+                self._mmap = mmap.mmap(file_obj.fileno(), 0, access=access)
+            offset = bmodel_header_type.itemsize
+            self.head = np.frombuffer(
+                self._mmap[:offset], dtype=bmodel_header_type
+            )
+            desc_size = int(self.head["flatbuffers_size"][0])
+            binary_size = int(self.head["binary_size"][0])
+            binary_desc = self._mmap[offset : offset + desc_size]
+            offset += desc_size
+            binary = memoryview(self._mmap)[offset : offset + binary_size]
             bmodel: bmodel_fbs.Model = bmodel_fbs.Model.GetRootAsModel(binary_desc, 0)
 
             self.binary = binary
@@ -662,6 +698,13 @@ class BModel:
     def __repr__(self):
         return pformat(self.__dict__)
 
+    def close(self):
+        try:
+            self._mmap.close()
+        except BufferError:
+            # commands still refer to the map, it is released with them
+            pass
+
     def serialize(self, file_name):
         import flatbuffers
 
@@ -707,10 +750,14 @@ class BModel:
             dtype=bmodel_header_type,
         )
 
-        with open(file_name, "w") as f:
+        # written aside then renamed, the source bmodel may be file_name and
+        # is still mapped
+        tmp_file = file_name + ".tmp"
+        with open(tmp_file, "w") as f:
             header.tofile(f)
             np.array(buffer).tofile(f)
             np.array(payload, np.uint8).tofile(f)
+        os.replace(tmp_file, file_name)
 
     def decode_cpu_op(self, cpu_param: CpuParam):
         return cpu_param
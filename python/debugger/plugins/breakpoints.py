@@ -9,6 +9,7 @@
 
 from typing import List, Union, Dict
 import re
+import numpy as np
 
 from debugger.tdb_support import (
     TdbCmdBackend,
@@ -88,6 +89,10 @@ class CmdIdBreakpoint(Breakpoint):
 
         return True
 
+    def stop_points(self, tdb: "TdbCmdBackend"):
+        points = np.flatnonzero((tdb.op_df["cmd_type"] == self.match_type).values)
+        return [p for p in points if tdb.cmditer[p].reg.cmd_id == self.match_index]
+
 
 class LocBreakpoint(Breakpoint):
     """final.mlir location"""
@@ -113,6 +118,25 @@ class MlirFileLineBreakpoint(Breakpoint):
 
         return loc.file_line == self.file_line
 
+    def stop_points(self, tdb: TdbCmdBackend):
+        index: FinalMlirIndexPlugin = tdb.get_plugin(FinalMlirIndexPlugin)
+        if not index.enabled:
+            return None
+        df = tdb.index_df
+        return df.loc[df["line-num"] == self.file_line, "executed_id"] - 1
+
+
+def mlir_text_points(tdb: TdbCmdBackend, text: str):
+    # cmd_points of the final.mlir lines containing text
+    index = tdb.get_plugin(FinalMlirIndexPlugin)  # type: FinalMlirIndexPlugin
+    if not index.enabled:
+        return []
+    lines = {
+        i + 1 for i, line in enumerate(index.final_mlir.lines) if line.find(text) >= 0
+    }
+    df = tdb.index_df
+    return df.loc[df["line-num"].isin(lines), "executed_id"] - 1
+
 
 class CmdFileLineBreakpoint(Breakpoint):
     """
@@ -143,6 +167,9 @@ class ValueIdBreakpoint(Breakpoint):
             return True
         return False
 
+    def stop_points(self, tdb: TdbCmdBackend):
+        return mlir_text_points(tdb, self.text)
+
 
 class DialectOpBreakpoint(Breakpoint):
     type = "dialect"
@@ -160,6 +187,9 @@ class DialectOpBreakpoint(Breakpoint):
             return True
         return False
 
+    def stop_points(self, tdb: TdbCmdBackend):
+        return mlir_text_points(tdb, self.text)
+
 
 class ASM1684NameBreakpoint(Breakpoint):
     type = "1684-asm"
@@ -236,6 +266,17 @@ class Breakpoints:
                 return self.breaks.pop(index)
         return None
 
+    def stop_points(self, tdb: "TdbCmdBackend"):
+        points = []
+        for v in self.breaks.values():
+            if not v.enabled:
+                continue
+            break_points = v.stop_points(tdb)
+            if break_points is None:
+                return None
+            points.extend(break_points)
+        return points
+
     def should_break(self, tdb: "TdbCmdBackend"):
         for _, v in self.breaks.items():
             if v.enabled and v.should_stop(tdb):
@@ -340,18 +381,23 @@ class BreakpointPlugin(TdbPlugin, TdbPluginCmd):
 
     def after_load(self, tdb: TdbCmdBackend):
         self.breakpoints._clear()
+        self.stoped_op = None
+
+    def step_points(self, tdb: TdbCmdBackend):
+        return self.breakpoints.stop_points(tdb)
 
     def before_step(
         self,
         tdb: "TdbCmdBackend",
     ):
-        cmd = tdb.get_cmd()
-        if cmd == self.stoped_op:
+        # cmds are decoded again once out of the CmdGroupList cache, the
+        # stopped one is recorded by its position
+        if tdb.cmd_point == self.stoped_op:
             self.stoped_op = None
             return
         break_hit = self.breakpoints.should_break(tdb)
         if break_hit:
-            self.stoped_op = cmd
+            self.stoped_op = tdb.cmd_point
             tdb.message(f"Hit: {break_hit}")
             raise BreakpointStop(break_hit)
 
@@ -543,6 +543,17 @@ class ProgressPlugin(TdbPlugin):
         self.visited_subnet = set()
         self.progress.stop()
 
+    def step_points(self, tdb: TdbCmdBackend):
+        # updated after each fast-forward instead
+        return []
+
+    def after_fast_forward(self, tdb: TdbCmdBackend):
+        try:
+            self.after_step(tdb)
+        except StopIteration:
+            # run to the end, stopped at the next step
+            pass
+
     def after_step(self, tdb: TdbCmdBackend):
         if tdb.status != TdbStatus.RUNNING:
             return
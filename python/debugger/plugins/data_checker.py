@@ -9,11 +9,9 @@
 
 import math
 import numpy as np
-from numpy.lib import format
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, Optional
 import os
 import json
-import zipfile
 import pandas as pd
 
 from rich import get_console
@@ -24,6 +22,7 @@ from rich.table import Table
 from rich.panel import Panel
 from ..final_mlir import Value
 from numpy_helper.npz_compare import TensorCompare as _TensorCompare
+from numpy_helper.tensor_dump import TensorDump
 from ..target_common import MType
 from ..tdb_support import (
     BreakpointStop,
@@ -41,49 +40,6 @@ from ..target_1688.context import BM1688Context
 from ..target_2260.context import SG2260Context
 
 
-class IncNpzFile:
-    def __init__(self, file: str):
-        """
-        :param file: the ``npz`` file to write
-        :param mode: must be one of {'x', 'w', 'a'}. See
-               https://docs.python.org/3/library/zipfile.html for detail
-        """
-        self.fn = file
-        self.zip = zipfile.ZipFile(file, mode="a", compression=zipfile.ZIP_DEFLATED)
-        self.keys = set()
-
-    def __setitem__(self, key: str, data) -> None:
-        if key in self.keys:
-            return
-
-        self.keys.add(key)
-        kwargs = {
-            "mode": "w",
-            "force_zip64": True,
-        }
-        if self.zip is None or self.zip.fp is None:
-            self.zip = zipfile.ZipFile(
-                self.fn, mode="a", compression=zipfile.ZIP_DEFLATED
-            )
-
-        with self.zip.open(key, **kwargs) as fid:
-            val = np.asanyarray(data)
-            format.write_array(fid, val, allow_pickle=True)
-
-    def __getitem__(self, key: str):
-        self.zip.close()
-        return np.load(self.fn, allow_pickle=True)[key]
-
-    def close(self):
-        if self.zip is not None:
-            self.zip.close()
-            self.zip = None
-
-    def return_npz(self):
-        self.zip.close()
-        return np.load(self.fn, allow_pickle=True)
-
-
 class DumpMode(Enum):
     NEVER = 0
     FAILED = 1
@@ -204,6 +160,11 @@ class TensorCompare(_TensorCompare):
         return cmp_res, msg
 
 
+def _not_empty(values):
+    # operands/results of index_df: a list of ValueView, or nan
+    return isinstance(values, list) and len(values) > 0
+
+
 class DataCheck(TdbPlugin, TdbPluginCmd):
     """
     DataCheck
@@ -234,6 +195,8 @@ class DataCheck(TdbPlugin, TdbPluginCmd):
         self.failed_results_fn = "failed_bmodel_outputs.npz"
         self.excepts = set()
         self.dump_mode = DumpMode.FAILED
+        # codec of the tensor dump, see TensorDump
+        self.dump_codec = "none"
 
     def set_tol(self, cosine_similarity_tol=0.99, euclidean_similarity_tol=0.9):
         self.tc = TensorCompare(
@@ -249,19 +212,60 @@ class DataCheck(TdbPlugin, TdbPluginCmd):
     def after_load(self, tdb: TdbCmdBackend):
         self.index: FinalMlirIndexPlugin = tdb.get_plugin(FinalMlirIndexPlugin)
 
-        self._failed_tensor = None
+        self.close_dump()
         self.tdb.message(f"dump mode = {self.dump_mode}")
 
+    @property
+    def dump_file(self):
+        # tensors are appended to a TensorDump while running, and exported
+        # to failed_results_fn when the execution stops
+        return os.path.splitext(self.failed_results_fn)[0] + ".dump"
+
     @property
     def failed_tensor(self):
         if self._failed_tensor is None:
-            file = self.failed_results_fn
+            file = self.dump_file
             if os.path.exists(file):
-                os.remove(file)
-                print(f"remove exist {file}")
-            self._failed_tensor = IncNpzFile(file)
+                print(f"overwrite exist {file}")
+            self._failed_tensor = TensorDump(file, "w", codec=self.dump_codec)
+            self._exported = None
         return self._failed_tensor
 
+    def export_npz(self, file=None):
+        if self._failed_tensor is None:
+            return
+        if file is None:
+            file = self.failed_results_fn
+        exported = (file, len(self._failed_tensor))
+        if exported == self._exported:
+            # nothing dumped since the last export
+            return
+        self._failed_tensor.to_npz(file)
+        self._exported = exported
+        self.tdb.message(f"{exported[1]} tensors are saved in {file}")
+
+    def close_dump(self):
+        """close the tensor dump and remove its files, after the export"""
+        if getattr(self, "_failed_tensor", None) is None:
+            self._failed_tensor = None
+            return
+        file = self._failed_tensor.file
+        self._failed_tensor.close()
+        self._failed_tensor = None
+        for f in (file, file + ".idx"):
+            if os.path.exists(f):
+                os.remove(f)
+
+    def do_export(self, arg):
+        """
+        check export [file]: export the dumped tensors into a npz file,
+        failed_results_fn by default
+        """
+        if self._failed_tensor is None:
+            self.tdb.message("no tensor dumped")
+            return
+        self.export_npz(arg.strip() or None)
+
     def do_dump_names(self, arg=None):
         """
         dump failed comparison data into npz file
@@ -488,6 +492,43 @@ class DataCheck(TdbPlugin, TdbPluginCmd):
 
         return None
 
+    def get_actual(self, point_index, value: Value):
+        """
+        dequantized data of value in memory when cmditer[point_index] runs,
+        None if it can not be read
+        """
+        context = self.tdb.context
+        memref = value.get_memref(context)
+        if not context.memory.using_cmodel:
+            if memref.mtype != MType.G and memref.mtype != MType.R:
+                return None
+
+        cmd = self.tdb.cmditer[point_index]
+        if isinstance(context, SG2260Context) or isinstance(context, BM1688Context):
+            raw_data = context.memory.get_data(memref, core_id=cmd.core_id)
+        else:
+            raw_data = context.memory.get_data(memref)
+        return (raw_data.astype(np.float32) - value.zero_point) * value.scale
+
+    def value_matches(self, point_index, value_view: ValueView) -> Optional[bool]:
+        """
+        compare a value with the reference data, without recording nor
+        dumping anything; None if it is not compared
+        """
+        value = value_view.value
+        if value is None or value.name in self.excepts:
+            return None
+        desired = self.get_ref_data(value)
+        if desired is None:
+            return None
+        actual = self.get_actual(point_index, value)
+        if actual is None:
+            return None
+        cmp_res = self.tc.compare(
+            actual.reshape(desired.shape), desired, verbose=2, int8_tensor_close=True
+        )
+        return bool(cmp_res[0])
+
     def check_data(
         self, point_index, is_operand, value_view: ValueView
     ) -> ComparedResult:
@@ -504,19 +545,10 @@ class DataCheck(TdbPlugin, TdbPluginCmd):
                     value_res = ComparedResult(value_view, None, msg="ignore")
                     return value_res
 
-        context = self.tdb.context
-        memref = value.get_memref(context)
-        if not context.memory.using_cmodel:
-            if memref.mtype != MType.G and memref.mtype != MType.R:
-                value_res = ComparedResult(value_view, None, msg="ignore")
-                return value_res
-
-        cmd = self.tdb.cmditer[point_index]
-        if isinstance(context, SG2260Context) or isinstance(context, BM1688Context):
-            raw_data = context.memory.get_data(memref, core_id=cmd.core_id)
-        else:
-            raw_data = context.memory.get_data(memref)
-        actual = (raw_data.astype(np.float32) - value.zero_point) * value.scale
+        actual = self.get_actual(point_index, value)
+        if actual is None:
+            value_res = ComparedResult(value_view, None, msg="ignore")
+            return value_res
 
         desired = self.get_ref_data(value)
         if desired is None:
@@ -588,6 +620,15 @@ class DataCheck(TdbPlugin, TdbPluginCmd):
 
         return success
 
+    def step_points(self, tdb: TdbCmdBackend):
+        # the commands before which operands, or after which results, of a
+        # final.mlir op are compared
+        if self.ref_data is None or not self.enabled:
+            return []
+        df = tdb.index_df
+        has_values = df["operands"].map(_not_empty) | df["results"].map(_not_empty)
+        return df.loc[has_values, "executed_id"] - 1
+
     def before_step(self, tdb: TdbCmdBackend):
         if self.ref_data is None or not self.enabled:
             return
@@ -605,6 +646,6 @@ class DataCheck(TdbPlugin, TdbPluginCmd):
             raise BreakpointStop()
 
     def after_stop(self, tdb: TdbCmdBackend):
-        # make sure npz file is valid
-        self.failed_tensor.close()
+        # at the end of the execution, or at a failure with break_when_fail
+        self.export_npz()
         return super().after_stop(tdb)
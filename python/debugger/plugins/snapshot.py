@@ -0,0 +1,408 @@
+# ==============================================================================
+#
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+import math
+import zlib
+
+import numpy as np
+
+from ..tdb_support import (
+    TdbCmdBackend,
+    TdbPlugin,
+    TdbPluginCmd,
+    TdbStatus,
+)
+from .data_checker import DataCheck, _not_empty
+
+
+class PagedMemory:
+    """
+    snapshots of a memory buffer by pages: only the non-zero pages are
+    kept, zlib compressed, and a page not changed since the last snapshot
+    shares its data with that snapshot.
+    """
+
+    def __init__(self, buffer: np.ndarray, page_size=1 << 16):
+        self.page_size = math.gcd(buffer.size, page_size)
+        # a view, writing pages writes the buffer
+        self.pages = buffer.reshape(-1, self.page_size)
+        # pages of the last snapshot taken or restored, to find the changes
+        self.last_index = np.zeros(0, dtype=np.int64)
+        self.last_data = np.zeros((0, self.page_size), dtype=np.uint8)
+        self.last_blobs: List[bytes] = []
+
+    def nonzero_pages(self):
+        pages = self.pages
+        if self.page_size % 8 == 0:
+            pages = pages.view(np.uint64)
+        return np.flatnonzero(pages.any(axis=1))
+
+    def save(self) -> Tuple[np.ndarray, List[bytes]]:
+        index = self.nonzero_pages()
+        data = self.pages[index]
+        same = np.zeros(len(index), dtype=bool)
+        pos = np.zeros(len(index), dtype=np.int64)
+        if len(self.last_index) > 0:
+            pos = np.searchsorted(self.last_index, index).clip(
+                0, len(self.last_index) - 1
+            )
+            known = self.last_index[pos] == index
+            same[known] = (data[known] == self.last_data[pos[known]]).all(axis=1)
+        blobs = [
+            self.last_blobs[p] if s else zlib.compress(d.tobytes(), 1)
+            for d, s, p in zip(data, same, pos)
+        ]
+        self.last_index, self.last_data, self.last_blobs = index, data, blobs
+        return index, blobs
+
+    def restore(self, state: Tuple[np.ndarray, List[bytes]]):
+        index, blobs = state
+        stale = np.setdiff1d(self.nonzero_pages(), index)
+        self.pages[stale] = 0
+        data = np.empty((len(index), self.page_size), dtype=np.uint8)
+        for i, blob in enumerate(blobs):
+            data[i] = np.frombuffer(zlib.decompress(blob), dtype=np.uint8)
+        self.pages[index] = data
+        self.last_index, self.last_data, self.last_blobs = index, data, list(blobs)
+
+
+@dataclass
+class Snapshot:
+    cmd_point: int
+    memory: Dict[str, Tuple[np.ndarray, List[bytes]]]
+    cpu_mem: dict
+    global_layer_line: dict = field(default=None)
+
+
+def memory_buffers(memory):
+    """raveled DDR/LMEM/SMEM arrays of a cmodel memory, by name"""
+    buffers = {}
+    for name in ("DDR", "LMEM", "SMEM"):
+        mem = getattr(memory, name, None)
+        if mem is None:
+            continue
+        if isinstance(mem, np.ndarray):
+            buffers[name] = mem
+        else:
+            # one per core
+            for i, m in enumerate(mem):
+                buffers[f"{name}{i}"] = m
+    return buffers
+
+
+class SnapshotPlugin(TdbPlugin, TdbPluginCmd):
+    """
+    snapshots of the cmodel memory every `interval` commands, to go back
+    to any executed command without rerunning the model from the start.
+
+    adds the tdb commands:
+
+     - rstep [n]: go back n commands
+     - goto <executed_id>: go to the point after the command executed_id
+     - bisect: find the first command whose results diverge from the
+       reference data, needs the data-check plugin; it assumes a
+       divergence lasts, every command after a failed one fails too
+    """
+
+    name = "snapshot"
+    func_names = ["snapshot"]
+
+    def __init__(self, tdb: TdbCmdBackend) -> None:
+        super().__init__(tdb)
+        self.interval = 1000
+        self.snapshots: Dict[int, Snapshot] = {}
+        self.buffers: Dict[str, PagedMemory] = {}
+        tdb.do_rstep = self.do_rstep
+        tdb.do_rs = self.do_rstep
+        tdb.do_goto = self.do_goto
+        tdb.do_bisect = self.do_bisect
+
+    def __str__(self) -> str:
+        return f"{self.name}({self.interval})"
+
+    @property
+    def enabled(self):
+        return len(self.buffers) > 0
+
+    def after_load(self, tdb: TdbCmdBackend):
+        self.snapshots.clear()
+        self.buffers.clear()
+        if not tdb.memory.using_cmodel:
+            tdb.error("snapshot only supports cmodel memory")
+            return
+        self.buffers = {
+            name: PagedMemory(buffer)
+            for name, buffer in memory_buffers(tdb.memory).items()
+        }
+        self.take()
+
+    def step_points(self, tdb: TdbCmdBackend):
+        if not self.enabled:
+            return []
+        return range(0, len(tdb.cmditer), self.interval)
+
+    def before_step(self, tdb: TdbCmdBackend):
+        if self.enabled and tdb.cmd_point % self.interval == 0:
+            if tdb.cmd_point not in self.snapshots:
+                self.take()
+
+    def take(self):
+        tdb = self.tdb
+        layer_line = getattr(tdb, "global_layer_line", None)
+        self.snapshots[tdb.cmd_point] = Snapshot(
+            tdb.cmd_point,
+            {name: buffer.save() for name, buffer in self.buffers.items()},
+            dict(tdb.memory.CPU_MEM),
+            layer_line.copy() if layer_line is not None else None,
+        )
+
+    def restore(self, snapshot: Snapshot):
+        tdb = self.tdb
+        for name, state in snapshot.memory.items():
+            self.buffers[name].restore(state)
+        tdb.memory.CPU_MEM.clear()
+        tdb.memory.CPU_MEM.update(snapshot.cpu_mem)
+        if snapshot.global_layer_line is not None:
+            tdb.global_layer_line = snapshot.global_layer_line.copy()
+        tdb.cmd_point = snapshot.cmd_point
+
+    def run_to(self, target: int):
+        # run without hooks, taking the snapshots passed by
+        tdb = self.tdb
+        while tdb.cmd_point < target:
+            boundary = (tdb.cmd_point // self.interval + 1) * self.interval
+            stop = min(boundary, target)
+            if tdb.static_mode:
+                tdb.cmd_point = stop
+            else:
+                cmds = tdb.cmditer[tdb.cmd_point : stop]
+                for _ in tdb.runner.compute_cmds(cmds, skip=tdb._is_sys):
+                    tdb.cmd_point += 1
+            if tdb.cmd_point % self.interval == 0:
+                if tdb.cmd_point not in self.snapshots:
+                    self.take()
+
+    def goto(self, target: int):
+        """restore the nearest snapshot before target, and run up to it"""
+        tdb = self.tdb
+        target = max(0, min(target, len(tdb.cmditer)))
+        points = sorted(self.snapshots)
+        base = points[bisect_right(points, target) - 1]
+        if not base <= tdb.cmd_point <= target:
+            self.restore(self.snapshots[base])
+        self.run_to(target)
+        if tdb.cmd_point < len(tdb.cmditer):
+            tdb.status = TdbStatus.IDLE
+        else:
+            tdb.status = TdbStatus.END
+
+    def _check_ready(self):
+        if self.tdb.status == TdbStatus.UNINIT:
+            self.tdb.message("The program is not being run.")
+            return False
+        if not self.enabled:
+            self.tdb.error("no snapshot of the memory")
+            return False
+        return True
+
+    def _show_point(self):
+        tdb = self.tdb
+        tdb.message(f"cmd_point = {tdb.cmd_point}")
+        try:
+            tdb.message(tdb.get_cmd())
+        except StopIteration:
+            tdb.message("End of Execution")
+
+    def _goto(self, target: int):
+        try:
+            self.goto(target)
+        except ValueError as e:
+            self.tdb.error(e)
+            return False
+        return True
+
+    def do_rstep(self, arg):
+        """
+        rstep [n]: step back n commands, 1 by default
+        """
+        if not self._check_ready():
+            return
+        try:
+            n = int(arg) if arg.strip() else 1
+        except ValueError as e:
+            self.tdb.error(e)
+            return
+        if self._goto(self.tdb.cmd_point - n):
+            self._show_point()
+
+    def do_goto(self, arg):
+        """
+        goto <executed_id>: stop after the command of executed_id ran,
+        forward or backward
+        """
+        if not self._check_ready():
+            return
+        try:
+            target = int(arg)
+        except ValueError as e:
+            self.tdb.error(e)
+            return
+        if self._goto(target):
+            self._show_point()
+
+    def layer_last_points(self) -> Dict[str, int]:
+        """
+        the executed_id of the last result of each layer split over the
+        cores: before it, the data of the layer is partial, as check_data
+        of data-check counts down with global_layer_line
+        """
+        tdb = self.tdb
+        lines = getattr(tdb, "global_layer_line", {})
+        last = {}
+        df = tdb.index_df
+        for executed_id, value_views in zip(df["executed_id"], df["results"]):
+            if not _not_empty(value_views):
+                continue
+            for value_view in value_views:
+                if not value_view.is_operand and value_view.file_line in lines:
+                    line = value_view.file_line
+                    last[line] = max(last.get(line, 0), int(executed_id))
+        return last
+
+    def compared_values(self, last_points: Dict[str, int], executed_id: int):
+        # results of the command, without the partial ones of a split layer
+        values = self.tdb.index_df.loc[
+            self.tdb.index_df["executed_id"] == executed_id, "results"
+        ]
+        for value_views in values:
+            if not _not_empty(value_views):
+                continue
+            for value_view in value_views:
+                if value_view.is_operand:
+                    continue
+                if last_points.get(value_view.file_line, executed_id) != executed_id:
+                    continue
+                yield value_view
+
+    def failed_values(
+        self, checker: DataCheck, last_points: Dict[str, int], executed_id: int
+    ) -> List[str]:
+        return [
+            value_view.value.name
+            for value_view in self.compared_values(last_points, executed_id)
+            if checker.value_matches(executed_id - 1, value_view) is False
+        ]
+
+    def point_matches(
+        self, checker: DataCheck, last_points: Dict[str, int], executed_id: int
+    ) -> bool:
+        return all(
+            checker.value_matches(executed_id - 1, value_view) is not False
+            for value_view in self.compared_values(last_points, executed_id)
+        )
+
+    def do_bisect(self, arg):
+        """
+        bisect: binary search the first command whose results diverge from
+        the reference data, and stop after it; the results compared are the
+        ones of data-check, given by the reference npz. A divergence is
+        assumed to last: once a result fails, the ones after it fail too,
+        a model going back to matching results is not bisected right
+        """
+        if not self._check_ready():
+            return
+        tdb = self.tdb
+        checker: DataCheck = tdb.get_plugin(DataCheck)
+        if checker is None or not checker.enabled:
+            tdb.error("bisect needs the reference data, final.mlir and tensor_location")
+            return
+
+        last_points = self.layer_last_points()
+        df = tdb.index_df
+        rows = df[df["results"].map(_not_empty)]
+        points = [
+            point
+            for point in sorted(set(int(i) for i in rows["executed_id"]))
+            if any(True for _ in self.compared_values(last_points, point))
+        ]
+        lo, hi = 0, len(points) - 1
+        first_failed = None
+        try:
+            while lo <= hi:
+                mid = (lo + hi) // 2
+                self.goto(points[mid])
+                if self.point_matches(checker, last_points, points[mid]):
+                    lo = mid + 1
+                else:
+                    first_failed = points[mid]
+                    hi = mid - 1
+            if first_failed is None:
+                tdb.message(f"no divergence in {len(points)} compared commands")
+                return
+            self.goto(first_failed)
+        except ValueError as e:
+            tdb.error(e)
+            return
+
+        tdb.message(
+            f"first divergence at executed_id {first_failed}: "
+            f"{', '.join(self.failed_values(checker, last_points, first_failed))}"
+        )
+        tdb.message(tdb.get_precmd())
+
+    def do_interval(self, arg):
+        """
+        snapshot interval <n>: take a snapshot every n commands, the
+        snapshots taken are kept
+        """
+        if arg.strip() == "":
+            self.tdb.message(f"interval = {self.interval}")
+            return
+        try:
+            interval = int(arg)
+            assert interval > 0, "interval must be positive"
+        except (ValueError, AssertionError) as e:
+            self.tdb.error(e)
+            return
+        self.interval = interval
+        self.tdb.message(f"interval = {self.interval}")
+
+    def do_take(self, arg):
+        """
+        snapshot take: take a snapshot of the current point
+        """
+        if self._check_ready():
+            self.take()
+
+    def do_clear(self, arg):
+        """
+        snapshot clear: drop all the snapshots but the first one
+        """
+        if 0 in self.snapshots:
+            self.snapshots = {0: self.snapshots[0]}
+
+    def do_info(self, arg):
+        """
+        snapshot info: points and memory used by the snapshots
+        """
+        blobs = {}
+        for snapshot in self.snapshots.values():
+            for _, state_blobs in snapshot.memory.values():
+                for blob in state_blobs:
+                    blobs[id(blob)] = len(blob)
+        self.tdb.message(f"points: {sorted(self.snapshots)}")
+        self.tdb.message(f"size: {sum(blobs.values()) / 2**20:.2f} MB")
+
+    def emptyline(self) -> bool:
+        self.do_info("")
+
+    def default(self, arg: str):
+        self.tdb.error(f"unknown snapshot command {arg}")
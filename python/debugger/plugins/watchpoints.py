@@ -184,6 +184,12 @@ class WatchPlugin(TdbPlugin, TdbPluginCmd):
         else:
             self.tdb.message("Please enter valid value_view type.")
 
+    def step_points(self, tdb: "TdbCmdBackend"):
+        # any command may write the watched values
+        if any(w.enabled for w in self.watches.values()):
+            return None
+        return []
+
     def after_step(self, tdb: "TdbCmdBackend"):
         for k, v in self.watchid2value.items():
             cur_watchpoint, old_value = v
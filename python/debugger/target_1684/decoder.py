@@ -58,7 +58,7 @@ def buffer_to_bits(buffer):
 
 class Decoder(DecoderBase):
     def decode_tiu_cmd(self, reg_buf: memoryview, offset, subnet_id) -> TiuCmd:
-        head = TiuHead.from_buffer(reg_buf, offset)  # type: TiuHead
+        head = self.decode_reg(TiuHead, reg_buf, offset=offset)  # type: TiuHead
         op_info = tiu_index.get((head.tsk_typ, head.tsk_eu_typ), None)
 
         # get op struct
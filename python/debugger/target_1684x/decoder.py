@@ -74,9 +74,12 @@ class DmaHead(HeadDef):
 class Decoder(DecoderBase):
     tiu_head_length = 50
     dma_head_length = 39
+    op_class_dic = op_class_dic
+    tiu_sys_cls = tiu_sys
+    dma_sys_cls = dma_sys
 
-    def decode_tiu_cmd(self, reg_buf: memoryview, *, offset, subnet_id) -> BaseTpuCmd:
-        head = TiuHead.from_buffer(reg_buf, offset)  # type: TiuHead
+    def tiu_op_info(self, reg_buf: memoryview, offset: int):
+        head = self.decode_reg(TiuHead, reg_buf, offset=offset)  # type: TiuHead
         op_info = tiu_index.get(
             (bool(head.cmd_short), head.tsk_typ, head.tsk_eu_typ), None
         )
@@ -84,6 +87,21 @@ class Decoder(DecoderBase):
             f"Unable to decode TIU code at offset {offset} out of {len(reg_buf)} total."
             f" Potential head identified as {head}"
         )
+        return op_info
+
+    def dma_op_info(self, reg_buf: memoryview, offset: int):
+        head = self.decode_reg(DmaHead, reg_buf, offset=offset)  # type: DmaHead
+        op_info = dma_index.get(
+            (bool(head.cmd_short), head.cmd_type, head.cmd_sp_func), None
+    )
+        assert op_info is not None, (
+            f"Unable to decode DMA code at offset {offset} out of {len(reg_buf)} total."
+            f" Potential head identified as {head}"
+        )
+        return op_info
+
+    def decode_tiu_cmd(self, reg_buf: memoryview, *, offset, subnet_id) -> BaseTpuCmd:
+        op_info = self.tiu_op_info(reg_buf, offset)
 
         # get op struct
         op_clazz = op_class_dic[op_info.name]
@@ -93,15 +111,8 @@ class Decoder(DecoderBase):
         return cmd
 
     def decode_dma_cmd(self, reg_buf: memoryview, *, offset, subnet_id) -> BaseTpuCmd:
-        head = DmaHead.from_buffer(reg_buf, offset)  # type: DmaHead
-        op_info = dma_index.get(
-            (bool(head.cmd_short), head.cmd_type, head.cmd_sp_func), None
-    )
+        op_info = self.dma_op_info(reg_buf, offset)
         # get op struct
-        assert op_info is not None, (
-            f"Unable to decode DMA code at offset {offset} out of {len(reg_buf)} total."
-            f" Potential head identified as {head}"
-        )
         op_clazz = op_class_dic[op_info.name]
         reg = self.decode_reg(op_clazz, reg_buf, offset=offset)
         buf = reg_buf[offset : offset + op_clazz.length // 8]
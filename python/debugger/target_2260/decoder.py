@@ -114,16 +114,17 @@ TiuHeads: List[ctypes.Structure] = [TiuHead, SYS_TR_ACC_HEAD]
 class Decoder(DecoderBase):
     tiu_head_length = 50
     dma_head_length = 40
+    op_class_dic = op_class_dic
+    tiu_sys_cls = tiu_sys
+    dma_sys_cls = dma_sys
 
     def __init__(self, context: "SG2260Context") -> None:
         super().__init__()
         self.context = context
 
-    def decode_tiu_cmd(
-        self, reg_buf: memoryview, *, offset, core_id, cmd_id, subnet_id):
-        assert cmd_id is not None, "2260 must assign cmd_id manully"
+    def tiu_op_info(self, reg_buf: memoryview, offset: int):
         for head_cls in TiuHeads:  # type: cmd_base_t
-            head = head_cls.from_buffer(reg_buf, offset)  # type: TiuHead
+            head = self.decode_reg(head_cls, reg_buf, offset=offset)  # type: TiuHead
             op_info = tiu_index.get(head, None)
 
             if op_info is not None:
@@ -132,6 +133,22 @@ class Decoder(DecoderBase):
             f"Unable to decode TIU code at offset {offset} out of {len(reg_buf)} total."
             f" Potential head identified as {head}"
         )
+        return op_info
+
+    def dma_op_info(self, reg_buf: memoryview, offset: int):
+        head = self.decode_reg(DmaHead, reg_buf, offset=offset)  # type: DmaHead
+        op_info = dma_index.get(head, None)
+
+        assert op_info is not None, (
+            f"Unable to decode DMA code at offset {offset} out of {len(reg_buf)} total."
+            f" Potential head identified as {head}"
+        )
+        return op_info
+
+    def decode_tiu_cmd(
+        self, reg_buf: memoryview, *, offset, core_id, cmd_id, subnet_id):
+        assert cmd_id is not None, "2260 must assign cmd_id manully"
+        op_info = self.tiu_op_info(reg_buf, offset)
         # get op struct
         op_clazz = op_class_dic[op_info.name]
         reg = self.decode_reg(op_clazz, buf=reg_buf, offset=offset)
@@ -150,13 +167,7 @@ class Decoder(DecoderBase):
     def decode_dma_cmd(
         self, reg_buf: memoryview, *, offset, core_id, cmd_id, subnet_id):
         assert cmd_id is not None, "1688 must assign cmd_id manully"
-        head = DmaHead.from_buffer(reg_buf, offset)  # type: DmaHead
-        op_info = dma_index.get(head, None)
-
-        assert op_info is not None, (
-            f"Unable to decode DMA code at offset {offset} out of {len(reg_buf)} total."
-            f" Potential head identified as {head}"
-        )
+        op_info = self.dma_op_info(reg_buf, offset)
         # get op struct
         op_clazz = op_class_dic[op_info.name]
 
@@ -7,7 +7,7 @@
 #
 # ==============================================================================
 
-from .decoder import DecoderBase, HeadDef
+from .decoder import DecoderBase, HeadDef, RegTable, reg_layout, unpack_regs
 from .runner import (
     c_array_to_ndarray,
     MemoryBase,
@@ -7,7 +7,9 @@
 #
 # ==============================================================================
 import ctypes
-from typing import List, Type
+import functools
+import numpy as np
+from typing import Dict, List, Tuple, Type
 from .op_support import (
     atomic_reg,
     BaseTpuCmd,
@@ -32,12 +34,105 @@ class HeadDef(ctypes.Structure):
 
 
 
+@functools.lru_cache(maxsize=None)
+def reg_layout(clazz: Type[atomic_reg]) -> List[Tuple[str, int, int]]:
+    """
+    (name, bit offset, bit width) of the fields of a register class, read
+    from the ctypes layout: each field is set alone and the bits it covers
+    are located in the raw bytes.
+    """
+    # repeated (reserved) fields: only the last one is accessible
+    fields = {field[0]: field for field in clazz._fields_}
+    layout = []
+    for field in fields.values():
+        name, field_type = field[:2]
+        width = field[2] if len(field) > 2 else ctypes.sizeof(field_type) * 8
+        reg = clazz.from_buffer_copy(bytes(ctypes.sizeof(clazz)))
+        setattr(reg, name, (1 << width) - 1)
+        bits = np.unpackbits(np.frombuffer(bytes(reg), np.uint8), bitorder="little")
+        pos = np.flatnonzero(bits)
+        assert len(pos) == width and pos[-1] - pos[0] + 1 == width, name
+        layout.append((name, int(pos[0]), width))
+    return layout
+
+
+def _field_dtype(width):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if width <= np.iinfo(dtype).bits:
+            return dtype
+    return np.uint64
+
+
+def unpack_regs(clazz: Type[atomic_reg], data: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Registers of the commands of class clazz at the byte offsets of data, as
+    a structured array: cmd_index is left to the caller, cmd_offset is the
+    offset of the command, then one column per field.
+    """
+    layout = reg_layout(clazz)
+    # a few register definitions have fields beyond their length, read them
+    # from the following bytes as ctypes does
+    length = max(clazz.length, max(pos + width for _, pos, width in layout))
+    length = (length + 7) // 8
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if len(offsets) and offsets[-1] + length > len(data):
+        data = np.concatenate([data, np.zeros(length, np.uint8)])
+    # commands as rows of 64 bits words, padded to a whole word
+    rows = np.zeros((len(offsets), (length + 7) // 8 * 8), np.uint8)
+    rows[:, :length] = data[offsets[:, None] + np.arange(length)]
+    words = rows.view("<u8")
+
+    dtype = [("cmd_index", np.int64), ("cmd_offset", np.int64)]
+    dtype += [(name, _field_dtype(width)) for name, _, width in layout]
+    res = np.zeros(len(offsets), dtype=dtype)
+    res["cmd_offset"] = offsets
+    for name, pos, width in layout:
+        word, shift = divmod(pos, 64)
+        value = words[:, word] >> np.uint64(shift)
+        if shift + width > 64:
+            value |= words[:, word + 1] << np.uint64(64 - shift)
+        if width < 64:
+            value &= np.uint64((1 << width) - 1)
+        res[name] = value
+    return res
+
+
+class RegTable(dict):
+    """
+    Commands of a buffer decoded by columns: op name -> structured array of
+    the registers of the commands of this op (see unpack_regs), cmd_index
+    being the position of the command in the buffer.
+    """
+
+    @property
+    def num_cmds(self):
+        return sum(len(x) for x in self.values())
+
+    def column(self, name: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(cmd_index, value) of a field, over all the ops having it, in
+        the order of the buffer"""
+        tables = [x for x in self.values() if name in x.dtype.names]
+        if not tables:
+            return np.zeros(0, np.int64), np.zeros(0, np.uint64)
+        index = np.concatenate([x["cmd_index"] for x in tables])
+        value = np.concatenate([x[name].astype(np.uint64) for x in tables])
+        order = np.argsort(index, kind="stable")
+        return index[order], value[order]
+
+
 class DecoderBase:
     tiu_head_length = None
     dma_head_length = None
+    # set by the targets supporting decode_tiu_table/decode_dma_table
+    op_class_dic: Dict[str, Type[atomic_reg]] = None
+    tiu_sys_cls: Type[atomic_reg] = None
+    dma_sys_cls: Type[atomic_reg] = None
 
     @staticmethod
     def decode_reg(clazz: Type[atomic_reg], buf: memoryview, *, offset=0) -> atomic_reg:
+        if isinstance(buf, bytes) or (isinstance(buf, memoryview) and buf.readonly):
+            # bmodel mapped read-only, registers are copied instead of shared
+            return clazz.from_buffer_copy(buf, offset)  # type: atomic_reg
         res = clazz.from_buffer(buf, offset)  # type: atomic_reg
         return res
 
@@ -118,3 +213,51 @@ class DecoderBase:
     @staticmethod
     def buf_is_end(*args, **kwargs):
         raise NotImplementedError()
+
+    def tiu_op_info(self, reg_buf: memoryview, offset: int):
+        """op class of the TIU command at offset, from its head"""
+        raise NotImplementedError()
+
+    def dma_op_info(self, reg_buf: memoryview, offset: int):
+        """op class of the DMA command at offset, from its head"""
+        raise NotImplementedError()
+
+    def _decode_table(self, reg_buf, op_info_fn, sys_cls) -> RegTable:
+        data = np.frombuffer(reg_buf, np.uint8)
+        # only the heads are read one by one, to find where each command is
+        cmds: Dict[str, Tuple[type, list, list]] = {}
+        offset, index = 0, 0
+        while offset < len(data):
+            op_name = op_info_fn(reg_buf, offset).name
+            clazz = self.op_class_dic[op_name]
+            if op_name not in cmds:
+                cmds[op_name] = (clazz, [], [])
+            cmds[op_name][1].append(index)
+            cmds[op_name][2].append(offset)
+            offset += clazz.length // 8
+            index += 1
+            # same as buf_is_end
+            if (
+                issubclass(clazz, sys_cls)
+                and (len(data) - offset) * 8 < 1025
+                and not np.any(data[offset:])
+            ):
+                break
+        table = RegTable()
+        for op_name, (clazz, indices, offsets) in cmds.items():
+            regs = unpack_regs(clazz, data, offsets)
+            regs["cmd_index"] = indices
+            table[op_name] = regs
+        return table
+
+    def decode_tiu_table(self, reg_buf: memoryview) -> RegTable:
+        """
+        Decode all the TIU commands of reg_buf at once, as numpy columns
+        instead of command objects. Much faster on large buffers, for tools
+        which only read the register fields.
+        """
+        return self._decode_table(reg_buf, self.tiu_op_info, self.tiu_sys_cls)
+
+    def decode_dma_table(self, reg_buf: memoryview) -> RegTable:
+        """DMA commands of reg_buf as numpy columns, see decode_tiu_table"""
+        return self._decode_table(reg_buf, self.dma_op_info, self.dma_sys_cls)
@@ -14,7 +14,7 @@ import ctypes
 from functools import lru_cache
 from ctypes import Structure, POINTER
 from numpy import ndarray
-from .op_support import MemRefBase, Value, CpuCmd, get_type_str
+from .op_support import MemRefBase, Value, CpuCmd, CMDType, get_type_str
 from typing import List
 import tempfile
 
@@ -194,6 +194,32 @@ class Runner:
     def dma_compute(self, command, core_id=0):
         raise NotImplementedError()
 
+    def compute(self, command):
+        """run one command, False if its type is not supported"""
+        cmd_type = command.cmd_type
+        if cmd_type == CMDType.tiu:
+            self.tiu_compute(command)
+        elif cmd_type == CMDType.dma:
+            self.dma_compute(command)
+        elif cmd_type == CMDType.cpu:
+            self.cpu_compute(command)
+        elif cmd_type == CMDType.dyn_ir:
+            self.dynamic_compute(command)
+        else:
+            return False
+        return True
+
+    def compute_cmds(self, commands, skip=None):
+        """
+        Run a range of commands as one batch, skipping the ones for which
+        skip(command) is True. Yields after each command, so the caller
+        knows how far the batch went if it is interrupted.
+        """
+        for command in commands:
+            if skip is None or not skip(command):
+                self.compute(command)
+            yield command
+
     @property
     @lru_cache()
     def cpu_processor(self):
@@ -6,7 +6,7 @@
 # third-party components.
 #
 # ==============================================================================
-from typing import List, Union, Dict, NamedTuple, Type
+from typing import Iterable, List, Optional, Union, Dict, NamedTuple, Type
 from functools import partial
 import re
 import os
@@ -150,6 +150,9 @@ def complete_file(self, text: str, line, begidx, endidx):
 
 
 class TdbCmdBackend(cmd.Cmd):
+    # max commands run at once by fast_step, between progress updates
+    fast_forward_batch = 4096
+
     def __init__(
         self,
         bmodel_file: str = None,
@@ -188,6 +191,8 @@ class TdbCmdBackend(cmd.Cmd):
         self.displays = Displays.get_instance()
 
         self.static_mode = False
+        # continue/run skip the steps no plugin hooks into
+        self.fast_forward = True
         self.enable_message = True
         self.cmditer: List[Union[BaseTpuCmd, CpuCmd, DynIrCmd]]
 
@@ -410,19 +415,8 @@ class TdbCmdBackend(cmd.Cmd):
         cmd = self.get_cmd()
 
         try:
-            if not self.static_mode:
-                cmd_type = cmd.cmd_type
-                if cmd_type.is_static():
-                    if not self.context.is_sys(cmd):
-                        if cmd_type == CMDType.tiu:
-                            self.runner.tiu_compute(cmd)
-                        elif cmd_type == CMDType.dma:
-                            self.runner.dma_compute(cmd)
-                elif cmd_type == CMDType.cpu:
-                    self.runner.cpu_compute(cmd)
-                elif cmd_type == CMDType.dyn_ir:
-                    self.runner.dynamic_compute(cmd)
-                else:
+            if not self.static_mode and not self._is_sys(cmd):
+                if not self.runner.compute(cmd):
                     self.error("skip unknown CMDType")
         except ValueError as e:
             self.error(e)
@@ -430,6 +424,49 @@ class TdbCmdBackend(cmd.Cmd):
 
         self.cmd_point += 1
 
+    def _is_sys(self, cmd):
+        return cmd.cmd_type.is_static() and self.context.is_sys(cmd)
+
+    def hook_points(self) -> Optional[np.ndarray]:
+        """
+        sorted cmd_points where some plugin needs its before_step/after_step
+        hooks, see TdbPlugin.step_points; None if a plugin needs all of them
+        """
+        points = [np.zeros(0, dtype=np.int64)]
+        for plugin in self.plugins.plugins.values():
+            plugin_points = plugin.step_points(self)
+            if plugin_points is None:
+                return None
+            points.append(np.asarray(list(plugin_points), dtype=np.int64))
+        return np.unique(np.concatenate(points))
+
+    def fast_step(self, points: Optional[np.ndarray]):
+        """
+        step() at the points of hook_points, elsewhere run all the commands
+        up to the next point as one batch, without calling any hook. Raise
+        the same exceptions as step().
+        """
+        if points is None or not self.fast_forward:
+            return self.step()
+        end = len(self.cmditer)
+        next_index = np.searchsorted(points, self.cmd_point)
+        stop = int(points[next_index]) if next_index < len(points) else end
+        stop = min(stop, end, self.cmd_point + self.fast_forward_batch)
+        if stop <= self.cmd_point:
+            return self.step()
+
+        if self.static_mode:
+            self.cmd_point = stop
+        else:
+            cmds = self.cmditer[self.cmd_point : stop]
+            try:
+                for _ in self.runner.compute_cmds(cmds, skip=self._is_sys):
+                    self.cmd_point += 1
+            except ValueError as e:
+                self.error(e)
+                raise BreakpointStop()
+        self.plugins._call_loop("after_fast_forward")
+
     def set_inputs_dict(self, inputs):
         args = self.atomic_mlir.functions[0].signature[0]
         from utils.lowering import lowering
@@ -569,6 +606,16 @@ class Breakpoint:
     def should_stop(self, tdb: TdbCmdBackend) -> bool:
         pass
 
+    def stop_points(self, tdb: TdbCmdBackend) -> Optional[Iterable[int]]:
+        """
+        all the cmd_points where should_stop may be True, found from the
+        indexes of tdb; None if unknown, should_stop is then checked at
+        every step.
+        """
+        if type(self).should_stop is Breakpoint.should_stop:
+            return []
+        return None
+
     def toggle_enable(self, flag: bool):
         self.enabled = flag
 
@@ -640,6 +687,17 @@ class TdbPlugin:
     def before_next(self, tdb: TdbCmdBackend):
         pass
 
+    def step_points(self, tdb: TdbCmdBackend) -> Optional[Iterable[int]]:
+        """
+        cmd_points (index of the cmd about to run) where before_step and
+        after_step of this plugin must be called, so continue/run can run
+        the commands in between at once. None means every step.
+        """
+        cls = type(self)
+        if not hasattr(cls, "before_step") and cls.after_step is TdbPlugin.after_step:
+            return []
+        return None
+
     def after_stop(self, tdb: TdbCmdBackend):
         pass
 
@@ -20,6 +20,7 @@ from utils.preprocess import get_preprocess_parser, preprocess
 from utils.mlir_parser import *
 from utils.misc import *
 from tools.model_runner import get_chip_from_model, round_away_from_zero
+from utils.numeric import bf16_to_fp32, fp32_to_bf16
 
 
 
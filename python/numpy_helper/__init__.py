@@ -12,10 +12,7 @@ from .npz_statistic import npz_statistic
 from .npz_cali_test import npz_cali_test
 import numpy as np
 import sys
-import struct
-
-def bf16_to_fp32(bf16_value):
-    return struct.unpack('<f', struct.pack('<HH', 0, bf16_value))[0]
+from utils.numeric import bf16_to_fp32
 
 def get_npz_shape(args):
     if (len(args) < 2):
@@ -117,10 +114,7 @@ def npz_bf16_to_fp32(args):
         if bf16_arr.dtype == np.float32:
             npz_out[s] = bf16_arr
         else:
-            # Using NumPy's vectorize function to apply bf16_to_fp32 to the entire array
-            vectorized_func = np.vectorize(bf16_to_fp32)
-            fp32_arr = vectorized_func(bf16_arr).astype(np.float32)
-            npz_out[s] = fp32_arr
+            npz_out[s] = bf16_to_fp32(bf16_arr.astype(np.uint16))
 
     np.savez(args[1], **npz_out)
 
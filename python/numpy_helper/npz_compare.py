@@ -12,11 +12,11 @@ from __future__ import division
 import numpy as np
 import sys
 import argparse
-import struct
+from utils.numeric import bf16_to_fp32, fp32_to_bf16
 from .tensor_compare import TensorCompare, TensorCompareStats
 import multiprocessing
 from tqdm import tqdm
-import gc
+from .npz_mmap import NpzMmap
 
 
 def parse_args(args_list):
@@ -41,32 +41,17 @@ def parse_args(args_list):
     parser.add_argument("--save", type=str, help="Save result as a csv file")
     parser.add_argument("--per_axis_compare", type=int, default=-1,
                         help="Compare along axis, usually along axis 1 as per-channel")
+    parser.add_argument("--max_compare", type=int, default=0,
+                        help="Only compare about this number of tensors evenly picked, 0 for all")
+    parser.add_argument("--max_diffs", type=int, default=0,
+                        help="Only print the worst differing elements with -vvv, 0 for all")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Number of compare processes, 0 for min(cpu count, 8)")
     args = parser.parse_args(args_list)
     # yapf: enable
     return args
 
 
-def bf16_to_fp32(d_bf16):
-    s = d_bf16.shape
-    d_bf16 = d_bf16.flatten()
-    assert d_bf16.dtype == np.uint16
-    d_fp32 = np.empty_like(d_bf16, dtype=np.float32)
-    for i in range(len(d_bf16)):
-        d_fp32[i] = struct.unpack('<f', struct.pack('<HH', 0, d_bf16[i]))[0]
-    return d_fp32.reshape(s)
-
-
-def fp32_to_bf16(d_fp32):
-    s = d_fp32.shape
-    d_fp32 = d_fp32.flatten()
-    assert d_fp32.dtype == np.float32
-    d_bf16 = np.empty_like(d_fp32, dtype=np.uint16)
-    for i in range(len(d_bf16)):
-        bytes = struct.pack('f', d_fp32[i])
-        d_bf16[i] = struct.unpack('<H', struct.pack('BB', bytes[2], bytes[3]))[0]
-    return d_bf16.reshape(s)
-
-
 def crop_array(data, shape):
     slices = [slice(0, dim) for dim in shape]
     return data[tuple(slices)]
@@ -113,12 +98,19 @@ def dequantize(d1, threshold):
     return d1
 
 
-def compare_one_array(tc, npz1, npz2, name, verbose, lock, dic, int8_tensor_close,
-                      per_axis_compare):
-    lock.acquire()
+# npz files and settings of each compare worker, opened once by init_worker
+worker_ctx = {}
+
+
+def init_worker(f1, f2, tc, verbose, int8_tensor_close, per_axis_compare):
+    worker_ctx['npz1'] = NpzMmap(f1)
+    worker_ctx['npz2'] = NpzMmap(f2)
+    worker_ctx['args'] = (tc, verbose, int8_tensor_close, per_axis_compare)
+
+
+def compare_one_array(tc, npz1, npz2, name, verbose, int8_tensor_close, per_axis_compare):
     d1 = npz1.get(name)
     d2 = npz2.get(name)
-    lock.release()
     try:
         # dirty hack for NonMaxSuppression
         # onnx and bmodel can get correct shape, but top/tpu always get largest shape
@@ -131,22 +123,23 @@ def compare_one_array(tc, npz1, npz2, name, verbose, lock, dic, int8_tensor_clos
     except:
         print("Error: {} in two npz file is not same shape. {} v.s. {}".format(
             name, d1.shape, d2.shape))
-        result = (False, tc.NOT_MATCH, {}, None)
-        dic[name] = result
-        return result
-    result = tc.compare(d1, d2, verbose, int8_tensor_close, per_axis_compare)
-    dic[name] = result
-    return result
+        return (False, tc.NOT_MATCH, {}, None)
+    return tc.compare(d1, d2, verbose, int8_tensor_close, per_axis_compare)
+
 
+def compare_worker(name):
+    tc, verbose, int8_tensor_close, per_axis_compare = worker_ctx['args']
+    result = compare_one_array(tc, worker_ctx['npz1'], worker_ctx['npz2'], name, verbose,
+                               int8_tensor_close, per_axis_compare)
+    return name, result
 
-def print_result_one_array(tc, npz1, name, dic, verbose, per_axis_compare):
+
+def print_result_one_array(tc, npz1, name, result, verbose, per_axis_compare):
     d1 = npz1[name]
-    tc.print_result(d1, name, dic[name], verbose, per_axis_compare)
+    tc.print_result(d1, name, result, verbose, per_axis_compare)
 
 
 def npz_compare(args_list):
-    lock = multiprocessing.Lock()
-    dic = multiprocessing.Manager().dict()
     args = parse_args(args_list)
     f1 = args.target_file
     f2 = args.ref_file
@@ -166,17 +159,18 @@ def npz_compare(args_list):
     quant_types = {}
 
     int8_tensor_close = args.int8_tensor_close
-    npz1 = np.load(f1)
-    npz2 = np.load(f2)
+    npz1 = NpzMmap(f1)
+    npz2 = NpzMmap(f2)
     tc = TensorCompare(close_order_tol=3,
                        cosine_similarity_tol=tolerance[0],
                        euclidean_similarity_tol=tolerance[1],
                        signal_to_quantization_noise_tol=float('-inf'),
-                       per_axis_compare=args.per_axis_compare)
+                       per_axis_compare=args.per_axis_compare,
+                       max_diffs=args.max_diffs)
 
     common = list()
     for name in npz2.files:
-        if name in npz1.files and name not in excepts:
+        if name in npz1 and name not in excepts:
             common.append(name)
     if ordered_names:
         names = []
@@ -189,42 +183,44 @@ def npz_compare(args_list):
     stats = TensorCompareStats()
 
     names_list = list(names)  # deep copy
-    if len(names_list) > 200:
-        step = len(names_list) // 200
+    if args.max_compare > 0 and len(names_list) > args.max_compare:
+        step = len(names_list) // args.max_compare
         if step > 1:
             names_list = names_list[::step]
         if names[-1] not in names_list:
             # last compare is very important
             names_list.append(names[-1])
-    process_number = min(multiprocessing.cpu_count(), 8)
+    process_number = args.workers if args.workers > 0 else min(multiprocessing.cpu_count(), 8)
+    process_number = min(process_number, max(len(names_list), 1))
     if args.per_axis_compare >= 0:
         process_number = 1
 
-    pbar = tqdm(names, total=len(names_list), position=0, leave=True)
-    while (len(names_list) > 0):
-        compare_process_name_list = names_list[:process_number]
-        names_list = names_list[process_number:]  # remove done name
-        # take process number names
-        # take name which will do compare
-        processes = []
-        for name in compare_process_name_list:
+    # each worker maps the two files by itself, results come back in order
+    if process_number > 1:
+        pool = multiprocessing.Pool(process_number,
+                                    initializer=init_worker,
+                                    initargs=(f1, f2, tc, args.verbose, int8_tensor_close,
+                                              args.per_axis_compare))
+        results = pool.imap(compare_worker, names_list)
+    else:
+        pool = None
+        results = ((name,
+                    compare_one_array(tc, npz1, npz2, name, args.verbose, int8_tensor_close,
+                                      args.per_axis_compare)) for name in names_list)
+    pbar = tqdm(total=len(names_list), position=0, leave=True)
+    try:
+        for name, result in results:
             pbar.set_description("compare {}".format(name))
             pbar.update(1)
-            p = multiprocessing.Process(target=compare_one_array,
-                                        args=(tc, npz1, npz2, name, args.verbose, lock, dic,
-                                              int8_tensor_close, args.per_axis_compare))
-            processes.append(p)
-            p.start()
-
-        for j in processes:
-            j.join()
-        gc.collect()
-
-    for name in names:
-        if dic.get(name) == None:
-            continue
-        stats.update(name, dic.get(name))
-        print_result_one_array(tc, npz1, name, dic, args.verbose, args.per_axis_compare)
+            stats.update(name, result)
+            print_result_one_array(tc, npz1, name, result, args.verbose, args.per_axis_compare)
+    finally:
+        pbar.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+        npz1.close()
+        npz2.close()
 
     stats.print_result()
     if (args.save):
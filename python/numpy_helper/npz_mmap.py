@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# ==============================================================================
+#
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+
+import mmap
+import struct
+import zipfile
+import numpy as np
+
+
+class NpzMmap():
+    """Read-only npz reader which memory-maps the uncompressed members.
+
+    np.savez stores members without compression, so an array is simply a
+    .npy file at some offset of the zip: it is mapped from there instead of
+    being read and copied. Compressed members fall back to a normal read.
+    The arrays returned are read-only.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.zip = zipfile.ZipFile(file)
+        self.fd = open(file, 'rb')
+        try:
+            self.mm = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            self.mm = None
+        self.members = {}
+        for info in self.zip.infolist():
+            name = info.filename
+            if name.endswith('.npy'):
+                name = name[:-4]
+            self.members[name] = info
+        self.files = list(self.members.keys())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        # arrays do not export the buffer of the map, closing it would leave them
+        # dangling: the map is released with the last array referring to it
+        self.mm = None
+        self.fd.close()
+        self.zip.close()
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+    def keys(self):
+        return self.files
+
+    def get(self, name, default=None):
+        if name not in self.members:
+            return default
+        return self[name]
+
+    def __getitem__(self, name):
+        info = self.members[name]
+        if info.compress_type == zipfile.ZIP_STORED and self.mm is not None:
+            data = self.map_member(info)
+            if data is not None:
+                return data
+        with self.zip.open(info) as f:
+            return np.lib.format.read_array(f, allow_pickle=False)
+
+    def map_member(self, info):
+        # local file header: 30 bytes, then the file name and the extra field
+        offset = info.header_offset
+        name_len, extra_len = struct.unpack('<HH', self.mm[offset + 26:offset + 30])
+        start = offset + 30 + name_len + extra_len
+        self.fd.seek(start)
+        version = np.lib.format.read_magic(self.fd)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(self.fd)
+        elif version == (2, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(self.fd)
+        else:
+            return None
+        if dtype.hasobject:
+            return None
+        return np.ndarray(shape,
+                          dtype=dtype,
+                          buffer=self.mm,
+                          offset=self.fd.tell(),
+                          order='F' if fortran_order else 'C')
@@ -42,12 +42,14 @@ class TensorCompare():
                  cosine_similarity_tol=0.99,
                  euclidean_similarity_tol=0.90,
                  signal_to_quantization_noise_tol=50,
-                 per_axis_compare=-1):
+                 per_axis_compare=-1,
+                 max_diffs=0):
         self.close_order_tol = close_order_tol
         self.cosine_similarity_tol = cosine_similarity_tol
         self.euclidean_similarity_tol = euclidean_similarity_tol
         self.signal_to_quantization_noise_tol = signal_to_quantization_noise_tol
         self.per_axis_compare = per_axis_compare
+        self.max_diffs = max_diffs
         return
 
     def square_rooted(self, x):
@@ -82,21 +84,26 @@ class TensorCompare():
         return sqnr
 
     def all_diffs(self, d1, d2):
-        diffs = list()
+        # (index, target, ref) of the differing elements, if max_diffs > 0 only
+        # the max_diffs worst ones, worst first
         d1f = d1.ravel()
         d2f = d2.ravel()
         if d1f.dtype == np.int8:
             assert (d2f.dtype == np.int8)
-            for i in range(len(d1f)):
-                if (d1f[i] != d2f[i]):
-                    diffs.append((i, d1f[i], d2f[i]))
+            err = np.abs(d1f.astype(np.int32) - d2f.astype(np.int32))
+            mask = err != 0
         else:
             atol = 10**(-self.close_order_tol)
             rtol = 10**(-self.close_order_tol)
-            for i in range(len(d1f)):
-                if fabs(d1f[i] - d2f[i]) > (atol + rtol * fabs(d2f[i])):
-                    diffs.append((i, d1f[i], d2f[i]))
-            return diffs
+            d1d = d1f.astype(np.float64)
+            d2d = d2f.astype(np.float64)
+            err = np.abs(d1d - d2d) - (atol + rtol * np.abs(d2d))
+            mask = err > 0
+        idx = np.flatnonzero(mask)
+        if self.max_diffs > 0 and idx.size > self.max_diffs:
+            worst = np.argpartition(-err[idx], self.max_diffs - 1)[:self.max_diffs]
+            idx = idx[worst[np.argsort(-err[idx][worst], kind='stable')]]
+        return list(zip(idx.tolist(), d1f[idx].tolist(), d2f[idx].tolist()))
 
     def diff_details(self, d1, d2, verbose):
         details = {}
@@ -0,0 +1,164 @@
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+
+import os
+import mmap
+import json
+import zlib
+import zipfile
+import numpy as np
+from numpy.lib import format
+
+CODECS = ("none", "zlib")
+
+
+class TensorDump():
+    """Append-only store of named arrays.
+
+    The raw data of the arrays is appended to `file`, and one json line per
+    array to `file + ".idx"` with its offset, dtype and shape. Nothing
+    written is ever rewritten, so a dump costs the same whatever the number
+    of arrays already in the store, and a reader can map the data file
+    while a writer keeps appending. Arrays are stored uncompressed, and
+    read back as read-only views of the map, or zlib compressed at the
+    fastest level with codec="zlib". An array is stored once, the first
+    time its name is written.
+    """
+
+    ALIGN = 64
+
+    def __init__(self, file, mode='r', codec="none"):
+        assert mode in ('r', 'w', 'a'), mode
+        assert codec in CODECS, codec
+        self.file = file
+        self.index_file = file + ".idx"
+        self.mode = mode
+        self.codec = codec
+        self.entries = {}
+        self.mm = None
+        self.index_pos = 0
+        self.data_fd = None
+        self.index_fd = None
+        if mode != 'r':
+            if mode == 'w' or not os.path.exists(file):
+                open(file, 'wb').close()
+                open(self.index_file, 'w').close()
+            self.data_fd = open(file, 'ab')
+            self.index_fd = open(self.index_file, 'a')
+        self.read_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read_index(self):
+        # entries appended since the last read, a partial last line is
+        # being written
+        with open(self.index_file, 'rb') as f:
+            f.seek(self.index_pos)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                self.index_pos += len(line)
+                entry = json.loads(line)
+                self.entries.setdefault(entry["name"], entry)
+
+    def __setitem__(self, name, data):
+        assert self.data_fd is not None, "{} is read-only".format(self.file)
+        if name in self.entries:
+            return
+        array = np.ascontiguousarray(np.asanyarray(data))
+        if array.dtype.hasobject:
+            raise TypeError("{}: object arrays are not supported".format(name))
+        raw = array.tobytes()
+        if self.codec == "zlib":
+            raw = zlib.compress(raw, 1)
+        offset = self.data_fd.tell()
+        pad = -offset % self.ALIGN
+        self.data_fd.write(b'\0' * pad)
+        self.data_fd.write(raw)
+        self.data_fd.flush()
+        entry = {
+            "name": name,
+            "offset": offset + pad,
+            "nbytes": len(raw),
+            "dtype": format.dtype_to_descr(array.dtype),
+            "shape": list(array.shape),
+            "codec": self.codec,
+        }
+        # the index line is written after the data, a reader never sees an
+        # entry without its data
+        self.index_fd.write(json.dumps(entry) + '\n')
+        self.index_fd.flush()
+        self.entries[name] = entry
+
+    def map(self, size):
+        if self.mm is not None and len(self.mm) >= size:
+            return self.mm
+        self.unmap()
+        with open(self.file, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.mm
+
+    def unmap(self):
+        # not closed: the arrays read are views of the map, which has them as
+        # base and is released with the last of them
+        self.mm = None
+
+    def __getitem__(self, name):
+        if name not in self.entries:
+            self.read_index()
+        entry = self.entries[name]
+        dtype = format.descr_to_dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        offset, nbytes = entry["offset"], entry["nbytes"]
+        if nbytes == 0:
+            return np.zeros(shape, dtype=dtype)
+        mm = self.map(offset + nbytes)
+        if entry["codec"] == "zlib":
+            raw = zlib.decompress(mm[offset:offset + nbytes])
+            return np.frombuffer(raw, dtype=dtype).reshape(shape)
+        return np.ndarray(shape, dtype=dtype, buffer=mm, offset=offset)
+
+    def __contains__(self, name):
+        if name not in self.entries:
+            self.read_index()
+        return name in self.entries
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def keys(self):
+        self.read_index()
+        return list(self.entries.keys())
+
+    def get(self, name, default=None):
+        if name not in self:
+            return default
+        return self[name]
+
+    def to_npz(self, npz_file):
+        """export to an npz file, as np.savez, one array in memory at a time"""
+        tmp = npz_file + ".tmp"
+        with zipfile.ZipFile(tmp, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+            for name in self.keys():
+                with zf.open(name + ".npy", 'w', force_zip64=True) as f:
+                    format.write_array(f, np.asanyarray(self[name]), allow_pickle=False)
+        os.replace(tmp, npz_file)
+
+    def close(self):
+        self.unmap()
+        for fd in (self.data_fd, self.index_fd):
+            if fd is not None:
+                fd.close()
+        self.data_fd = None
+        self.index_fd = None
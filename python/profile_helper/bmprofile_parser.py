@@ -11,6 +11,8 @@
 import os
 import re
 import logging
+import functools
+import numpy as np
 import struct as st
 from collections import namedtuple
 import glob
@@ -59,32 +61,141 @@ class MemInfo:
         self.info = info
 
 
-def parse_fixed_length_items(raw_data, FixedType):
-    class FixedItemWrapper():
-        def __str__(self):
-            kv_list=[f"{k}:{getattr(self, k)}" for k in self._fields_]
-            kv_list.sort()
-            return ",".join(kv_list)
-        def add_kv(self, k, v):
-            self._fields_.append(k)
-            setattr(self, k, v)
-    tlen = ct.sizeof(FixedType)
-    items = []
-    while True:
-        num_items = len(items)
-        if len(raw_data) - num_items*tlen == 0:
-            break
-        if len(raw_data)<(num_items+1)*tlen:
+@functools.lru_cache()
+def record_dtype(FixedType):
+    """
+    numpy structured dtype of a ctypes record, with the storage words of
+    its bitfields, and the bitfields as {name: (word, shift, width)}
+    """
+    names, formats, offsets = [], [], []
+    bitfields = {}
+    # the last field wins when names repeat, as with getattr
+    fields = {f[0]: f for f in FixedType._fields_}
+    for name, field in fields.items():
+        ctype = field[1]
+        offset = getattr(FixedType, name).offset
+        if len(field) == 3:
+            word = "_word_{}".format(offset)
+            if word not in names:
+                names.append(word)
+                formats.append(np.dtype(ctype))
+                offsets.append(offset)
+            # bit position, by setting the field in an empty record
+            raw = FixedType()
+            setattr(raw, name, 1)
+            value = int.from_bytes(bytes(raw)[offset:offset + ct.sizeof(ctype)], "little")
+            bitfields[name] = (word, value.bit_length() - 1, field[2])
+        else:
+            names.append(name)
+            formats.append(np.dtype(ctype))
+            offsets.append(offset)
+    dtype = np.dtype({
+        "names": names,
+        "formats": formats,
+        "offsets": offsets,
+        "itemsize": ct.sizeof(FixedType)
+    })
+    return dtype, bitfields
+
+
+class FixedItemWrapper():
+    """
+    object view of one record of FixedItems: fields are read from the
+    columns, other attributes are set on the object as before. Setting a
+    field keeps the value on the object, the columns are not changed.
+    """
+    static = None
+    dynamic = None
+    command = None
+
+    def __init__(self, table, index):
+        self.__dict__["_table"] = table
+        self.__dict__["_index"] = index
+
+    def __getattr__(self, k):
+        table = self.__dict__["_table"]
+        if k in table.columns:
+            return table.columns[k][self.__dict__["_index"]].item()
+        raise AttributeError(k)
+
+    @property
+    def _fields_(self):
+        return self._table.fields + self.__dict__.get("_extra", [])
+
+    def __str__(self):
+        kv_list = [f"{k}:{getattr(self, k)}" for k in self._fields_]
+        kv_list.sort()
+        return ",".join(kv_list)
+
+    def add_kv(self, k, v):
+        self.__dict__.setdefault("_extra", []).append(k)
+        setattr(self, k, v)
+
+
+class FixedItems():
+    """
+    records of a block of fixed length items, decoded at once into numpy
+    columns, one per field. Integer fields are widened to int64 (64 bits
+    ones are kept as uint64) so they can be updated in place. Indexing gives the
+    FixedItemWrapper objects of the records, made on first access and then
+    kept, for the code using them as a list.
+    """
+
+    def __init__(self, raw_data, FixedType):
+        dtype, bitfields = record_dtype(FixedType)
+        num = len(raw_data) // dtype.itemsize
+        if len(raw_data) != num * dtype.itemsize:
             logging.warn("raw_data may be incomplete when parsing fixed length items: " + FixedType.__name__)
-            break
-        item_data = raw_data[num_items*tlen: (num_items+1)*tlen]
-        raw_item = ct.cast(item_data, ct.POINTER(FixedType)).contents
-        item = FixedItemWrapper()
-        for key in raw_item._fields_:
-            setattr(item, key[0], getattr(raw_item, key[0]))
-        item._fields_ = list(x[0] for x in raw_item._fields_)
-        items.append(item)
-    return items
+        records = np.frombuffer(raw_data, dtype=dtype, count=num)
+        self.name = FixedType.__name__
+        self.fields = list({f[0]: None for f in FixedType._fields_})
+        self.columns = {}
+        for name in self.fields:
+            if name in bitfields:
+                word, shift, width = bitfields[name]
+                data = records[word].astype(np.uint64)
+                data = (data >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+                if width < 64:
+                    data = data.astype(np.int64)
+            else:
+                data = records[name]
+            if data.dtype.kind in "iu" and data.dtype != np.uint64:
+                data = data.astype(np.int64)
+            else:
+                data = data.copy()
+            self.columns[name] = data
+        self.items = [None] * num
+
+    def __len__(self):
+        return len(self.items)
+
+    def record(self, index):
+        item = self.items[index]
+        if item is None:
+            item = FixedItemWrapper(self, index)
+            self.items[index] = item
+        return item
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.record(i) for i in range(len(self))[index]]
+        if index < 0:
+            index += len(self)
+        return self.record(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.record(i)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+
+def parse_fixed_length_items(raw_data, FixedType):
+    return FixedItems(raw_data, FixedType)
 
 def parse_dyn_data(raw_data):
     return parse_fixed_length_items(raw_data, DynRecord)
@@ -648,29 +759,29 @@ class BMProfileParser:
         def next_id(raw_id, inc=1):
             return next_id_by_width(raw_id, inc, self.archlib.ID_WIDTH)
 
-        # fix command
-        if self.archlib.ID_WIDTH>16:
-            delta_id = 0
-            last_id = 0
-            for c in commands:
-                if last_id > 65000 and c.inst_id < 1000:
-                    delta_id += 65536
-                last_id = c.inst_id
-                c.inst_id += delta_id
-        for c in commands:
-            c.static = None
-            c.dynamic = None
-            c.command = None
+        # fix command: the id wraps around 65536
+        inst_id = commands.columns["inst_id"]
+        if self.archlib.ID_WIDTH>16 and len(inst_id) > 1:
+            wrap = (inst_id[:-1] > 65000) & (inst_id[1:] < 1000)
+            inst_id[1:] += np.cumsum(wrap, dtype=np.int64) * 65536
+        inst_id = inst_id.tolist()
+        # static/dynamic/command are None until matched, records not yet
+        # made have the defaults of FixedItemWrapper
+        for c in commands.items:
+            if c is not None:
+                c.static = None
+                c.dynamic = None
+                c.command = None
 
         dyn_idx = 0
         cmd_idx = 0
         if static_node:
             for i, d in enumerate(dyn_node):
-                c = commands[cmd_idx]
-                if c.inst_id == 0 and cmd_idx > 0:
+                if inst_id[cmd_idx] == 0 and cmd_idx > 0:
                     dyn_idx = i
                     break
-                if node_id_func(d) == next_id(c.inst_id):
+                if node_id_func(d) == next_id(inst_id[cmd_idx]):
+                    c = commands[cmd_idx]
                     c.dynamic = d
                     c.command = d.command
                     d.pmu_info = c
@@ -678,8 +789,8 @@ class BMProfileParser:
             for s in static_node:
                 if cmd_idx >= len(commands):
                     break
-                c = commands[cmd_idx]
-                if node_id_func(s) == next_id(c.inst_id):
+                if node_id_func(s) == next_id(inst_id[cmd_idx]):
+                    c = commands[cmd_idx]
                     c.static = s
                     c.command = s.command
                     s.pmu_info = c
@@ -688,8 +799,8 @@ class BMProfileParser:
             if cmd_idx >= len(commands):
                 break
             d = dyn_node[i]
-            c = commands[cmd_idx]
-            if node_id_func(d) == next_id(c.inst_id):
+            if node_id_func(d) == next_id(inst_id[cmd_idx]):
+                c = commands[cmd_idx]
                 c.dynamic = d
                 c.command = d.command
                 d.pmu_info = c
@@ -723,17 +834,22 @@ class BMProfileParser:
             if len(dyn_data) > 1:
                 dyn_base_cycle = dyn_data[1].begin_cycle
 
+            # times of all the records at once, the first one is not a node
+            columns = dyn_data.columns
+            base = np.uint64(dyn_base_cycle)
+            begin_usec = (columns["begin_cycle"] - base).view(np.int64)*dyn_cycle_ns/1000
+            end_cycle = columns["end_cycle"]
+            end_usec = (end_cycle - base).view(np.int64)*dyn_cycle_ns/1000
+            no_end = (end_cycle == np.uint64(0xFFFFFFFFFFFFFFFF)) | (end_cycle == 0)
+            columns["begin_usec"] = begin_usec
+            columns["end_usec"] = np.where(no_end, begin_usec + 0.01, end_usec)
+
             extra_data = item.dyn_extra
             gdma_parser = self.archlib.GDMACommandParser()
             bd_parser = self.archlib.BDCommandParser()
             for d in dyn_data[1:]:
                 d.pmu_info = None
                 d.sim_info = None
-                d.begin_usec = (d.begin_cycle - dyn_base_cycle)*dyn_cycle_ns/1000
-                if d.end_cycle == 0xFFFFFFFFFFFFFFFF or d.end_cycle == 0:
-                    d.end_usec = d.begin_usec + 0.01
-                else:
-                    d.end_usec = (d.end_cycle - dyn_base_cycle)*dyn_cycle_ns/1000
                 d.extra = extra_data.get(d.profile_id, [])
                 d.info = []
                 d.command = None
@@ -823,21 +939,21 @@ class BMProfileParser:
 
         # calibrate time
         def reset_monitor_time(monitor_data, start_cycle=0):
-            monitor_start = 0
-            if len(monitor_data)>0:
-                monitor_start = monitor_data[0].inst_start_time
-            last_start_time = 0
-            last_end_time = 0
-            fixed_offset = start_cycle
-            for n in monitor_data:
-                if n.inst_start_time < last_start_time or n.inst_end_time < last_end_time:
-                    fixed_offset += 1<<32
-                last_start_time = n.inst_start_time
-                last_end_time = n.inst_end_time
-                n.add_kv("raw_inst_start_time", n.inst_start_time)
-                n.add_kv("raw_inst_end_time", n.inst_end_time)
-                n.inst_start_time = int(n.inst_start_time - monitor_start + fixed_offset)
-                n.inst_end_time = int(n.inst_end_time - monitor_start + fixed_offset)
+            if len(monitor_data) == 0:
+                return
+            columns = monitor_data.columns
+            start = columns["inst_start_time"]
+            end = columns["inst_end_time"]
+            monitor_start = start[0]
+            # the 32 bits counters wrap around
+            wrap = np.zeros(len(start), dtype=np.int64)
+            wrap[1:] = (start[1:] < start[:-1]) | (end[1:] < end[:-1])
+            fixed_offset = start_cycle + np.cumsum(wrap).astype(np.float64) * (1<<32)
+            columns["raw_inst_start_time"] = start.copy()
+            columns["raw_inst_end_time"] = end.copy()
+            monitor_data.fields += ["raw_inst_start_time", "raw_inst_end_time"]
+            columns["inst_start_time"] = np.trunc((start - monitor_start) + fixed_offset).astype(np.int64)
+            columns["inst_end_time"] = np.trunc((end - monitor_start) + fixed_offset).astype(np.int64)
 
         reset_monitor_time(item.monitor_gdma, monitor_start_time/global_data.gdma_period)
         reset_monitor_time(item.monitor_bd, monitor_start_time/global_data.tiu_period)
@@ -858,9 +974,8 @@ class BMProfileParser:
                         offset = gdma_start - n.pmu_info.inst_start_time
                         break
                 if offset != 0:
-                    for n in item.monitor_bd:
-                        n.inst_start_time += offset
-                        n.inst_end_time += offset
+                    item.monitor_bd.columns["inst_start_time"] += offset
+                    item.monitor_bd.columns["inst_end_time"] += offset
                     break
         elif len(dyn_gdma)>0 and len(dyn_bd)>0:
             for gdma_node in dyn_gdma:
@@ -874,9 +989,8 @@ class BMProfileParser:
                         offset = max(gdma_start - n.pmu_info.inst_start_time, int(n.end_usec/global_data.tiu_period))
                         break
                 if offset != 0:
-                    for n in item.monitor_bd:
-                        n.inst_start_time += offset
-                        n.inst_end_time += offset
+                    item.monitor_bd.columns["inst_start_time"] += offset
+                    item.monitor_bd.columns["inst_end_time"] += offset
                     break
         else:
             print("WARNING: Cannot determine tiu start time, use 0 instead")
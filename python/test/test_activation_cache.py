@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+
+import os
+import numpy as np
+import pytest
+
+activation_cache = pytest.importorskip("calibration.activation_cache", exc_type=ImportError)
+
+
+class FakeModule:
+
+    def __init__(self, tensors):
+        self.tensors = tensors
+        self.reads = []
+
+    def get_tensor(self, name):
+        self.reads.append(name)
+        return self.tensors[name]
+
+
+def make_cache(tmp_path, max_size):
+    mlir_file = tmp_path / "model.mlir"
+    mlir_file.write_text("module {}\n")
+    return activation_cache.ActivationCache(str(tmp_path / "cache"), str(mlir_file), max_size)
+
+
+def test_cached_module(tmp_path):
+    cache = make_cache(tmp_path, 1 << 20)
+    tensors = {"a": np.ones(4, np.float32), "b": np.zeros(4, np.float32)}
+    module = FakeModule(tensors)
+    cached = activation_cache.CachedModule(module, cache)
+    assert not cached.set_sample("s0", ["a", "b"])
+    for name in ["a", "b"]:
+        cached.get_tensor(name)
+    assert cached.set_sample("s0", ["a", "b"])
+    np.testing.assert_array_equal(cached.get_tensor("a"), tensors["a"])
+    assert module.reads == ["a", "b"]
+    # evicted by another process, the whole sample is a miss
+    os.remove(cache.tensor_path("s0", "b"))
+    assert not cached.set_sample("s0", ["a", "b"])
+    np.testing.assert_array_equal(cached.get_tensor("b"), tensors["b"])
+    assert module.reads == ["a", "b", "b"]
+    assert cache.get("s0", "b") is not None
+
+
+def test_evict(tmp_path):
+    data = np.zeros(256, np.float32)
+    size = 1024 + 128  # the data and the npy header
+    cache = make_cache(tmp_path, 4 * size)
+    for i in range(3):
+        cache.put("s0", str(i), data)
+    assert cache.total_size == 3 * size
+    # a file of another model is counted once the directory is scanned again
+    other = os.path.join(cache.cache_dir, "other", "s0")
+    os.makedirs(other)
+    np.save(os.path.join(other, "x.npy"), data)
+    os.utime(os.path.join(other, "x.npy"), (0, 0))
+    cache.rescan()
+    assert cache.total_size == 4 * size
+    cache.get("s0", "0")
+    cache.put("s0", "3", data)
+    # down to 80% of the whole directory, least recently used first
+    assert cache.total_size == 3 * size
+    assert not os.path.exists(os.path.join(other, "x.npy"))
+    assert cache.get("s0", "1") is None
+    assert all(cache.get("s0", n) is not None for n in ["0", "2", "3"])
+    assert len(cache.scan()) == 3
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+
+import os
+import numpy as np
+import pytest
+from utils.build_cache import BuildCache, mlir_files, mlir_weight_file
+
+
+def write(path, data):
+    with open(path, "w") as f:
+        f.write(data)
+    return str(path)
+
+
+def read(path):
+    with open(path, "r") as f:
+        return f.read()
+
+
+def test_key(tmp_path):
+    cache = BuildCache(str(tmp_path / "cache"), version="v1")
+    a = write(tmp_path / "a.txt", "a")
+    key = cache.key("stage", [a], {"x": 1})
+    assert key == cache.key("stage", [a], {"x": 1})
+    assert key != cache.key("other", [a], {"x": 1})
+    assert key != cache.key("stage", [a], {"x": 2})
+    assert key != cache.key("stage", [a, None], {"x": 1})
+    assert key != BuildCache(str(tmp_path / "cache"), version="v2").key("stage", [a], {"x": 1})
+    write(a, "b")
+    assert key != cache.key("stage", [a], {"x": 1})
+
+
+def test_run_stage(tmp_path):
+    cache = BuildCache(str(tmp_path / "cache"))
+    src = write(tmp_path / "src.txt", "src")
+    out = str(tmp_path / "out" / "model.mlir")
+    extra = str(tmp_path / "out" / "model_weight.npz")
+    runs = []
+
+    def run():
+        runs.append(1)
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+        write(out, "mlir")
+        write(extra, "weight")
+
+    assert not cache.run_stage("s", [src], {}, [out], run, lambda: [extra])
+    os.remove(out)
+    os.remove(extra)
+    assert cache.run_stage("s", [src], {}, [out], run, lambda: [extra])
+    assert len(runs) == 1
+    # extras are restored next to the first output
+    assert read(out) == "mlir" and read(extra) == "weight"
+    assert (cache.hits, cache.misses) == (1, 1)
+    # the outputs of a stage changed
+    key = cache.key("s", [src], {})
+    assert not cache.restore(key, [out, str(tmp_path / "other")])
+
+
+def test_evict(tmp_path):
+    cache = BuildCache(str(tmp_path / "cache"), max_size=0)
+    keys = []
+    for i in range(4):
+        f = write(tmp_path / "f{}".format(i), str(i) * 1000)
+        keys.append(cache.key("s", [f]))
+        cache.store(keys[-1], "s", [f])
+        # lru clock
+        manifest = os.path.join(cache.entry_dir(keys[-1]), "manifest.json")
+        os.utime(manifest, (i, i))
+    assert all(cache.contains(k) for k in keys)
+    cache.restore(keys[0], [str(tmp_path / "r0")])
+    cache.max_size = 2500
+    cache.evict()
+    # down to 80% of max_size, the least recently used first
+    assert [cache.contains(k) for k in keys] == [True, False, False, False]
+    assert not any(n.endswith((".tmp", ".del")) for n in os.listdir(os.path.dirname(cache.entry_dir(keys[0]))))
+
+
+def test_cache_skip_env(tmp_path, monkeypatch):
+    pytest.importorskip("pymlir")
+    import argparse
+    import utils.build_cache as build_cache
+    monkeypatch.setattr(build_cache, "DEFAULT_CACHE_DIR", str(tmp_path / "default"))
+    monkeypatch.delenv("BUILD_CACHE", raising=False)
+    args = argparse.Namespace(build_cache=None, cache_skip=False)
+    monkeypatch.delenv("CACHE_SKIP", raising=False)
+    assert build_cache.create_build_cache(args) is None
+    # the environment of the former CacheTool selects the default directory
+    monkeypatch.setenv("CACHE_SKIP", "True")
+    assert build_cache.create_build_cache(args).cache_dir == str(tmp_path / "default")
+
+
+def test_mlir_files(tmp_path):
+    weight = tmp_path / "model_top_f32_all_weight.npz"
+    np.savez(str(weight), w=np.ones(2))
+    mlir = write(tmp_path / "model.mlir",
+                 'module attributes {module.weight_file = "model_top_f32_all_weight.npz"} {\n}\n')
+    assert mlir_weight_file(mlir) == str(weight)
+    assert mlir_files(mlir) == [mlir, str(weight)]
+
+
+def test_onnx_external_data(tmp_path):
+    onnx = pytest.importorskip("onnx")
+    model_transform = pytest.importorskip("tools.model_transform", exc_type=ImportError)
+    from onnx import helper, numpy_helper, TensorProto
+    w = numpy_helper.from_array(np.ones((64, 64), dtype=np.float32), "w")
+    graph = helper.make_graph([helper.make_node("MatMul", ["x", "w"], ["y"])], "g",
+                              [helper.make_tensor_value_info("x", TensorProto.FLOAT, [1, 64])],
+                              [helper.make_tensor_value_info("y", TensorProto.FLOAT, [1, 64])],
+                              initializer=[w])
+    model_def = str(tmp_path / "m.onnx")
+    onnx.save(helper.make_model(graph), model_def, save_as_external_data=True,
+              location="m.data", size_threshold=0)
+    assert model_transform.onnx_external_data(model_def) == [str(tmp_path / "m.data")]
+
+
+def test_extras_next_to_outputs(tmp_path):
+    # the weights of the final mlir next to it, the profile next to the model
+    cache = BuildCache(str(tmp_path / "cache"))
+    src = write(tmp_path / "src.txt", "src")
+    os.makedirs(str(tmp_path / "models"))
+    model = str(tmp_path / "models" / "m.bmodel")
+    final = str(tmp_path / "m_final.mlir")
+    weight = str(tmp_path / "m_final_weight.npz")
+    profile = model + ".compiler_profile_0.txt"
+
+    def run():
+        for f in (model, final, weight, profile):
+            write(f, os.path.basename(f))
+
+    cache.run_stage("codegen", [src], {}, [model, final], run, lambda: [weight, profile])
+    for f in (model, final, weight, profile):
+        os.remove(f)
+    assert cache.run_stage("codegen", [src], {}, [model, final], run, lambda: [weight, profile])
+    for f in (model, final, weight, profile):
+        assert read(f) == os.path.basename(f)
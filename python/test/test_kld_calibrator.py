@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+
+import numpy as np
+import pytest
+
+kld_calibrator = pytest.importorskip("calibration.kld_calibrator", exc_type=ImportError)
+
+
+class FakeModule:
+    # evaled_op is y = a * b, b is not quantized
+    def __init__(self):
+        self.tensors = {}
+
+    def set_tensor(self, name, value):
+        self.tensors[name] = value
+
+    def invoke_at(self, op):
+        return self.tensors["a"] * self.tensors["b"]
+
+
+def test_threshold_metrics():
+    np.random.seed(0)
+    ref = np.random.randn(50).astype(np.float32)
+    outputs = ref[None, :] + np.random.randn(4, 50).astype(np.float32) * [[0.0], [0.1], [1.0], [5.0]]
+    outputs = outputs.astype(np.float32)
+    outputs[3, 7] = np.nan
+    expected = []
+    for out in outputs:
+        # the per threshold computation of calc_distance
+        out = out.copy()
+        out[np.isnan(out)] = 0.0
+        distance = np.linalg.norm(ref - out) / np.linalg.norm(ref, ord=1)
+        expected.append((distance, kld_calibrator.cosine_sim(out, ref.copy())))
+    distance, cos_sim = kld_calibrator.threshold_metrics(outputs, ref)
+    np.testing.assert_allclose(distance, [d for d, _ in expected], rtol=1e-5)
+    np.testing.assert_allclose(cos_sim, [c for _, c in expected], rtol=1e-5)
+    assert distance[0] == 0 and distance[1] < distance[2] < distance[3]
+
+
+def test_threshold_distances():
+    np.random.seed(1)
+    b = np.random.rand(2, 8).astype(np.float32)
+    module = FakeModule()
+    module.set_tensor("b", b)
+    samples = []
+    for _ in range(3):
+        a = np.random.randn(2, 8).astype(np.float32)
+        samples.append(({"a": a}, a * b))
+    thresholds = [0.5, 1.0, 2.0, 4.0]
+    distance, cos_sim = kld_calibrator.threshold_distances(module, "y", samples, thresholds)
+    for t, threshold in enumerate(thresholds):
+        d, c = 0.0, 0.0
+        for inputs, ref in samples:
+            out = kld_calibrator.import_quant_bias(inputs["a"].copy(), threshold) * b
+            d += np.linalg.norm((ref - out).flatten()) / np.linalg.norm(ref.flatten(), ord=1)
+            c += kld_calibrator.cosine_sim(out, ref.copy())
+        assert distance[t] == pytest.approx(d, rel=1e-5)
+        assert cos_sim[t] == pytest.approx(c, rel=1e-5)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+
+import argparse
+import os
+from types import SimpleNamespace
+import numpy as np
+import pytest
+
+onnx = pytest.importorskip("onnx")
+pytest.importorskip("pymlir")
+pytest.importorskip("torch")
+from onnx import helper, numpy_helper, TensorProto
+from tools.model_transform import OnnxTransformer
+from tools.model_runner import mlir_inference
+import utils.learning_quant as learning_quant
+
+CHIP = "bm1684x"
+
+
+class FakeRefs:
+
+    def __init__(self, num_sample):
+        self.num_sample = num_sample
+        self.calls = {}
+
+    def get(self, name, idx):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        return np.full((2, 3), idx, dtype=np.float32)
+
+
+def test_gather_refs_shared():
+    # m1 and m2 read x through their own reshapes not in the module
+    pre_ops = {"m1": ["r1"], "m2": ["r2"], "r1": ["x"], "r2": ["x"]}
+    parser = SimpleNamespace(get_pre_op_by_op_name=lambda op: pre_ops[op],
+                             get_op_type_by_op_name=lambda op: "top.Reshape")
+    refs = FakeRefs(2)
+    learner = SimpleNamespace(parser=parser, module=SimpleNamespace(all_tensor_names=["x"]),
+                              ref_tensors=refs, num_sample=2)
+    names, arrays = learning_quant.gather_refs(learner, ["m1", "m2"])
+    assert names == {"m1": ["m1", "r1", "x"], "m2": ["m2", "r2", "x"]}
+    assert sorted(arrays) == ["m1", "m2", "r1", "r2", "x"]
+    # x is stacked once for the group
+    assert refs.calls["x"] == 2
+    descs, shms = learning_quant.share_arrays(arrays)
+    try:
+        # one segment per tensor
+        assert len(shms) == len(arrays)
+        shm = shms[list(arrays).index("x")]
+        assert descs["x"] == (shm.name, (2, 2, 3), "<f4")
+        np.testing.assert_array_equal(np.ndarray((2, 2, 3), dtype=np.float32, buffer=shm.buf), arrays["x"])
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+
+def matmul_model(name):
+    # x -> r1 -> m1 and x -> r2 -> m2, m1 and m2 are learned in one group
+    np.random.seed(0)
+    w1 = numpy_helper.from_array(np.random.randn(16, 8).astype(np.float32), "w1")
+    w2 = numpy_helper.from_array(np.random.randn(16, 8).astype(np.float32), "w2")
+    s1 = numpy_helper.from_array(np.array([2, 16], dtype=np.int64), "s1")
+    s2 = numpy_helper.from_array(np.array([1, 2, 16], dtype=np.int64), "s2")
+    nodes = [
+        helper.make_node("Reshape", ["x", "s1"], ["r1"]),
+        helper.make_node("Reshape", ["x", "s2"], ["r2"]),
+        helper.make_node("MatMul", ["r1", "w1"], ["m1"]),
+        helper.make_node("MatMul", ["r2", "w2"], ["m2"]),
+    ]
+    graph = helper.make_graph(nodes, name,
+                              [helper.make_tensor_value_info("x", TensorProto.FLOAT, [2, 16])],
+                              [helper.make_tensor_value_info("m1", TensorProto.FLOAT, [2, 8]),
+                               helper.make_tensor_value_info("m2", TensorProto.FLOAT, [1, 2, 8])],
+                              initializer=[w1, w2, s1, s2])
+    model = helper.make_model(graph, producer_name=name)
+    model.opset_import[0].version = 13
+    return model
+
+
+def test_workers_param_back(tmp_path):
+    cwd = os.getcwd()
+    os.chdir(str(tmp_path))
+    try:
+        name = "learning_matmul"
+        fp32_mlir = name + ".mlir"
+        OnnxTransformer(name, matmul_model(name)).model_transform(fp32_mlir)
+        os.makedirs("dataset")
+        table = name + "_cali_table"
+        with open(table, "w") as f:
+            for i in range(3):
+                x = np.random.randn(2, 16).astype(np.float32)
+                np.savez("dataset/x{}.npz".format(i), x=x)
+            for k, v in mlir_inference({"x": x}, fp32_mlir, True).items():
+                f.write("{} {} {} {}\n".format(k, np.abs(v).max(), v.min(), v.max()))
+        args = argparse.Namespace(mlir_file=fp32_mlir, dataset="dataset", data_list=None,
+                                  mini_batch=1, epoch=1, chip=CHIP, excepts="", workers=1)
+        learning_quant.loger = learning_quant.logging(str(tmp_path / "logging"))
+        param_back = []
+        for workers in (1, 2):
+            args.workers = workers
+            searcher = learning_quant.LearningGptqWeight(args)
+            assert len(searcher.finetune_layers) == 2
+            searcher.scales = learning_quant.CaliTable(table, table + "_new").table
+            inputs = learning_quant.learning_inputs(searcher.parser, args)
+            searcher.num_sample = inputs.prepare(3)
+            searcher.ref_tensors = learning_quant.ref_tensors(searcher, inputs)
+            learning_quant.learning_in_groups(searcher, workers)
+            param_back.append(searcher.param_back)
+        learning_quant.loger.end()
+        assert sorted(param_back[0]) == sorted(param_back[1])
+        for k in param_back[0]:
+            np.testing.assert_array_equal(param_back[0][k], param_back[1][k])
+    finally:
+        os.chdir(cwd)
+
+
+def test_update_h():
+    np.random.seed(0)
+    parser = SimpleNamespace(get_op_type_by_op_name=lambda op: "top.MatMul")
+    learner = SimpleNamespace(H={}, samples={}, parser=parser,
+                              orig_weights={"m": np.zeros((8, 4), np.float32)})
+    inputs = [np.random.randn(1, 3, 8).astype(np.float32) for _ in range(4)]
+    learning_quant.LearningGptqWeight.update_H(learner, "m", inputs[:1])
+    learning_quant.LearningGptqWeight.update_H(learner, "m", inputs[1:])
+    # the running update of GPTQ, one sample at a time
+    H = np.zeros((8, 8))
+    for n, input in enumerate(inputs):
+        inp = input.reshape(-1, 8).transpose().astype(np.float64)
+        H = H * n / (n + 1) + 2 / (n + 1) * inp @ inp.T
+    assert learner.samples["m"] == 4
+    np.testing.assert_allclose(learner.H["m"], H, rtol=1e-5)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+
+import argparse
+import os
+import numpy as np
+import pytest
+
+onnx = pytest.importorskip("onnx")
+pytest.importorskip("pymlir")
+from onnx import helper, numpy_helper, TensorProto
+from tools.model_transform import OnnxTransformer
+from tools.model_runner import mlir_inference
+from calibration.mix_precision import MixQuantModel, MixPrecModule
+from calibration.sensitive_layer import SensitiveLayer
+
+CHIP = "bm1684x"
+
+
+def conv_model(name):
+    # x -> c1 -> c2, c1 is tuned and c2 is its int8 user
+    np.random.seed(0)
+    w1 = numpy_helper.from_array(np.random.randn(8, 4, 3, 3).astype(np.float32), "w1")
+    w2 = numpy_helper.from_array(np.random.randn(8, 8, 3, 3).astype(np.float32), "w2")
+    nodes = [
+        helper.make_node("Conv", ["x", "w1"], ["c1"], pads=[1, 1, 1, 1]),
+        helper.make_node("Conv", ["c1", "w2"], ["c2"], pads=[1, 1, 1, 1]),
+    ]
+    graph = helper.make_graph(nodes, name,
+                              [helper.make_tensor_value_info("x", TensorProto.FLOAT, [1, 4, 8, 8])],
+                              [helper.make_tensor_value_info("c2", TensorProto.FLOAT, [1, 8, 8, 8])],
+                              initializer=[w1, w2])
+    model = helper.make_model(graph, producer_name=name)
+    model.opset_import[0].version = 13
+    return model
+
+
+@pytest.fixture(scope="module")
+def sensitive(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp("mix_precision")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    name = "mix_prec_conv"
+    fp32_mlir = name + ".mlir"
+    OnnxTransformer(name, conv_model(name)).model_transform(fp32_mlir)
+    x = np.random.randn(1, 4, 8, 8).astype(np.float32)
+    os.makedirs("dataset")
+    np.savez("dataset/x.npz", x=x)
+    table = name + "_cali_table"
+    with open(table, "w") as f:
+        for k, v in mlir_inference({"x": x}, fp32_mlir, True).items():
+            f.write("{} {} {} {}\n".format(k, np.abs(v).max(), v.min(), v.max()))
+    args = argparse.Namespace(mlir_file=fp32_mlir, chip=CHIP, calibration_table=table,
+                              dataset="dataset", data_list=None, input_num=1, inference_num=1,
+                              fp_type="auto", quantize_table=None, post_process=None,
+                              debug_cmd="")
+    layer = SensitiveLayer(args, None, None)
+    yield layer
+    os.chdir(cwd)
+
+
+def test_partial_infer_matches_lowering(sensitive):
+    mix_prec = sensitive.mix_prec
+    int8_model = MixQuantModel(sensitive.fp32_mlir, CHIP, sensitive.cali_table_name)
+    float_model = MixQuantModel(sensitive.fp32_mlir, CHIP)
+    predictions_gt = []
+    mix_prec.run_model(float_model, True, None, None, predictions_gt)
+    mix_prec.enable_print()
+    base = 1 - mix_prec.run_model(int8_model, False, None, None, predictions_gt)
+    mix_module = MixPrecModule(sensitive.fp32_mlir, int8_model, float_model)
+    mix_module.set_mix_layers([])
+    mix_table = mix_prec._gen_mix_table([])
+    # a threshold clipping c1, the loss of the mix model lowered again
+    th = sensitive.cali_table.thresholds_map["c1"][0] / 4
+    new_table = sensitive.set_layer_new_th(int8_model, "c1", th)
+    lowered = sensitive.run_trial(None, "c1", th, new_table, mix_table, None, None,
+                                  predictions_gt)
+    partial = sensitive.run_trial(mix_module, "c1", th, new_table, mix_table, None, None,
+                                  predictions_gt)
+    assert abs(lowered - base) > 1e-3
+    assert abs(partial - lowered) < 1e-3
+    # the activations of the sample are kept, the next try runs c1 and c2 only
+    assert 0 in mix_module.samples and mix_module.cache_size > 0
+    again = sensitive.run_trial(mix_module, "c1", th, new_table, mix_table, None, None,
+                                predictions_gt)
+    assert again == partial
+    mix_module.reset_threshold("c1")
+    assert abs(1 - mix_prec.run_model(mix_module, False, None, None, predictions_gt) - base) < 1e-6
+    mix_module.clean()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+
+from types import SimpleNamespace
+import pytest
+
+mlir_parser = pytest.importorskip("utils.mlir_parser", exc_type=ImportError)
+
+
+def op(name, type, opds, outputs=None):
+    return SimpleNamespace(name=name, type=type, opds=opds,
+                           outputs=[name] if outputs is None else outputs)
+
+
+def graph_parser():
+    #  x -> a -> b ----> d -> e
+    #       |    \-> c --^    ^
+    #       \-----------------/   e uses a twice
+    ops = [
+        op("x", "top.Input", []),
+        op("w", "top.Weight", []),
+        op("a", "top.Conv", ["x", "w", "none"]),
+        op("b", "top.Relu", ["a"]),
+        op("c", "top.Sigmoid", ["b"]),
+        op("d", "top.Add", ["b", "c"]),
+        op("e", "top.Concat", ["d", "a", "a"]),
+    ]
+    parser = mlir_parser.MlirParser.__new__(mlir_parser.MlirParser)
+    parser.ops = ops
+    parser.build_index()
+    return parser
+
+
+def old_pre_ops(parser, name):
+    outputs = parser.get_op_output_name_list()
+    return [opd for o in parser.ops if o.name == name for opd in o.opds if opd in outputs]
+
+
+def old_next_ops(parser, name):
+    outputs = parser.get_op_output_name_list()
+    return [o.name for o in parser.ops if name in o.opds and o.name in outputs]
+
+
+def test_queries():
+    parser = graph_parser()
+    for name in ["x", "a", "b", "d", "e", "none"]:
+        assert parser.get_pre_op_by_op_name(name) == old_pre_ops(parser, name)
+        assert parser.get_next_op_by_op_name(name) == old_next_ops(parser, name)
+        assert parser.get_user_count_by_op_name(name) == sum(name in o.opds for o in parser.ops)
+        assert parser.get_use_count_by_op_name(name) == sum(o.opds.count(name) for o in parser.ops)
+    assert parser.get_pre_op_by_op_name("a") == ["x", "w"]
+    assert parser.get_next_op_by_op_name("a") == ["b", "e"]
+    assert parser.get_use_count_by_op_name("a") == 3
+    assert parser.get_op_type_by_op_name("c") == "top.Sigmoid"
+    assert parser.get_opds_by_op_name("d") == ["b", "c"]
+    assert parser.get_op_by_op_name("none") is None
+    assert parser.get_producer_by_tensor_name("b").name == "b"
+    assert [o.name for o in parser.get_consumers_by_tensor_name("b")] == ["c", "d"]
+
+
+def old_all_ops(name, neighbours, keep):
+    # the breadth first walk the index replaced
+    all_ops = [name] + neighbours(name)
+    cur_ops = neighbours(name)
+    while cur_ops:
+        for new_op in neighbours(cur_ops.pop(0)):
+            if new_op not in all_ops:
+                cur_ops.append(new_op)
+                if keep(new_op):
+                    all_ops.append(new_op)
+    return all_ops
+
+
+def test_closures():
+    parser = graph_parser()
+    for name in ["x", "w", "a", "b", "c", "d", "e"]:
+        pre_ops = parser.get_all_pre_ops_by_op_name(name)
+        old = old_all_ops(name, parser.get_pre_op_by_op_name, parser.get_pre_op_by_op_name)
+        # the op and its inputs first
+        direct = len(parser.get_pre_op_by_op_name(name)) + 1
+        assert pre_ops[:direct] == old[:direct]
+        assert sorted(pre_ops) == sorted(old)
+        next_ops = parser.get_all_next_ops_by_op_name(name)
+        old = old_all_ops(name, parser.get_next_op_by_op_name, lambda op: True)
+        assert sorted(next_ops) == sorted(old)
+    # the inputs as listed by the op, then the ancestors in block order
+    assert parser.get_all_pre_ops_by_op_name("e") == ["e", "d", "a", "a", "b", "c"]
+    # graph inputs are only kept as direct inputs
+    assert parser.get_all_pre_ops_by_op_name("b") == ["b", "a"]
+    assert parser.get_all_pre_ops_by_op_name("a") == ["a", "x", "w"]
+    assert parser.get_all_next_ops_by_op_name("x") == ["x", "a", "b", "c", "d", "e"]
+    # memoized, a copy is returned
+    parser.get_all_next_ops_by_op_name("c").append("f")
+    assert parser.get_all_next_ops_by_op_name("c") == ["c", "d", "e"]
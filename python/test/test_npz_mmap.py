@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+
+import numpy as np
+import pytest
+from numpy_helper.npz_mmap import NpzMmap
+from numpy_helper.npz_compare import npz_compare
+
+
+def test_map_members(tmp_path):
+    file = str(tmp_path / "a.npz")
+    arrays = {
+        "f32": np.random.randn(3, 5).astype(np.float32),
+        "fortran": np.asfortranarray(np.arange(12, dtype=np.int16).reshape(3, 4)),
+        "empty": np.zeros((0, 2), dtype=np.int8),
+        "scalar": np.array(2.5),
+    }
+    np.savez(file, **arrays)
+    with NpzMmap(file) as npz:
+        assert npz.keys() == list(arrays) and len(npz) == 4
+        assert "f32" in npz and npz.get("none") is None
+        for k, v in arrays.items():
+            d = npz[k]
+            assert d.dtype == v.dtype
+            np.testing.assert_array_equal(d, v)
+        # mapped from the file, not copied
+        d = npz["f32"]
+        assert not d.flags.owndata and not d.flags.writeable
+        assert npz["fortran"].flags.f_contiguous
+    # the arrays still refer to the map after close
+    np.testing.assert_array_equal(d, arrays["f32"])
+
+
+def test_compressed(tmp_path):
+    file = str(tmp_path / "c.npz")
+    np.savez_compressed(file, a=np.arange(100), b=np.ones((4, 4), dtype=np.float16))
+    with NpzMmap(file) as npz:
+        np.testing.assert_array_equal(npz["a"], np.arange(100))
+        assert npz["b"].dtype == np.float16
+
+
+def test_npz_compare(tmp_path):
+    f1 = str(tmp_path / "target.npz")
+    f2 = str(tmp_path / "ref.npz")
+    a = np.random.randn(64).astype(np.float32)
+    np.savez(f1, a=a, b=np.arange(32, dtype=np.float32), c=np.ones(2))
+    np.savez(f2, a=a * 1.0001, b=np.arange(32, dtype=np.float32))
+    for workers in ("1", "2"):
+        stats = npz_compare([f1, f2, "--workers", workers])
+        assert stats.failed == 0 and list(stats.results) == ["a", "b"]
+    np.savez(f2, a=-a, b=np.arange(32, dtype=np.float32))
+    with pytest.raises(SystemExit):
+        npz_compare([f1, f2])
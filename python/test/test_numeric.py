@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+
+import numpy as np
+import pytest
+from utils.numeric import bf16_to_fp32, fp32_to_bf16, fp8e4m3_to_fp32, fp8e5m2_to_fp32
+from numpy_helper.tensor_compare import TensorCompare
+
+
+def test_bf16():
+    x = np.array([[1.0, -2.5], [3.0e38, 1.0e-40]], dtype=np.float32)
+    b = fp32_to_bf16(x)
+    assert b.dtype == np.uint16 and b.shape == (2, 2)
+    np.testing.assert_array_equal(bf16_to_fp32(b), (x.view(np.uint32) & 0xFFFF0000).view(np.float32))
+    # ties to even: 1 + 2^-8 down to 1, 1 + 3 * 2^-8 up to 1 + 2^-6
+    # below half an ulp: 1 + 2^-7 + 2^-9 down to 1 + 2^-7
+    x = np.array([1 + 2**-8, 1 + 3 * 2**-8, 1 + 2**-7 + 2**-9, np.nan, np.inf], dtype=np.float32)
+    r = bf16_to_fp32(fp32_to_bf16(x, rounding=True))
+    np.testing.assert_array_equal(r[:3], [1.0, 1 + 2**-6, 1 + 2**-7])
+    assert np.isnan(r[3]) and r[4] == np.inf
+    # truncated
+    assert bf16_to_fp32(fp32_to_bf16(x[1:2]))[0] == 1 + 2**-7
+
+
+def test_fp8():
+    code = np.array([0x00, 0x01, 0x08, 0x38, 0x7E, 0x7F, 0xB8, 0xFF], dtype=np.uint8)
+    v = fp8e4m3_to_fp32(code)
+    np.testing.assert_array_equal(v[[0, 1, 2, 3, 4, 6]], [0, 2**-9, 2**-6, 1, 448, -1])
+    assert np.isnan(v[5]) and np.isnan(v[7])
+    code = np.array([0x01, 0x3C, 0x7B, 0x7C, 0x7D, 0xFC], dtype=np.uint8)
+    v = fp8e5m2_to_fp32(code).reshape(2, 3)
+    assert v.dtype == np.float32 and v.shape == (2, 3)
+    np.testing.assert_array_equal(v.ravel()[[0, 1, 2, 3, 5]], [2**-16, 1, 57344, np.inf, -np.inf])
+    assert np.isnan(v[1, 1])
+    with pytest.raises(AssertionError):
+        fp8e4m3_to_fp32(code.astype(np.int8))
+
+
+def test_debugger_fp8():
+    op_support = pytest.importorskip("debugger.target_common.op_support", exc_type=ImportError)
+    code = np.arange(256, dtype=np.uint8).reshape(16, 16)
+    for to_fp16, to_fp32 in ((op_support.fp8e4m3_to_fp16, fp8e4m3_to_fp32),
+                             (op_support.fp8e5m2_to_fp16, fp8e5m2_to_fp32)):
+        d = to_fp16(code)
+        # all the fp8 values are exact in fp16
+        assert d.dtype == np.float16 and d.shape == (16, 16)
+        np.testing.assert_array_equal(d.astype(np.float32), to_fp32(code))
+
+
+def test_all_diffs():
+    tc = TensorCompare(close_order_tol=3)
+    d1 = np.zeros((4, 4), dtype=np.float32)
+    d2 = d1.copy()
+    d2[0, 1] = 1.0
+    d2[2, 3] = -3.0
+    d2[3, 3] = 1e-5
+    assert tc.all_diffs(d1, d2) == [(1, 0.0, 1.0), (11, 0.0, -3.0)]
+    tc.max_diffs = 1
+    assert tc.all_diffs(d1, d2) == [(11, 0.0, -3.0)]
+    i1 = np.array([1, 2, 3], dtype=np.int8)
+    assert TensorCompare().all_diffs(i1, np.array([1, 0, 3], dtype=np.int8)) == [(1, 2, 0)]
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+
+import pytest
+
+onnx = pytest.importorskip("onnx")
+onnx_opt = pytest.importorskip("transform.OnnxOpt", exc_type=ImportError)
+from onnx import helper, TensorProto
+
+
+def test_folding_without_constants():
+    # x -> Relu -> Sigmoid, nothing to fold
+    nodes = [
+        helper.make_node("Relu", ["x"], ["r"]),
+        helper.make_node("Sigmoid", ["r"], ["y"]),
+    ]
+    graph = helper.make_graph(nodes, "g",
+                              [helper.make_tensor_value_info("x", TensorProto.FLOAT, [1, 4])],
+                              [helper.make_tensor_value_info("y", TensorProto.FLOAT, [1, 4])])
+    model = helper.make_model(graph)
+    model.opset_import[0].version = 13
+    model = onnx.shape_inference.infer_shapes(model)
+    assert [v.name for v in model.graph.value_info] == ["r"]
+    folder = onnx_opt.ConstantFolding(model, [])
+    assert not folder.model.graph.value_info
+    folded = folder.run()
+    assert len(folded.graph.node) == 2
+    # the shapes cleared by ConstantFolding are inferred again
+    assert [v.name for v in folded.graph.value_info] == ["r"]
+    dims = folded.graph.value_info[0].type.tensor_type.shape.dim
+    assert [d.dim_value for d in dims] == [1, 4]
+    assert folder.get_value_info_all("r") is not None
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import pytest
+
+snapshot = pytest.importorskip("debugger.plugins.snapshot", exc_type=ImportError)
+
+
+def test_paged_memory():
+    buffer = np.zeros(1 << 20, dtype=np.uint8)
+    memory = snapshot.PagedMemory(buffer, 1 << 12)
+    buffer[5000:6000] = 3
+    buffer[10000] = 1
+    state0 = memory.save()
+    # only the non-zero pages are kept
+    assert len(state0[0]) == 2
+    buffer[100] = 7
+    buffer[5000] = 9
+    state1 = memory.save()
+    # the unchanged page shares its data with the last snapshot
+    assert state1[1][2] is state0[1][1]
+    data1 = buffer.copy()
+    buffer[200000:300000] = 5
+    memory.restore(state0)
+    assert buffer[5000:6000].min() == 3 and buffer.sum() == 3001
+    memory.restore(state1)
+    assert (buffer == data1).all()
+
+
+def value(name, file_line, is_operand=False):
+    return SimpleNamespace(value=SimpleNamespace(name=name), file_line=file_line,
+                           is_operand=is_operand)
+
+
+def test_bisect_split_layers():
+    # layer 10 is split over 2 cores, its data is complete after executed_id 5
+    df = pd.DataFrame({
+        "executed_id": [3, 5, 7],
+        "results": [[value("a", 10)], [value("a", 10)], [value("b", 20), value("c", 20, True)]],
+    })
+    tdb = SimpleNamespace(index_df=df, global_layer_line={10: 2})
+    plugin = snapshot.SnapshotPlugin.__new__(snapshot.SnapshotPlugin)
+    plugin.tdb = tdb
+    last_points = plugin.layer_last_points()
+    assert last_points == {10: 5}
+    names = lambda point: [v.value.name for v in plugin.compared_values(last_points, point)]
+    assert (names(3), names(5), names(7)) == ([], ["a"], ["b"])
+    compared = []
+
+    def value_matches(point_index, value_view):
+        compared.append(point_index)
+        return value_view.value.name != "b"
+
+    checker = SimpleNamespace(value_matches=value_matches)
+    # the partial data of core 0 at executed_id 3 is not compared
+    assert plugin.point_matches(checker, last_points, 3)
+    assert compared == []
+    assert plugin.point_matches(checker, last_points, 5)
+    assert not plugin.point_matches(checker, last_points, 7)
+    assert plugin.failed_values(checker, last_points, 7) == ["b"]
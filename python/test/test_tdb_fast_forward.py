@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import pytest
+
+tdb_support = pytest.importorskip("debugger.tdb_support", exc_type=ImportError)
+from debugger.target_common import CMDType
+from debugger.target_common.runner import Runner
+
+
+class FakeRunner:
+    compute_cmds = Runner.compute_cmds
+
+    def __init__(self, fail_at=None):
+        self.computed = []
+        self.fail_at = fail_at
+
+    def compute(self, command):
+        if command.id == self.fail_at:
+            raise ValueError("failed")
+        self.computed.append(command.id)
+        return True
+
+
+class PointsPlugin(tdb_support.TdbPlugin):
+    name = "test-points"
+
+    def __init__(self, tdb, points):
+        super().__init__(tdb)
+        self.points = points
+
+    def step_points(self, tdb):
+        return self.points
+
+
+class NoHookPlugin(tdb_support.TdbPlugin):
+    name = "test-no-hook"
+
+
+class StepHookPlugin(tdb_support.TdbPlugin):
+    name = "test-step-hook"
+
+    def after_step(self, tdb):
+        pass
+
+
+def fake_tdb(plugins, num_cmds=10, sys_cmds=(), runner=None):
+    tdb = tdb_support.TdbCmdBackend.__new__(tdb_support.TdbCmdBackend)
+    tdb.cmditer = [SimpleNamespace(id=i, cmd_type=CMDType.tiu, sys=i in sys_cmds) for i in range(num_cmds)]
+    tdb.cmd_point = 0
+    tdb.static_mode = False
+    tdb.fast_forward = True
+    tdb.fast_forward_batch = 4
+    tdb.enable_message = False
+    tdb.context = SimpleNamespace(is_sys=lambda cmd: cmd.sys)
+    tdb.runner = runner if runner is not None else FakeRunner()
+    tdb.calls = []
+    tdb.plugins = SimpleNamespace(plugins={i: p(tdb) for i, p in enumerate(plugins)},
+                                  _call_loop=tdb.calls.append)
+    steps = []
+
+    def step():
+        # the hooks are called around it
+        steps.append(tdb.cmd_point)
+        tdb.runner.compute(tdb.cmditer[tdb.cmd_point])
+        tdb.cmd_point += 1
+
+    tdb.step = step
+    return tdb, steps
+
+
+def test_hook_points():
+    tdb, _ = fake_tdb([NoHookPlugin, lambda t: PointsPlugin(t, [6, 3]),
+                       lambda t: PointsPlugin(t, pd.Series([3, 1]))])
+    np.testing.assert_array_equal(tdb.hook_points(), [1, 3, 6])
+    tdb, _ = fake_tdb([lambda t: PointsPlugin(t, [2]), StepHookPlugin])
+    # a plugin with step hooks and no points needs every step
+    assert tdb.hook_points() is None
+    assert len(fake_tdb([NoHookPlugin])[0].hook_points()) == 0
+
+
+def test_fast_step():
+    tdb, steps = fake_tdb([lambda t: PointsPlugin(t, [3, 6])], sys_cmds=(4, ))
+    points = tdb.hook_points()
+    while tdb.cmd_point < len(tdb.cmditer):
+        tdb.fast_step(points)
+    # the hook points are stepped, the rest run in batches of at most 4
+    assert steps == [3, 6]
+    assert tdb.runner.computed == [0, 1, 2, 3, 5, 6, 7, 8, 9]
+    assert tdb.calls == ["after_fast_forward"] * 3
+    # without fast forward, or when a plugin needs all the steps
+    tdb, steps = fake_tdb([])
+    tdb.fast_forward = False
+    tdb.fast_step(np.array([5]))
+    tdb.fast_step(None)
+    assert steps == [0, 1]
+
+
+def test_fast_step_error():
+    tdb, steps = fake_tdb([], runner=FakeRunner(fail_at=2))
+    with pytest.raises(tdb_support.BreakpointStop):
+        tdb.fast_step(tdb.hook_points())
+    # stopped at the failing command
+    assert tdb.cmd_point == 2 and tdb.runner.computed == [0, 1]
+    assert steps == [] and tdb.calls == []
+
+
+def test_breakpoint_stop_points():
+    breakpoints = pytest.importorskip("debugger.plugins.breakpoints", exc_type=ImportError)
+    types = [CMDType.tiu, CMDType.dma, CMDType.tiu, CMDType.tiu, CMDType.dma]
+    cmd_ids = [1, 1, 2, 1, 2]
+    tdb = SimpleNamespace(
+        op_df=pd.DataFrame({"cmd_type": types}),
+        cmditer=[SimpleNamespace(reg=SimpleNamespace(cmd_id=i)) for i in cmd_ids])
+    assert list(breakpoints.CmdIdBreakpoint("T1").stop_points(tdb)) == [0, 3]
+    assert list(breakpoints.CmdIdBreakpoint("D2").stop_points(tdb)) == [4]
+    # checked at every step
+    assert breakpoints.AddrBreakpoint("G100").stop_points(tdb) is None
+    # never stops
+    assert tdb_support.Breakpoint("x").stop_points(tdb) == []
+
+
+def test_breakpoint_resume():
+    breakpoints = pytest.importorskip("debugger.plugins.breakpoints", exc_type=ImportError)
+    # every get_cmd decodes a new cmd, as out of the CmdGroupList cache
+    tdb = SimpleNamespace(cmd_point=0, message=lambda msg: None,
+                          get_cmd=lambda: SimpleNamespace(cmd_type=CMDType.tiu,
+                                                          reg=SimpleNamespace(cmd_id=1)))
+    plugin = breakpoints.BreakpointPlugin(tdb)
+    plugin.breakpoints.add_break("T1")
+    with pytest.raises(tdb_support.BreakpointStop):
+        plugin.before_step(tdb)
+    # continue steps over the cmd it stopped at, and stops at the next hit
+    plugin.before_step(tdb)
+    tdb.cmd_point = 1
+    with pytest.raises(tdb_support.BreakpointStop):
+        plugin.before_step(tdb)
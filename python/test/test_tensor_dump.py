@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+
+import os
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from numpy_helper.tensor_dump import TensorDump
+
+
+@pytest.mark.parametrize("codec", ["none", "zlib"])
+def test_write_read(tmp_path, codec):
+    file = str(tmp_path / "t.dump")
+    arrays = {
+        "f32": np.random.randn(3, 5).astype(np.float32),
+        "i8": np.arange(-8, 8, dtype=np.int8).reshape(4, 4),
+        "f16": np.random.randn(7).astype(np.float16),
+        "empty": np.zeros((0, 3), dtype=np.float32),
+        "scalar": np.array(1.5),
+    }
+    with TensorDump(file, "w", codec=codec) as dump:
+        for k, v in arrays.items():
+            dump[k] = v
+        # the first data written of a name is kept
+        dump["f32"] = np.zeros(1)
+    with TensorDump(file) as dump:
+        assert dump.keys() == list(arrays)
+        for k, v in arrays.items():
+            assert dump[k].dtype == v.dtype
+            np.testing.assert_array_equal(dump[k], v)
+        assert dump.get("none") is None
+
+
+def test_read_while_writing(tmp_path):
+    file = str(tmp_path / "t.dump")
+    writer = TensorDump(file, "w")
+    reader = TensorDump(file)
+    writer["a"] = np.arange(10)
+    assert "a" in reader
+    a = reader["a"]
+    # data appended after the file is mapped
+    writer["b"] = np.arange(100000, dtype=np.float32)
+    np.testing.assert_array_equal(reader["b"], np.arange(100000, dtype=np.float32))
+    np.testing.assert_array_equal(a, np.arange(10))
+    assert len(reader) == 2
+    with pytest.raises(AssertionError):
+        reader["c"] = np.zeros(1)
+    writer.close()
+    reader.close()
+
+
+def test_append_and_npz(tmp_path):
+    file = str(tmp_path / "t.dump")
+    with TensorDump(file, "w") as dump:
+        dump["a"] = np.ones(4)
+    with TensorDump(file, "a") as dump:
+        dump["b"] = np.full((2, 2), 3, dtype=np.int32)
+        dump.to_npz(str(tmp_path / "t.npz"))
+    npz = np.load(str(tmp_path / "t.npz"))
+    assert sorted(npz.files) == ["a", "b"]
+    np.testing.assert_array_equal(npz["b"], np.full((2, 2), 3, dtype=np.int32))
+
+
+def test_data_check_export(tmp_path):
+    # the dumped tensors are exported when the execution stops, at the end or at
+    # a failure with --fail_fast, and the dump is removed once closed
+    data_checker = pytest.importorskip("debugger.plugins.data_checker", exc_type=ImportError)
+    messages = []
+    tdb = SimpleNamespace(reference_data_fns=[], message=messages.append)
+    plugin = data_checker.DataCheck(tdb)
+    plugin._failed_tensor = None
+    plugin.failed_results_fn = str(tmp_path / "failed_bmodel_outputs.npz")
+    plugin.failed_tensor["a"] = np.ones(3)
+    plugin.after_stop(tdb)
+    assert np.load(plugin.failed_results_fn).files == ["a"]
+    plugin.failed_tensor["b"] = np.zeros(2)
+    plugin.after_stop(tdb)
+    assert sorted(np.load(plugin.failed_results_fn).files) == ["a", "b"]
+    dump_file = plugin.dump_file
+    plugin.close_dump()
+    assert not os.path.exists(dump_file)
+    assert not os.path.exists(dump_file + ".idx")
+    assert os.path.exists(plugin.failed_results_fn)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+
+import zipfile
+import numpy as np
+from transform.BaseConverter import BaseConverter, NpzWriter, WeightStore
+
+
+class FakeMLIR:
+
+    def create_weight_op(self, name, shape, type):
+        return (name, tuple(shape), type)
+
+
+def test_lazy_weight():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return np.arange(6, dtype=np.int8).reshape(2, 3)
+
+    store = WeightStore()
+    store.add("w", loader)
+    assert store.dtype("w") == np.float32
+    for _ in range(3):
+        w = store["w"]
+        assert w.dtype == np.float32 and w.shape == (2, 3)
+    # the loader is kept, its data is not
+    assert len(calls) == 3
+    assert callable(store.entries["w"])
+    store["w"] = np.ones(2, dtype=np.int32)
+    assert store.dtype("w") == np.int32 and "w" in store.modified
+
+
+def test_npz_writer_rewrite(tmp_path):
+    file = str(tmp_path / "w.npz")
+    writer = NpzWriter(file)
+    writer.write("a", np.zeros(3))
+    writer.write("b", np.ones(2))
+    writer.write("a", np.full(3, 2.0))
+    writer.close()
+    names = [info.filename for info in zipfile.ZipFile(file).infolist()]
+    assert sorted(names) == ["a.npy", "b.npy"]
+    npz = np.load(file)
+    np.testing.assert_array_equal(npz["a"], np.full(3, 2.0))
+    np.testing.assert_array_equal(npz["b"], np.ones(2))
+
+
+def test_weight_to_npz(tmp_path):
+    converter = BaseConverter()
+    converter.mlir = FakeMLIR()
+    converter.weight_file = str(tmp_path / "weight.npz")
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return np.array([1, 2], dtype=np.int64)
+
+    converter.addWeight("w0", np.arange(4, dtype=np.float16))
+    converter.addLazyWeight("w1", [2], loader)
+    converter.addWeight("unused", np.zeros(1, dtype=np.float32))
+    converter.addWeight("w2", np.ones((2, 3), dtype=np.float32))
+    # changed before its op is created, written once by WeightToNpz
+    converter.tensors["w2"] = converter.getWeight("w2").T * 3
+    assert converter.getWeightOp("w0") == ("w0", (4, ), "F32")
+    converter.getWeightOp("w1")
+    converter.getWeightOp("w2", [3, 2])
+    assert sorted(converter.weight_writer.names) == ["w0", "w1"]
+    # once written, the weights are mapped from the file
+    assert not callable(converter.tensors.entries["w2"])
+    w1 = converter.getWeight("w1")
+    assert isinstance(w1, np.memmap) and w1.dtype == np.float32
+    np.testing.assert_array_equal(w1, [1, 2])
+    assert len(calls) == 1 and converter.tensors.dtype("w1") == np.float32
+    w1 += 1
+    np.testing.assert_array_equal(converter.getWeight("w1"), [1, 2])
+    converter.WeightToNpz(converter.weight_file)
+    npz = np.load(converter.weight_file)
+    assert sorted(npz.files) == ["w0", "w1", "w2"]
+    assert npz["w1"].dtype == np.float32
+    np.testing.assert_array_equal(npz["w0"], np.arange(4, dtype=np.float32))
+    np.testing.assert_array_equal(npz["w2"], np.full((3, 2), 3.0))
+    # no duplicate member
+    assert len(zipfile.ZipFile(converter.weight_file).infolist()) == 3
@@ -42,6 +42,13 @@ def main():
         default="failed_bmodel_outputs.npz",
         help="bmodel inference result",
     )
+    parser.add_argument(
+        "--dump_codec",
+        type=str,
+        choices=["none", "zlib"],
+        default="none",
+        help="compression of the dumped tensors",
+    )
     parser.add_argument(
         "--fail_fast", action="store_true", help="Stop if there is a check failure."
     )
@@ -110,6 +117,9 @@ if __name__ == "__main__":
     plugin.dump_mode = getattr(DumpMode, args.dump_mode.upper(), DumpMode.FAILED)
     plugin.excepts.update(excepts)
 
+    plugin.dump_codec = args.dump_codec
+    plugin.failed_results_fn = args.report
+
     tdb.message(f"dump mode = {plugin.dump_mode}")
 
     tdb.do_run("")
@@ -117,17 +127,20 @@ if __name__ == "__main__":
     plugin.do_summary("table")
     if args.dump_dataframe:
         plugin.dump_dataframe()
-    plugin.failed_results_fn = args.report
     plugin.do_dump_names(args.report)
     msg = """
     type `check` to start analysis and dump data.
     - `check summary table|reduce` to view report of check results.
     - `check data <file-line> <index>` to review value details
-    - `check dump` or `check dump <file-name>` to dump tensor that failed in comparison into npz files
+    - `check export` or `check export <file-name>` to export the dumped tensors into npz files
     """
     tdb.message(msg)
-    if args.no_interactive:
-        if args.report is None:
-            args.report = os.path.join(context_dir, "failed_bmodel_outputs.npz")
-    else:
-        tdb.cmdloop()
+    try:
+        if args.no_interactive:
+            if args.report is None:
+                args.report = os.path.join(context_dir, "failed_bmodel_outputs.npz")
+        else:
+            tdb.cmdloop()
+    finally:
+        # the tensors are exported, quit exits from the loop
+        plugin.close_dump()
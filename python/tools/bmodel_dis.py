@@ -31,7 +31,7 @@ def decode_dma_file(dma_file, device):
 def BModel2MLIR(bmodel_file):
     from debugger.atomic_dialect import BModel2MLIR
 
-    bmodel = dis.BModel(bmodel_file)
+    bmodel = dis.BModel(bmodel_file, read_only=True)
     return BModel2MLIR(bmodel)
 
 
@@ -43,7 +43,7 @@ def BModelCMDIter(bmodel: dis.BModel) -> Iterator[Tuple[Tuple, dis.CmdGroup]]:
 
 
 def BModel2Reg(bmodel_file):
-    bmodel = dis.BModel(bmodel_file)
+    bmodel = dis.BModel(bmodel_file, read_only=True)
     for subnet in BModelCMDIter(bmodel):
         subnet_id = subnet.id
         for gid, cmds in enumerate(subnet.cmd_group):
@@ -57,6 +57,27 @@ def BModel2Reg(bmodel_file):
                 )
 
 
+def BModel2RegTable(bmodel_file):
+    # same as BModel2Reg, each command group decoded as numpy columns
+    bmodel = dis.BModel(bmodel_file, read_only=True)
+    decoder = bmodel.context.decoder
+    for subnet in BModelCMDIter(bmodel):
+        subnet_id = subnet.id
+        groups = [(0, gid, cmds) for gid, cmds in enumerate(subnet.cmd_group)]
+        groups += [
+            (core_id, gid, cmds)
+            for core_id, _cmds in enumerate(subnet.core_commands)
+            for gid, cmds in enumerate(_cmds.gdma_tiu_commands)
+        ]
+        for core_id, gid, cmds in groups:
+            formated_id = f"core({core_id}).subnet({subnet_id}).group({gid})"
+            yield (
+                formated_id,
+                decoder.decode_tiu_table(cmds.tiu_cmd.bytes),
+                decoder.decode_dma_table(cmds.dma_cmd.bytes),
+            )
+
+
 def BModel2Bin(bmodel_file):
     import math
 
@@ -74,7 +95,7 @@ def BModel2Bin(bmodel_file):
             )
 
     fname = FName()
-    bmodel = dis.BModel(bmodel_file)
+    bmodel = dis.BModel(bmodel_file, read_only=True)
     for subnet in BModelCMDIter(bmodel):
         fname.core_id = 0
         fname.subnet_id = subnet.id
@@ -165,7 +186,7 @@ def __main():
     parser.add_argument(
         "--format",
         dest="format",
-        choices=["mlir", "reg", "bits", "bin", "reg-set", "version"],
+        choices=["mlir", "reg", "bits", "bin", "reg-set", "reg-npz", "version"],
         default="mlir",
         help="The format of format operations.",
     )
@@ -182,7 +203,7 @@ def __main():
             module = BModel2MLIR(args.bmodels[0])
             print(module, flush=True)
         elif args.format == "version":
-            bmodel = dis.BModel(args.bmodels[0])
+            bmodel = dis.BModel(args.bmodels[0], read_only=True)
             print(bmodel.version)
         elif args.format == "reg" or args.format == "reg-set":
             import json
@@ -214,6 +235,18 @@ def __main():
             }
             print(json.dumps(outs, indent=2, ensure_ascii=False), flush=True)
 
+        elif args.format == "reg-npz":
+            import numpy as np
+
+            # one structured array per op of each command group
+            tables = {}
+            for _id, tiu, dma in BModel2RegTable(args.bmodels[0]):
+                for engine, table in (("tiu", tiu), ("dma", dma)):
+                    for op_name, regs in table.items():
+                        tables[f"{_id}.{engine}.{op_name}"] = regs
+            out_file = args.bmodels[0] + ".regs.npz"
+            np.savez(out_file, **tables)
+            print(f"saved to {out_file}", flush=True)
         elif args.format == "bin":
             BModel2Bin(args.bmodels[0])
         else:
@@ -9,6 +9,7 @@
 # ==============================================================================
 
 import os
+import shutil
 import numpy as np
 import argparse
 from utils.mlir_shell import *
@@ -18,7 +19,7 @@ from utils.auto_remove import file_mark, file_clean
 from tools.model_runner import mlir_inference, model_inference, show_fake_cmd
 import pymlir
 from utils.misc import str2bool
-from utils.cache_tool import CacheTool
+from utils.build_cache import mlir_files, create_build_cache
 from utils.log_setting import setup_logger
 
 logger = setup_logger("deploy")
@@ -104,13 +105,19 @@ class DeployTool:
                 self.prefix += "_asym"
             else:
                 self.prefix += "_sym"
-        self.cache_tool = CacheTool(args.cache_skip)
-        self.cache_skip = args.cache_skip
+        self.build_cache = create_build_cache(args)
         self._prepare_input_npz()
 
     def cleanup(self):
         file_clean()
 
+    def cached_stage(self, stage, inputs, params, outputs, run, extras=None):
+        # run the stage unless the build cache has its outputs, True on a hit
+        if self.build_cache is None:
+            run()
+            return False
+        return self.build_cache.run_stage(stage, inputs, params, outputs, run, extras)
+
     def lowering(self):
         if self.chip == 'cpu':
             top_to_tosa(self.mlir_file, "tmp_tosa.mlir", self.includeWeight)
@@ -126,13 +133,25 @@ class DeployTool:
             self.tpu_mlir = "{}_tpu.mlir".format(self.prefix)
             file_mark(self.tpu_mlir)
             self.final_mlir = "{}_final.mlir".format(self.prefix)
-            mlir_lowering(self.mlir_file, self.tpu_mlir, self.quantize, self.chip, self.num_device,
-                          self.num_core, self.cali_table, self.asymmetric, self.quantize_table,
-                          self.customization_format, self.fuse_preprocess, self.aligned_input,
-                          self.ignore_f16_overflow, self.do_winograd, self.q_group_size)
-            if self.do_validate and self.cache_tool.do_tpu_validate(
-                    self.tpu_mlir, self.tpu_npz, self.tolerance, self.embed_debug_info):
-                tool.validate_tpu_mlir()
+            params = [
+                self.tpu_mlir, self.quantize, self.chip, self.num_device, self.num_core,
+                self.asymmetric, self.customization_format, self.fuse_preprocess,
+                self.aligned_input, self.ignore_f16_overflow, self.do_winograd, self.q_group_size
+            ]
+
+            def run():
+                mlir_lowering(self.mlir_file, self.tpu_mlir, self.quantize, self.chip,
+                              self.num_device, self.num_core, self.cali_table, self.asymmetric,
+                              self.quantize_table, self.customization_format,
+                              self.fuse_preprocess, self.aligned_input, self.ignore_f16_overflow,
+                              self.do_winograd, self.q_group_size)
+
+            self.cached_stage("lowering",
+                              mlir_files(self.mlir_file) + [self.cali_table, self.quantize_table],
+                              {"lowering": params}, [self.tpu_mlir], run,
+                              lambda: mlir_files(self.tpu_mlir)[1:])
+            if self.do_validate:
+                self.validate_tpu_mlir()
 
     def _prepare_input_npz(self):
         num_inputs = len(self.test_input)
@@ -214,44 +233,77 @@ class DeployTool:
             top_outputs = mlir_inference(gen_input_f32, self.mlir_file)
             np.savez(self.ref_npz, **top_outputs)
         self.tpu_npz = "{}_tpu_outputs.npz".format(self.prefix)
-        if not self.cache_skip:
-            file_mark(self.tpu_npz)
+        file_mark(self.tpu_npz)
         self.model_npz = "{}_model_outputs.npz".format(self.prefix)
-        if not self.cache_skip:
-            file_mark(self.model_npz)
+        file_mark(self.model_npz)
 
     def validate_tpu_mlir(self):
-        show_fake_cmd(self.in_f32_npz, self.tpu_mlir, self.tpu_npz)
-        tpu_outputs = mlir_inference(self.inputs, self.tpu_mlir, self.compare_all)
-        np.savez(self.tpu_npz, **tpu_outputs)
-        # compare fp32 blobs and quantized tensors with tolerance similarity
-        f32_blobs_compare(self.tpu_npz, self.ref_npz, self.tolerance, self.excepts)
-        self.cache_tool.mark_tpu_success()
+
+        def run():
+            show_fake_cmd(self.in_f32_npz, self.tpu_mlir, self.tpu_npz)
+            tpu_outputs = mlir_inference(self.inputs, self.tpu_mlir, self.compare_all)
+            np.savez(self.tpu_npz, **tpu_outputs)
+            # compare fp32 blobs and quantized tensors with tolerance similarity
+            f32_blobs_compare(self.tpu_npz, self.ref_npz, self.tolerance, self.excepts)
+
+        self.cached_stage("tpu_validate",
+                          mlir_files(self.tpu_mlir) + [self.in_f32_npz, self.ref_npz],
+                          {"validate": [self.tolerance, self.excepts, self.compare_all]},
+                          [self.tpu_npz], run)
 
     def build_model(self):
         if self.chip == 'cpu':
             tosa_to_llvm(self.tosa_mlir, self.model)
         else:
-            mlir_to_model(self.tpu_mlir, self.model, self.final_mlir, self.dynamic,
-                          self.quant_input, self.quant_output, self.quant_input_list,
-                          self.quant_output_list, self.disable_layer_group, self.opt,
-                          self.merge_weight, self.op_divide, self.embed_debug_info, self.addr_mode,
-                          self.model_version)
-            if not self.skip_validation and self.do_validate and self.cache_tool.do_model_validate(
-                    self.model, self.model_npz):
-                tool.validate_model()
+            params = [
+                self.final_mlir, self.dynamic, self.quant_input, self.quant_output,
+                self.quant_input_list, self.quant_output_list, self.disable_layer_group, self.opt,
+                self.op_divide, self.embed_debug_info, self.addr_mode, self.model_version
+            ]
+
+            def run():
+                mlir_to_model(self.tpu_mlir, self.model, self.final_mlir, self.dynamic,
+                              self.quant_input, self.quant_output, self.quant_input_list,
+                              self.quant_output_list, self.disable_layer_group, self.opt,
+                              self.merge_weight, self.op_divide, self.embed_debug_info,
+                              self.addr_mode, self.model_version)
+
+            if self.merge_weight:
+                # depends on the weight map left by the previous build
+                run()
+            elif self.cached_stage("codegen", mlir_files(self.tpu_mlir), {"codegen": params},
+                                   [self.model, self.final_mlir], run, self.codegen_extras):
+                out_dir = self.model.rsplit(".", maxsplit=1)[0]
+                os.makedirs(out_dir, exist_ok=True)
+                shutil.copy(self.final_mlir, os.path.join(out_dir, 'final.mlir'))
+            if not self.skip_validation and self.do_validate:
+                self.validate_model()
+
+    def codegen_extras(self):
+        # the weights of the final mlir, and the files written next to the model:
+        # the profiles and the tensor location read by tdb and bmodel_checker.py
+        files = [
+            self.model + ".json", self.model + ".compiler_profile_0.txt",
+            self.model + ".net_0.profile"
+        ]
+        return mlir_files(self.final_mlir)[1:] + [f for f in files if os.path.exists(f)]
 
     def validate_model(self):
 
-        show_fake_cmd(self.in_f32_npz, self.model, self.model_npz)
-        model_outputs = model_inference(self.inputs, self.model)
-        np.savez(self.model_npz, **model_outputs)
-        if self.state == "TOP_QUANTIZED":
-            f32_blobs_compare(self.model_npz, self.ref_npz, self.correctness, self.excepts, True)
-        else:
-            f32_blobs_compare(self.model_npz, self.tpu_npz, self.correctness, self.excepts, True)
+        def run():
+            show_fake_cmd(self.in_f32_npz, self.model, self.model_npz)
+            model_outputs = model_inference(self.inputs, self.model)
+            np.savez(self.model_npz, **model_outputs)
+            if self.state == "TOP_QUANTIZED":
+                f32_blobs_compare(self.model_npz, self.ref_npz, self.correctness, self.excepts,
+                                  True)
+            else:
+                f32_blobs_compare(self.model_npz, self.tpu_npz, self.correctness, self.excepts,
+                                  True)
 
-        self.cache_tool.mark_model_success()
+        ref_npz = self.ref_npz if self.state == "TOP_QUANTIZED" else self.tpu_npz
+        self.cached_stage("model_validate", [self.model, self.in_f32_npz, ref_npz],
+                          {"validate": [self.correctness, self.excepts]}, [self.model_npz], run)
 
 
 def deprecated_option(cond, msg):
@@ -259,8 +311,7 @@ def deprecated_option(cond, msg):
         raise RuntimeError(msg)
 
 
-if __name__ == '__main__':
-    logger.info("SOPHGO Toolchain {}".format(pymlir.module().version))
+def deploy_parser():
     parser = argparse.ArgumentParser()
     # yapf: disable
     # ========== Basic Options ===========
@@ -304,7 +355,14 @@ if __name__ == '__main__':
     parser.add_argument("--tolerance", default='0.8,0.5', help="tolerance for compare")
     parser.add_argument("--excepts", default='-', help="excepts tensors no compare")
     parser.add_argument("--skip_validation", action='store_true', help='skip checking the correctness of bmodel.')
-    parser.add_argument("--cache_skip", action='store_true', help='skip checking the correctness when generate same mlir and bmodel.')
+    parser.add_argument("--cache_skip", action='store_true',
+                        help='skip the stages and validations whose inputs did not change, '
+                        'cached in --build_cache or ~/.cache/tpu_mlir/build, '
+                        'same as CACHE_SKIP=True in the environment')
+    parser.add_argument("--build_cache", default=None,
+                        help="directory caching the outputs of each stage, shared by the builds")
+    parser.add_argument("--build_cache_size", default=50, type=float,
+                        help="max size of the build cache in GB, least recently used outputs are evicted")
     # ========== Fuse Preprocess Options ==============
     parser.add_argument("--fuse_preprocess", action='store_true',
                         help="add tpu preprocesses (mean/scale/channel_swap) in the front of model")
@@ -344,13 +402,23 @@ if __name__ == '__main__':
                         help="DEPRECATED, please use --addr_mode io_alone")
 
     # yapf: enable
-    args = parser.parse_args()
+    return parser
+
+
+def parse_deploy_args(argv=None):
+    args = deploy_parser().parse_args(argv)
     deprecated_option(args.io_alone, "DEPRECATED, please use --addr_mode io_alone")
 
     if args.customization_format.startswith("YUV"):
         args.aligned_input = True
     if not args.fuse_preprocess and args.customization_format:
         assert (0 and "Error! If not fuse_preprocess, customization_format shouldn't be set.")
+    return args
+
+
+if __name__ == '__main__':
+    logger.info("SOPHGO Toolchain {}".format(pymlir.module().version))
+    args = parse_deploy_args()
     tool = DeployTool(args)
     # lowering to tpu/tosa
     tool.lowering()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# ==============================================================================
+#
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+
+import os
+import sys
+import json
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from utils.mlir_shell import _os_system
+from utils.mlir_parser import MlirParser
+from utils.build_cache import create_build_cache, mlir_files, mlir_weight_attr, mlir_weight_file
+from utils.auto_remove import g_auto_remove_files
+from utils.log_setting import setup_logger
+
+logger = setup_logger("deploy")
+
+CVI_CHIPS = ['cv183x', 'cv182x', 'cv181x', 'cv180x']
+
+
+def parse_targets(spec: str):
+    """targets from a json file, or from "chip:quantize,..."
+
+    The json file is a list of {"chip": .., "quantize": .., "options": [..]},
+    options being more model_deploy.py arguments of the target. INT8_SYM,
+    INT8_ASYM, INT4_SYM and INT4_ASYM are accepted as quantize.
+    """
+    if os.path.isfile(spec):
+        with open(spec, "r") as f:
+            targets = json.load(f)
+    else:
+        targets = []
+        for t in spec.split(','):
+            if not t.strip():
+                continue
+            chip, quantize = t.strip().split(':')
+            targets.append({"chip": chip, "quantize": quantize})
+    for t in targets:
+        t["chip"] = t["chip"].lower()
+        t["quantize"] = t["quantize"].upper()
+        t["options"] = list(t.get("options", []))
+        if t["quantize"].endswith(("_SYM", "_ASYM")):
+            t["quantize"], mode = t["quantize"].rsplit('_', 1)
+            if mode == "ASYM":
+                t["options"].append("--asymmetric")
+    return targets
+
+
+def target_name(module_name: str, target: dict):
+    # same as the prefix of model_deploy.py
+    name = "{}_{}_{}".format(module_name, target["chip"], target["quantize"].lower())
+    if target["quantize"] in ["INT8", "INT4"]:
+        name += "_asym" if "--asymmetric" in target["options"] else "_sym"
+    return name
+
+
+class StageGraph:
+    """Stages with dependencies, each one is run in a process pool as soon as
+    the stages it depends on are done. The stages depending on a failed one
+    are not run."""
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name: str, fn, args: tuple = (), deps: list = []):
+        for d in deps:
+            assert d in self.stages, "unknown stage {}".format(d)
+        self.stages[name] = (fn, args, list(deps))
+
+    def run(self, workers: int):
+        done, failed = set(), {}
+        pending = dict(self.stages)
+        running = {}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while pending or running:
+                changed = True
+                while changed:
+                    changed = False
+                    for name in list(pending):
+                        fn, args, deps = pending[name]
+                        bad = [d for d in deps if d in failed]
+                        if bad:
+                            failed[name] = "{} failed".format(bad[0])
+                            del pending[name]
+                            changed = True
+                        elif all(d in done for d in deps):
+                            running[pool.submit(fn, *args)] = name
+                            del pending[name]
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for f in finished:
+                    name = running.pop(f)
+                    try:
+                        f.result()
+                        done.add(name)
+                        logger.info("[Done] {}".format(name))
+                    except Exception as e:
+                        failed[name] = str(e)
+                        logger.error("[Failed] {}: {}".format(name, e))
+        return failed
+
+
+def prepare_workdir(workdir: str, mlir: str):
+    # stages run in their own directory, where the weight file of the top mlir
+    # must be found by the name it has in the mlir
+    os.makedirs(workdir, exist_ok=True)
+    weight = mlir_weight_attr(mlir)
+    if weight is None or os.path.isabs(weight):
+        return
+    link = os.path.join(workdir, weight)
+    if os.path.lexists(link):
+        return
+    os.makedirs(os.path.dirname(link), exist_ok=True)
+    os.symlink(os.path.abspath(mlir_weight_file(mlir)), link)
+
+
+class StageContext:
+    # chdir to the stage directory and log the stage output to a file
+
+    def __init__(self, workdir: str, log_file: str):
+        self.workdir = workdir
+        self.log_file = log_file
+
+    def __enter__(self):
+        self.cwd = os.getcwd()
+        os.chdir(self.workdir)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.saved = [os.dup(1), os.dup(2)]
+        self.log = open(self.log_file, "w")
+        os.dup2(self.log.fileno(), 1)
+        os.dup2(self.log.fileno(), 2)
+        # files marked by the stages that ran before in this process
+        del g_auto_remove_files[:]
+        return self
+
+    def __exit__(self, *args):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(self.saved[0], 1)
+        os.dup2(self.saved[1], 2)
+        for fd in self.saved:
+            os.close(fd)
+        self.log.close()
+        os.chdir(self.cwd)
+
+
+def run_reference(workdir: str, argv: list, ref_npz: str):
+    # top mlir outputs of the test input, for all the targets
+    from tools.model_deploy import DeployTool, parse_deploy_args
+    with StageContext(workdir, os.path.join(workdir, "reference.log")):
+        args = parse_deploy_args(argv)
+        cache = create_build_cache(args)
+        if cache:
+            key = cache.key("reference", mlir_files(args.mlir) + args.test_input, {"argv": argv})
+            if cache.restore(key, [ref_npz]):
+                return
+        tool = DeployTool(args)
+        shutil.copyfile(tool.ref_npz, ref_npz)
+        if cache:
+            cache.store(key, "reference", [ref_npz])
+
+
+def run_calibration(workdir: str, mlir: str, dataset: str, input_num: int, table: str,
+                    cache_args: argparse.Namespace):
+    with StageContext(workdir, os.path.join(workdir, "calibration.log")):
+        cache = create_build_cache(cache_args)
+        if cache:
+            key = cache.key("calibration", mlir_files(mlir) + [dataset], {"input_num": input_num})
+            if cache.restore(key, [table]):
+                return
+        _os_system([
+            "run_calibration.py", mlir, "--dataset", dataset, "--input_num", input_num, "-o",
+            table
+        ])
+        if cache:
+            cache.store(key, "calibration", [table])
+
+
+def deploy_target(workdir: str, argv: list):
+    from tools.model_deploy import DeployTool, parse_deploy_args
+    with StageContext(workdir, os.path.join(workdir, "deploy.log")):
+        args = parse_deploy_args(argv)
+        tool = DeployTool(args)
+        tool.lowering()
+        tool.build_model()
+        if not args.debug:
+            tool.cleanup()
+
+
+def abspath(path):
+    return os.path.abspath(path) if path else path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="deploy a top mlir to several chips and quantize modes in parallel, "
+        "the other arguments are passed to model_deploy.py of each target")
+    # yapf: disable
+    parser.add_argument("--mlir", required=True, help="top mlir from model_transform.py")
+    parser.add_argument("--targets", required=True,
+                        help="json file of targets, or chip:quantize separated by comma, "
+                        "such as bm1684x:F16,bm1688:INT8_ASYM")
+    parser.add_argument("--output_dir", default="deploy_batch",
+                        help="models are saved here, each target runs in a subdirectory")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="number of stages running in parallel, 0 for the cpu count")
+    parser.add_argument("--build_cache", default=None,
+                        help="directory caching the outputs of the stages, shared by the builds")
+    parser.add_argument("--build_cache_size", default=50, type=float,
+                        help="max size of the build cache in GB")
+    parser.add_argument("--test_input", default="",
+                        help="input npy/npz/image file for validation, as model_deploy.py")
+    parser.add_argument("--test_reference", default="",
+                        help="reference npz file; if none, run once for all the targets")
+    parser.add_argument("--calibration_table",
+                        help="calibration table for int8 quantization")
+    parser.add_argument("--calibration_dataset",
+                        help="dataset to generate the calibration table if not given")
+    parser.add_argument("--input_num", type=int, default=0,
+                        help="num of inputs for calibration")
+    parser.add_argument("--quantize_table",
+                        help="table of OPs that quantized to specific mode")
+    # yapf: enable
+    args, deploy_argv = parser.parse_known_args()
+
+    mlir = os.path.abspath(args.mlir)
+    output_dir = os.path.abspath(args.output_dir)
+    cache_dir = abspath(args.build_cache)
+    cache_args = argparse.Namespace(build_cache=cache_dir,
+                                    build_cache_size=args.build_cache_size)
+    module_name = MlirParser(mlir).module_name
+    targets = parse_targets(args.targets)
+    test_input = ",".join(abspath(s.strip()) for s in args.test_input.split(',') if s.strip())
+    ref_npz = abspath(args.test_reference)
+    cali_table = abspath(args.calibration_table)
+    qtable = abspath(args.quantize_table)
+
+    common = list(deploy_argv)
+    if cache_dir:
+        common += ["--build_cache", cache_dir, "--build_cache_size", str(args.build_cache_size)]
+    if qtable:
+        common += ["--quantize_table", qtable]
+    graph = StageGraph()
+    shared_dir = os.path.join(output_dir, "shared")
+    prepare_workdir(shared_dir, mlir)
+    # shared stages
+    ref_deps = []
+    if test_input and not ref_npz:
+        ref_npz = os.path.join(shared_dir, module_name + "_ref_outputs.npz")
+        argv = ["--mlir", mlir, "--chip", targets[0]["chip"], "--model", "none"]
+        argv += common + ["--test_input", test_input]
+        graph.add("reference", run_reference, (shared_dir, argv, ref_npz))
+        ref_deps = ["reference"]
+    cali_deps = []
+    need_cali = any(t["quantize"] in ["INT8", "INT4"] for t in targets)
+    if need_cali and not cali_table and args.calibration_dataset:
+        cali_table = os.path.join(shared_dir, module_name + "_cali_table")
+        graph.add("calibration", run_calibration,
+                  (shared_dir, mlir, os.path.abspath(args.calibration_dataset), args.input_num,
+                   cali_table, cache_args))
+        cali_deps = ["calibration"]
+    # targets
+    models = []
+    for t in targets:
+        name = target_name(module_name, t)
+        ext = "cvimodel" if t["chip"] in CVI_CHIPS else "bmodel"
+        model = os.path.join(output_dir, "{}.{}".format(name, ext))
+        workdir = os.path.join(output_dir, name)
+        prepare_workdir(workdir, mlir)
+        argv = ["--mlir", mlir, "--chip", t["chip"], "--quantize", t["quantize"], "--model", model]
+        argv += common + t["options"]
+        deps = []
+        if test_input:
+            argv += ["--test_input", test_input, "--test_reference", ref_npz]
+            deps += ref_deps
+        if t["quantize"] in ["INT8", "INT4"] and cali_table:
+            argv += ["--calibration_table", cali_table]
+            deps += cali_deps
+        graph.add(name, deploy_target, (workdir, argv), deps)
+        models.append((name, model, workdir))
+
+    workers = args.workers if args.workers > 0 else os.cpu_count() or 1
+    failed = graph.run(min(workers, len(graph.stages)))
+    for name, model, workdir in models:
+        if name in failed:
+            logger.error("{}: failed, {}, see {}".format(name, failed[name],
+                                                         os.path.join(workdir, "deploy.log")))
+        else:
+            logger.info("{}: {}".format(name, model))
+    if failed:
+        sys.exit(1)
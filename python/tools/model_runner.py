@@ -15,7 +15,8 @@ import os
 import struct
 import shutil
 from utils.misc import str2bool
-from utils.lowering import lowering, round_away_from_zero, bf16_to_fp32
+from utils.lowering import lowering, round_away_from_zero
+from utils.numeric import bf16_to_fp32
 
 
 def show_fake_cmd(in_npz: str, model: str, out_npz: str):
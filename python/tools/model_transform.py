@@ -18,7 +18,7 @@ from utils.mlir_parser import *
 from utils.misc import *
 from utils.auto_remove import file_mark, file_clean
 from utils.preprocess import get_preprocess_parser, preprocess
-from utils.cache_tool import CacheTool
+from utils.build_cache import mlir_files, create_build_cache
 from utils.log_setting import setup_logger
 import pymlir
 
@@ -55,7 +55,11 @@ class ModelTransformer(object):
         self.converter.generate_mlir(mlir_origin)
         mlir_opt_for_top(mlir_origin, self.mlir_file, add_postprocess)
         logger.info("Mlir file generated:{}".format(mlir_file))
+        self.load_mlir(mlir_file)
 
+    def load_mlir(self, mlir_file: str):
+        # the mlir to validate, generated by model_transform or from the cache
+        self.mlir_file = mlir_file
         self.module_parsered = MlirParser(self.mlir_file)
         self.input_num = self.module_parsered.get_input_num()
 
@@ -114,7 +118,6 @@ class ModelTransformer(object):
         # compare all blobs layer by layers
         f32_blobs_compare(test_result, self.ref_npz, tolerance, excepts=excepts)
         file_mark(self.ref_npz)
-        cache_tool.mark_top_success()
 
     @abc.abstractmethod
     def origin_inference(self, inputs: dict) -> dict:
@@ -244,6 +247,68 @@ def get_model_transform(args):
     return tool
 
 
+def onnx_external_data(model_def: str):
+    """files holding the external data of an onnx model"""
+    import onnx
+    from onnx.external_data_helper import uses_external_data
+    model = onnx.load(model_def, load_external_data=False)
+    base_dir = os.path.dirname(os.path.abspath(model_def))
+    files = set()
+    for tensor in model.graph.initializer:
+        if uses_external_data(tensor):
+            for entry in tensor.external_data:
+                if entry.key == "location":
+                    files.add(os.path.join(base_dir, entry.value))
+    return sorted(files)
+
+
+def transform_and_validate(args):
+    """Generate the mlir and validate it, skipping what the build cache has.
+    Returns the ModelTransformer, None if nothing had to be run."""
+    cache = create_build_cache(args)
+    tools = []
+
+    def get_tool():
+        if not tools:
+            tools.append(get_model_transform(args))
+        return tools[0]
+
+    def transform():
+        get_tool().model_transform(args.mlir, args.add_postprocess)
+
+    def validate():
+        tool = get_tool()
+        if not hasattr(tool, "mlir_file"):
+            tool.load_mlir(args.mlir)
+        tool.model_validate(args.test_input, args.tolerance, args.excepts, args.test_result)
+
+    model_files = [args.model_def, args.model_data]
+    if args.model_def.endswith('.onnx'):
+        model_files += onnx_external_data(args.model_def)
+    model_files += [os.path.expanduser(f) for f in args.test_input]
+    if args.test_input:
+        assert (args.test_result)
+    if cache is None:
+        transform()
+        if args.test_input:
+            validate()
+        return get_tool()
+    ignored = ["test_input", "test_result", "tolerance", "excepts", "debug", "cache_skip",
+               "build_cache", "build_cache_size"]
+    params = {k: v for k, v in vars(args).items() if k not in ignored}
+    cache.run_stage("transform", model_files, params, [args.mlir], transform,
+                    lambda: mlir_files(args.mlir)[1:])
+    if args.test_input:
+        # the inputs are also given to model_deploy.py --test_input
+        in_f32_npz = args.model_name + '_in_f32.npz'
+        ref_npz = args.model_name + '_ref_outputs.npz'
+        cache.run_stage("top_validate",
+                        mlir_files(args.mlir) + model_files,
+                        {"validate": [args.tolerance, args.excepts]}, [in_f32_npz, args.test_result],
+                        validate, lambda: [ref_npz] if os.path.exists(ref_npz) else [])
+    return tools[0] if tools else None
+
+
 if __name__ == '__main__':
     logger.info("SOPHGO Toolchain {}".format(pymlir.module().version))
     parser = argparse.ArgumentParser()
@@ -262,7 +327,14 @@ if __name__ == '__main__':
                         "if has more than one input, join jpg or npy with semicolon")
     parser.add_argument("--test_result", default="", type=str,
                         help="if input is set, result is mlir inference result")
-    parser.add_argument("--cache_skip", action='store_true', help='skip checking the correctness when generate same mlir and bmodel.')
+    parser.add_argument("--cache_skip", action='store_true',
+                        help='skip the transform and validation whose inputs did not change, '
+                        'cached in --build_cache or ~/.cache/tpu_mlir/build, '
+                        'same as CACHE_SKIP=True in the environment')
+    parser.add_argument("--build_cache", default=None,
+                        help="directory caching the outputs of each stage, shared by the builds")
+    parser.add_argument("--build_cache_size", default=50, type=float,
+                        help="max size of the build cache in GB, least recently used outputs are evicted")
     parser.add_argument("--tolerance", default='0.99,0.99',
                         help="minimum similarity tolerance to model transform")
     parser.add_argument("--excepts", default='-', help="excepts")
@@ -278,11 +350,6 @@ if __name__ == '__main__':
     if unknown_args:
         args.unknown_params += unknown_args
 
-    cache_tool = CacheTool(args.cache_skip)
-    tool = get_model_transform(args)
-    tool.model_transform(args.mlir, args.add_postprocess)
-    if args.test_input and cache_tool.do_top_validate(tool.mlir_file, tool.in_f32_npz, args.tolerance, args.debug):
-        assert (args.test_result)
-        tool.model_validate(args.test_input, args.tolerance, args.excepts, args.test_result)
-    if not args.debug:
+    tool = transform_and_validate(args)
+    if tool and not args.debug:
         tool.cleanup()
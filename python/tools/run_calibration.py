@@ -28,7 +28,13 @@ if __name__ == '__main__':
     parser.add_argument('--tune_num', type=int, default=5, help='num of images for tune')
     parser.add_argument('--histogram_bin_num', type=int, default=2048,
                         help='Specify histogram bin numer for kld calculate')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes to shard the calibration samples and the tune thresholds over')
     parser.add_argument('-o', '--calibration_table', type=str, help='output threshold table')
+    parser.add_argument('--activation_cache', type=str, default=None,
+                        help='directory to cache fp32 activations across runs')
+    parser.add_argument('--activation_cache_size', type=float, default=20,
+                        help='max size in GB of the activation cache directory')
     parser.add_argument('--debug_cmd', type=str, default='', help='debug cmd')
     # yapf: enable
     args = parser.parse_args()
@@ -43,6 +43,16 @@ if __name__ == '__main__':
                         help=argparse.SUPPRESS)
     parser.add_argument('-o', '--quantize_table', required=True,
                         help='output searched bf16 layer table')
+    parser.add_argument('--activation_cache', type=str, default=None,
+                        help='directory to cache fp32 activations across runs')
+    parser.add_argument('--activation_cache_size', type=float, default=20,
+                        help='max size in GB of the activation cache directory')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes running the samples of a candidate mix model')
+    parser.add_argument('--build_cache', default=None,
+                        help='directory caching the lowered models, shared with model_deploy.py')
+    parser.add_argument('--build_cache_size', default=50, type=float,
+                        help='max size of the build cache in GB')
     parser.add_argument('--debug_cmd', type=str, default='', help='debug cmd')
 
     # yapf: enable
@@ -48,6 +48,16 @@ if __name__ == '__main__':
                         help='post_process program path')
     parser.add_argument('-o', '--quantize_table', required=True,
                         help='output searched sensitive layers table')
+    parser.add_argument('--activation_cache', type=str, default=None,
+                        help='directory to cache fp32 activations across runs')
+    parser.add_argument('--activation_cache_size', type=float, default=20,
+                        help='max size in GB of the activation cache directory')
+    parser.add_argument('--partial_infer', action='store_true',
+                        help='try the layers and thresholds in the int8 and float models loaded once, '
+                        'running again only the changed layers and the layers after them, '
+                        'instead of lowering a mix model for each try')
+    parser.add_argument('--partial_infer_cache_size', type=float, default=20,
+                        help='max size in GB of the activations of the samples kept by --partial_infer')
     parser.add_argument('--debug_cmd', type=str, default='', help='debug cmd')
 
     # yapf: enable
@@ -83,9 +83,10 @@ class TdbInterface(TdbCmdBackend):
         self._reset()
 
         self.status = TdbStatus.RUNNING
+        points = self.hook_points()
         while True:
             try:
-                self.step()
+                self.fast_step(points)
             except (KeyboardInterrupt, BreakpointStop):
                 self.status = TdbStatus.IDLE
                 break
@@ -123,10 +124,11 @@ class TdbInterface(TdbCmdBackend):
             return
 
         self.status = TdbStatus.RUNNING
+        points = self.hook_points()
 
         while True:
             try:
-                _ = self.step()
+                _ = self.fast_step(points)
             except (BreakpointStop, KeyboardInterrupt):
                 self.status = TdbStatus.IDLE
                 break
@@ -239,6 +241,11 @@ def parse_args(args=None):
     parser.add_argument(
         "--quiet", action="store_true", default=False, help="disable progress bar"
     )
+    parser.add_argument(
+        "--no_fast_forward",
+        action="store_true",
+        help="call the plugin hooks at every command in continue/run",
+    )
 
     return parser.parse_args(args)
 
@@ -287,6 +294,7 @@ def get_tdb(args=None):
         extra_plugins=extra_plugins,
         ddr_size=args.ddr_size,
     )
+    tdb.fast_forward = not args.no_fast_forward
     return tdb
 
 
@@ -5,14 +5,156 @@
 #
 # ==============================================================================
 
+import os
+import functools
+import shutil
+import struct
+import warnings
+import zipfile
 import numpy as np
 
 
+class WeightStore(object):
+    """Weights of a converter, by name.
+
+    Weights added by addWeight keep the dtype of the source model (or are only
+    a loader of it, such as an onnx initializer or a memory-mapped external data
+    file) and are converted to f32 each time they are read. A loader is called
+    at each read, its data is not kept. Once a weight is written to the weight
+    file, it is read back from the file instead. Weights assigned directly are
+    returned as they are.
+    """
+
+    def __init__(self):
+        self.entries = dict()
+        self.to_f32 = set()
+        # names assigned directly, the weight file may hold an older value
+        self.modified = set()
+        # dtype of the reloaded weights assigned directly
+        self.dtypes = dict()
+
+    def add(self, name, data):
+        # data: numpy array, or a callable loading it when needed
+        self.entries[name] = data
+        self.to_f32.add(name)
+
+    def raw(self, name):
+        data = self.entries[name]
+        if callable(data):
+            data = data()
+        return data
+
+    def reload(self, name, loader):
+        # the weight is read by loader from now on, in the dtype it is read as
+        self.entries[name] = loader
+        self.dtypes[name] = self.dtype(name)
+
+    def dtype(self, name):
+        if name in self.to_f32:
+            return np.dtype(np.float32)
+        if name in self.dtypes:
+            return self.dtypes[name]
+        return self.entries[name].dtype
+
+    def __getitem__(self, name):
+        data = self.raw(name)
+        if name in self.to_f32:
+            data = data.astype(np.float32, copy=False)
+            if len(data.shape) == 0:
+                data = data.reshape([1])
+        return data
+
+    def __setitem__(self, name, data):
+        self.entries[name] = data
+        self.to_f32.discard(name)
+        self.dtypes.pop(name, None)
+        self.modified.add(name)
+
+    def __delitem__(self, name):
+        del self.entries[name]
+        self.to_f32.discard(name)
+        self.dtypes.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class NpzWriter(object):
+    """Write arrays one by one to a npz file, the same format as np.savez."""
+
+    def __init__(self, file):
+        self.file = file
+        self.zip = zipfile.ZipFile(file, 'w', zipfile.ZIP_STORED, allowZip64=True)
+        # name -> offset of its last local file header
+        self.names = dict()
+        self.rewritten = False
+
+    def write(self, name, data):
+        if name in self.names:
+            self.rewritten = True
+        with warnings.catch_warnings():
+            # a rewritten array is a duplicate member until the file is closed
+            warnings.simplefilter("ignore", UserWarning)
+            with self.zip.open(name + '.npy', 'w', force_zip64=True) as f:
+                np.lib.format.write_array(f, np.asanyarray(data), allow_pickle=False)
+        self.names[name] = self.zip.infolist()[-1].header_offset
+
+    def load(self, name):
+        # map an array already written, also while the file is being written
+        if self.zip.fp is not None:
+            self.zip.fp.flush()
+        with open(self.file, 'rb') as f:
+            f.seek(self.names[name])
+            # local file header: 30 bytes, then the file name and the extra field
+            name_len, extra_len = struct.unpack('<HH', f.read(30)[26:30])
+            f.seek(name_len + extra_len, os.SEEK_CUR)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            offset = f.tell()
+        if np.prod(shape) == 0:
+            return np.empty(shape, dtype=dtype)
+        # copy on write, the file is not changed by the converter
+        return np.memmap(self.file,
+                         dtype=dtype,
+                         mode='c',
+                         offset=offset,
+                         shape=shape,
+                         order='F' if fortran_order else 'C')
+
+    def close(self):
+        self.zip.close()
+        if self.rewritten:
+            self.dedupe()
+
+    def dedupe(self):
+        # keep the last member of each name, the one np.load reads; only for a
+        # weight changed after it was written, which the converters avoid
+        tmp_file = self.file + '.tmp'
+        with zipfile.ZipFile(self.file) as src:
+            members = {info.filename: info for info in src.infolist()}
+            with zipfile.ZipFile(tmp_file, 'w', zipfile.ZIP_STORED, allowZip64=True) as dst:
+                for info in members.values():
+                    with src.open(info) as fin, dst.open(info.filename, 'w', force_zip64=True) as fout:
+                        shutil.copyfileobj(fin, fout, 1 << 24)
+        os.replace(tmp_file, self.file)
+        self.rewritten = False
+
+
 class BaseConverter(object):
 
     def __init__(self):
         self.operands = dict()
-        self.tensors = dict()
+        self.tensors = WeightStore()
+        self.weight_writer = None
         self.shapes = dict()
         self.input_names = list()
         self.output_names = list()
@@ -62,18 +204,25 @@ class BaseConverter(object):
     def addWeight(self, name, data):
         if not isinstance(data, np.ndarray):
             raise KeyError("tensor data must be numpy array")
-        if data.dtype != np.float32:
-            data = data.astype(np.float32)
         if name in self.tensors:
-            if np.all(self.tensors[name] == data):
+            if np.all(self.tensors[name] == data.astype(np.float32)):
                 return
             raise KeyError("tensor {} conflict".format(name))
         if len(data.shape) == 0:
             data = data.reshape([1])
-        # all weight convert to f32.
-        self.tensors[name] = data
+        # keep the source dtype, all weight are read as f32.
+        self.tensors.add(name, data)
         self.addShape(name, data.shape)
 
+    def addLazyWeight(self, name, shape, loader):
+        # loader() returns the data in the source dtype, called when needed
+        if name in self.tensors:
+            if np.all(self.tensors[name] == loader().astype(np.float32)):
+                return
+            raise KeyError("tensor {} conflict".format(name))
+        self.tensors.add(name, loader)
+        self.addShape(name, list(shape))
+
     def isWeight(self, name):
         if name in self.tensors:
             return True
@@ -109,7 +258,7 @@ class BaseConverter(object):
         if shape and old_shape != shape:
             assert (np.prod(old_shape) == np.prod(shape))
             old_shape = shape
-        ori_type = str(self.tensors[name].dtype)
+        ori_type = str(self.tensors.dtype(name))
         type_dict = {
             'int8': "INT8",
             'uint8': "UINT8",
@@ -122,11 +271,36 @@ class BaseConverter(object):
             raise KeyError("type {} not implemented".format(ori_type))
         op = self.mlir.create_weight_op(name, old_shape, type_dict[ori_type])
         self.addOperand(name, op)
+        self.saveWeight(name)
         return op
 
+    def saveWeight(self, name):
+        # stream the weight to the weight file once its op exists, so only the
+        # f32 copy of one weight is alive at a time; it is then mapped from the
+        # file. Weights assigned directly are written once by WeightToNpz.
+        weight_file = getattr(self, 'weight_file', None)
+        if not weight_file or name in self.tensors.modified:
+            return
+        if self.weight_writer is None:
+            self.weight_writer = NpzWriter(weight_file)
+        if name in self.weight_writer.names:
+            return
+        self.weight_writer.write(name, self.tensors[name])
+        self.tensors.reload(name, functools.partial(self.weight_writer.load, name))
+
     def WeightToNpz(self, weight_file):
-        tensor_npz = {}
+        writer = self.weight_writer
+        self.weight_writer = None
+        if writer is not None and writer.file != weight_file:
+            writer.close()
+            writer = None
+        if writer is None:
+            writer = NpzWriter(weight_file)
         for name in self.tensors:
-            if name in self.operands:
-                tensor_npz[name] = self.tensors[name]
-        np.savez(weight_file, **tensor_npz)
+            if name not in self.operands:
+                continue
+            # weights not written yet, or changed since
+            if name not in writer.names or name in self.tensors.modified:
+                writer.write(name, self.tensors[name])
+        writer.close()
+        self.tensors.modified.clear()
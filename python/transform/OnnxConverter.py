@@ -18,6 +18,8 @@ import numpy as np
 from utils.pad_setting import set_auto_pad
 from utils.auto_remove import file_mark, file_clean
 import copy, sys
+import os
+import functools
 import mlir.dialects.top as top
 from mlir.ir import *
 from typing import List
@@ -112,11 +114,18 @@ class OnnxConverter(BaseConverter):
         self.model = None
         self.mlir = None
         self.node_name_mapping = {}  # used in onnx opt
+        # name indexes of the final graph, see build_index
+        self.initializer_index = {}
+        self.shape_index = {}
+        self.const_nodes = {}
+        self.needed_names = set()
         self.np_onnx_dt_map = [
             None, np.float32, np.uint8, np.int8, np.int16, np.int16, np.int32, np.int64, None,
             np.bool_, np.float16, np.float64, np.uint32, np.uint64, None, None, None
         ]
         self.onnx_sim = onnx_sim
+        # where the external data of the initializers is, see load_initializer
+        self.external_data_dir = ""
         self.load_onnx_model(onnx_file, input_shapes, output_names, static_shape)
         self.init_MLIRImporter()
         self.unranked_type = self.mlir.get_tensor_type([])
@@ -261,10 +270,8 @@ class OnnxConverter(BaseConverter):
         file_clean()
 
     def check_need(self, name):
-        for node in self.converted_nodes:
-            for i in node.inputs:
-                if i == name:
-                    return True
+        if name in self.needed_names:
+            return True
         if name in self.output_names:
             return True
         return False
@@ -323,28 +330,29 @@ class OnnxConverter(BaseConverter):
             self.all_weights[w.name] = w
         # remove unused node
         self.select_unuse(self.all_outputs)
-        for n in self.all_nodes.values():
-            if n in self.model.graph.node:
-                self.model.graph.node.remove(n)
-        for w in self.all_weights.values():
-            self.model.graph.initializer.remove(w)
-        for i in self.all_inputs.values():
-            self.model.graph.input.remove(i)
-        for v in self.all_values.values():
-            self.model.graph.value_info.remove(v)
-        unuse_output = []
-        for o in self.model.graph.output:
-            if o.name not in self.all_outputs:
-                unuse_output.append(o)
-        for o in unuse_output:
-            self.model.graph.output.remove(o)
+        unuse_nodes = set(id(n) for n in self.all_nodes.values())
+        self.filter_repeated(self.model.graph.node, lambda n: id(n) not in unuse_nodes)
+        self.filter_repeated(self.model.graph.initializer, lambda w: w.name not in self.all_weights)
+        self.filter_repeated(self.model.graph.input, lambda i: i.name not in self.all_inputs)
+        self.filter_repeated(self.model.graph.value_info, lambda v: v.name not in self.all_values)
+        all_outputs = set(self.all_outputs)
+        self.filter_repeated(self.model.graph.output, lambda o: o.name in all_outputs)
+
+    @staticmethod
+    def filter_repeated(field, keep):
+        # rebuild a repeated field once instead of removing items one by one
+        kept = [x for x in field if keep(x)]
+        if len(kept) == len(field):
+            return
+        del field[:]
+        field.extend(kept)
 
     def get_outputs(self, model: onnx.ModelProto):
-        initializer_names = [x.name for x in model.graph.initializer]
+        initializer_names = set(x.name for x in model.graph.initializer)
         return [opt for opt in model.graph.output if opt.name not in initializer_names]
 
     def get_inputs(self, model: onnx.ModelProto):
-        initializer_names = [x.name for x in model.graph.initializer]
+        initializer_names = set(x.name for x in model.graph.initializer)
         return [ipt for ipt in model.graph.input if ipt.name not in initializer_names]
 
     def get_input_names(self, model: onnx.ModelProto):
@@ -411,20 +419,46 @@ class OnnxConverter(BaseConverter):
             print("WARNING: ConstantFolding failed.")
         print("ConstantFolding finished")
 
+    def build_index(self):
+        # index the graph by name once it is final (after simplify and onnx_opt),
+        # lookups during conversion must not scan the whole graph
+        self.initializer_index = {t.name: t for t in self.model.graph.initializer}
+        self.shape_index = self.get_shape_index(self.model.graph)
+
+    @staticmethod
+    def get_shape_index(graph):
+        # name -> dims, value_info is searched first, then input and output
+        index = {}
+        for values in (graph.output, graph.input, graph.value_info):
+            for v in reversed(list(values)):
+                index[v.name] = v.type.tensor_type.shape.dim
+        return index
+
     def find_named_tensor(self, name):
-        for tensor in self.model.graph.initializer:
-            if name == tensor.name:
-                return numpy_helper.to_array(tensor).astype(np.float32)
-        if self.subgraph_initializer is not None:
-            for tensor in self.subgraph_initializer:
-                if name == tensor.name:
-                    return numpy_helper.to_array(tensor).astype(np.float32)
-        for node in self.converted_nodes:
-            if node.op_type != "Constant":
-                continue
-            if node.name == name:
-                onnx_tensor = node.attrs['value']
-                return numpy_helper.to_array(onnx_tensor)
+        if name in self.initializer_index:
+            return numpy_helper.to_array(self.initializer_index[name]).astype(np.float32)
+        if self.subgraph_initializer is not None and name in self.subgraph_initializer:
+            return numpy_helper.to_array(self.subgraph_initializer[name]).astype(np.float32)
+        if name in self.const_nodes:
+            onnx_tensor = self.const_nodes[name].attrs['value']
+            return numpy_helper.to_array(onnx_tensor)
+
+    def load_initializer(self, tensor):
+        # saving a model over 2GB moves the data of the initializers to an
+        # external file, map it from there instead of reading it in
+        if tensor.data_location == onnx.TensorProto.EXTERNAL:
+            info = {e.key: e.value for e in tensor.external_data}
+            dtype = None
+            if tensor.data_type < len(self.np_onnx_dt_map):
+                dtype = self.np_onnx_dt_map[tensor.data_type]
+            if dtype is not None and tensor.data_type != onnx.TensorProto.UINT16:
+                return np.memmap(os.path.join(self.external_data_dir, info['location']),
+                                 dtype=dtype,
+                                 mode='r',
+                                 offset=int(info.get('offset', 0)),
+                                 shape=tuple(tensor.dims))
+            return numpy_helper.to_array(tensor, self.external_data_dir)
+        return numpy_helper.to_array(tensor)
 
     def load_onnx_model(self, onnx_file, input_shapes: list, output_names: list, static_shape=True):
         if isinstance(onnx_file, str):
@@ -443,12 +477,10 @@ class OnnxConverter(BaseConverter):
         self.input_shapes = self.get_input_shapes(self.model)
         self.input_types = self.get_input_types(self.model)
         self.output_types = self.get_output_types(self.model)
-        # add all weight
+        # add all weight, loaded in their own type when needed
         for tensor in self.model.graph.initializer:
-            name = tensor.name
-            data = numpy_helper.to_array(tensor).astype(np.float32)
-            self.addWeight(name, data)
-            # TODO: for quantized onnx, keep the same type
+            loader = functools.partial(self.load_initializer, tensor)
+            self.addLazyWeight(tensor.name, tensor.dims, loader)
         self.get_output_name(self.model.graph)
         self.onnx_file = "{}_opt.onnx".format(self.model_name)
         file_mark(self.onnx_file)
@@ -462,6 +494,7 @@ class OnnxConverter(BaseConverter):
                           save_as_external_data=True,
                           location=self.model_name + "_external_data",
                           convert_attribute=True)
+                self.external_data_dir = os.path.dirname(os.path.abspath(self.onnx_file))
             else:
                 raise E
         strip_model = onnx.ModelProto()
@@ -472,6 +505,7 @@ class OnnxConverter(BaseConverter):
         if static_shape:
             # fuse ops such as layernorm gelu...
             self.model, self.node_name_mapping = onnx_opt(self.model, True)
+        self.build_index()
 
     def get_output_name(self, graph):
         for output in graph.output:
@@ -533,17 +567,6 @@ class OnnxConverter(BaseConverter):
                                  self.input_types)
         self.weight_file = self.mlir.weight_file
 
-    def get_shape_for_node(self, input, output, value_info, name):
-        for i in value_info:
-            if i.name == name:
-                return i.type.tensor_type.shape.dim
-        for i in input:
-            if i.name == name:
-                return i.type.tensor_type.shape.dim
-        for i in output:
-            if i.name == name:
-                return i.type.tensor_type.shape.dim
-
     def generate_mlir(self, mlir_file: str):
         """convert all to mlir"""
         # add input op
@@ -555,17 +578,22 @@ class OnnxConverter(BaseConverter):
             raise RuntimeError("{} Op not support now".format(node.op_type))
 
         self.converted_nodes.clear()
+        self.const_nodes.clear()
+        self.needed_names.clear()
         for n in self.model.graph.node:
             node = OnnxNode(n)
             if n.op_type in ["Gather"]:
                 input_shape = dict()
                 for input in n.input:
-                    input_shape[input] = self.get_shape_for_node(self.model.graph.input, self.model.graph.output, self.model.graph.value_info, input)
+                    input_shape[input] = self.shape_index.get(input)
                 output_shape = dict()
                 for output in n.output:
-                    output_shape[output] = self.get_shape_for_node(self.model.graph.input, self.model.graph.output, self.model.graph.value_info, output)
+                    output_shape[output] = self.shape_index.get(output)
                 node.shape_info["input"] = input_shape
                 node.shape_info["output"] = output_shape
+            if n.op_type == "Constant":
+                self.const_nodes[node.name] = node
+            self.needed_names.update(node.inputs)
             self.converted_nodes.append(node)
         # checkout all type is supported
         unsupported = set()
@@ -2584,15 +2612,16 @@ class OnnxConverter(BaseConverter):
 
     def parse_subgraph(self, op, region_idx, graph_node):
         converted_nodes = list()
+        shape_index = self.get_shape_index(graph_node)
         for n in graph_node.node:
             node = OnnxNode(n)
             if n.op_type in ["Gather"]:
                 input_shape = dict()
                 for input in n.input:
-                    input_shape[input] = self.get_shape_for_node(graph_node.input, graph_node.output, graph_node.value_info, input)
+                    input_shape[input] = shape_index.get(input)
                 output_shape = dict()
                 for output in n.output:
-                    output_shape[output] = self.get_shape_for_node(graph_node.input, graph_node.output, graph_node.value_info, output)
+                    output_shape[output] = shape_index.get(output)
                 node.shape_info["input"] = input_shape
                 node.shape_info["output"] = output_shape
             converted_nodes.append(node)
@@ -2603,7 +2632,7 @@ class OnnxConverter(BaseConverter):
                 unsupported.add(n.op_type)
         if unsupported:
             raise RuntimeError("Op not support:{}".format(unsupported))
-        initializer_names = [x.name for x in graph_node.initializer]
+        initializer_names = set(x.name for x in graph_node.initializer)
         subgraph_input_names = list()
 
         region = op.regions[region_idx]
@@ -2637,11 +2666,10 @@ class OnnxConverter(BaseConverter):
                                                               entry_block_args[idx], **{})
                 self.addOperand(input.name, input_op)
         # add all weight
-        self.subgraph_initializer = graph_node.initializer
+        self.subgraph_initializer = {t.name: t for t in graph_node.initializer}
         for tensor in graph_node.initializer:
-            name = tensor.name
-            data = numpy_helper.to_array(tensor).astype(np.float32)
-            self.addWeight(name, data)
+            loader = functools.partial(self.load_initializer, tensor)
+            self.addLazyWeight(tensor.name, tensor.dims, loader)
         self.get_output_name(graph_node)
         def NoneAndRaise(node):
             raise RuntimeError("{} Op not support now".format(node.op_type))
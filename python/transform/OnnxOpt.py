@@ -71,7 +71,23 @@ class ConstantFolding(object):
             onnx.checker.check_model(self.model)
         except:
             print("WARNING: onnx model check failed")
-        self.const_tensors = []
+        self.const_tensors = set()
+        self.build_index()
+
+    def build_index(self):
+        # name -> value info, the first of value_info, input and output wins
+        self.value_infos = {}
+        for v in reversed(list(self.model.graph.output)):
+            self.value_infos[v.name] = v
+        for v in reversed(list(self.model.graph.input)):
+            self.value_infos[v.name] = v
+        for v in reversed(list(self.model.graph.value_info)):
+            self.value_infos[v.name] = v
+        # tensor name -> indexes of the consumer nodes
+        self.consumers = defaultdict(list)
+        for i, node in enumerate(self.model.graph.node):
+            for input in node.input:
+                self.consumers[input].append(i)
 
     def get_inputs(self):
         initializer_names = [x.name for x in self.model.graph.initializer]
@@ -101,23 +117,7 @@ class ConstantFolding(object):
         return inputs
 
     def get_value_info_all(self, name):
-        for v in self.model.graph.value_info:
-            if v.name == name:
-                return v
-        for v in self.model.graph.input:
-            if v.name == name:
-                return v
-        for v in self.model.graph.output:
-            if v.name == name:
-                return v
-        return None
-
-    @staticmethod
-    def insert_elem(nodes, idx, element):
-        nodes.extend([nodes[-1]])
-        for i in reversed(range(idx + 1, len(nodes) - 1)):
-            nodes[i].CopyFrom(nodes[i - 1])
-        nodes[idx].CopyFrom(element)
+        return self.value_infos.get(name, None)
 
     @staticmethod
     def get_shape_from_value_info_proto(vinfo):
@@ -177,36 +177,40 @@ class ConstantFolding(object):
         return node.op_type in ["RandomNormal", "RandomNormalLike", "RandomUniformLike"]
 
     def get_constant_nodes(self):
+        # indexes of the nodes to fold, in topological order; one pass is
+        # enough as const_tensors grows along the nodes
         const_nodes = []
-        dynamic_tensors = []
-        self.const_tensors = [x.name for x in self.model.graph.initializer]
-        self.const_tensors.extend([node.output[0] for node in self.model.graph.node if node.op_type == "Constant"])
-        self.const_tensors.extend([''])
-        for node in self.model.graph.node:
+        dynamic_tensors = set()
+        nodes = self.model.graph.node
+        self.const_tensors = set(x.name for x in self.model.graph.initializer)
+        self.const_tensors.update(node.output[0] for node in nodes if node.op_type == "Constant")
+        self.const_tensors.add('')
+        is_const = lambda node: all(x in self.const_tensors for x in node.input)
+        for i, node in enumerate(nodes):
             if node.op_type == "Shape" and node.input[0] not in dynamic_tensors:
-                const_nodes.append(node)
-                self.const_tensors.extend(node.output)
-            elif node.op_type == "Resize" and all([x in self.const_tensors for x in node.input]):
-                const_nodes.append(node)
-                self.const_tensors.extend(node.output)
+                const_nodes.append(i)
+                self.const_tensors.update(node.output)
+            elif node.op_type == "Resize" and is_const(node):
+                const_nodes.append(i)
+                self.const_tensors.update(node.output)
             elif any(x in dynamic_tensors for x in node.input):
-                dynamic_tensors.extend(node.output)
+                dynamic_tensors.update(node.output)
             elif self.is_dynamic(node):
-                dynamic_tensors.extend(node.output)
+                dynamic_tensors.update(node.output)
             elif self.is_quantizeLinear(node):
                 pass
             elif self.has_subgraph_in_node(node):
-                if all([x in self.const_tensors for x in node.input]):
+                if is_const(node):
                     if (node.op_type == "If"):
-                        const_nodes.append(node)
-            elif len(node.input) > 0 and all([x in self.const_tensors for x in node.input]) \
+                        const_nodes.append(i)
+            elif len(node.input) > 0 and is_const(node) \
                     and not self.is_non_determinstic_node(node):
-                const_nodes.append(node)
-                self.const_tensors.extend(node.output)
-            elif node.op_type == "Transpose" and all([x in self.const_tensors for x in node.input]):
-                const_nodes.append(node)
-                self.const_tensors.extend(node.output)
-        return copy.deepcopy(const_nodes)
+                const_nodes.append(i)
+                self.const_tensors.update(node.output)
+            elif node.op_type == "Transpose" and is_const(node):
+                const_nodes.append(i)
+                self.const_tensors.update(node.output)
+        return const_nodes
 
     def forward(self, model, test_input):
         input_shapes = {}
@@ -261,77 +265,80 @@ class ConstantFolding(object):
     def forward_for_node_outputs(self, const_nodes):
         model = copy.deepcopy(self.model)
         test_input = self.test_input
-        for node in const_nodes:
-            for output in node.output:
+        for i in const_nodes:
+            for output in self.model.graph.node[i].output:
                 model.graph.output.extend([onnx.ValueInfoProto(name=output)])
         return self.forward(model, test_input)
 
     def eliminate_const_nodes(self, const_node, res):
-        do_eliminate = False
+        # build the new node list in one pass instead of inserting in place
+        const_node = set(const_node)
+        if len(const_node) == 0:
+            return False
+        new_nodes = []
         for i, node in enumerate(self.model.graph.node):
-            if node in const_node:
-                if node.op_type == "If":
-                    sub_graph = {}
-                    for attr in node.attribute:
-                        sub_graph[attr.name] = attr.g.node
-                    if res[node.input[0]]:
-                        sub_nodes = sub_graph['then_branch']
-                    else:
-                        sub_nodes = sub_graph['else_branch']
-                    if len(node.output) != len(sub_nodes[-1].output):
-                        raise RuntimeError("If op not support multi output now, fix me.")
-                    sub_nodes[-1].output[:] = []
-                    sub_nodes[-1].output.extend(node.output)
-                    sub_nodes = sub_nodes[::-1]
-                    for n in sub_nodes:
-                        self.insert_elem(self.model.graph.node, i + 1, n)
-                    self.model.graph.node.remove(node)
-                    do_eliminate = True
-                    continue
-                for output in node.output:
-                    new_node = copy.deepcopy(node)
-                    new_node.name = "node_" + output
-                    new_node.op_type = "Constant"
-                    new_attr = onnx.helper.make_attribute(
-                        "value",
-                        onnx.numpy_helper.from_array(res[output], name=output)
-                    )
-                    del new_node.input[:]
-                    del new_node.attribute[:]
-                    del new_node.output[:]
-                    new_node.output.extend([output])
-                    new_node.attribute.extend([new_attr])
-                    self.insert_elem(self.model.graph.node, i + 1, new_node)
-                del self.model.graph.node[i]
-                do_eliminate = True
-        return do_eliminate
+            if i not in const_node:
+                new_nodes.append(node)
+                continue
+            if node.op_type == "If":
+                sub_graph = {}
+                for attr in node.attribute:
+                    sub_graph[attr.name] = attr.g.node
+                if res[node.input[0]]:
+                    sub_nodes = sub_graph['then_branch']
+                else:
+                    sub_nodes = sub_graph['else_branch']
+                if len(node.output) != len(sub_nodes[-1].output):
+                    raise RuntimeError("If op not support multi output now, fix me.")
+                sub_nodes[-1].output[:] = []
+                sub_nodes[-1].output.extend(node.output)
+                new_nodes.extend(sub_nodes)
+                continue
+            for output in node.output:
+                new_node = onnx.helper.make_node(
+                    "Constant", [], [output],
+                    name="node_" + output,
+                    value=onnx.numpy_helper.from_array(res[output], name=output))
+                new_nodes.append(new_node)
+        self.replace_nodes(new_nodes)
+        return True
+
+    def replace_nodes(self, new_nodes):
+        # copy out first, new_nodes may refer to the nodes being cleared
+        graph = onnx.GraphProto()
+        graph.node.extend(new_nodes)
+        del self.model.graph.node[:]
+        self.model.graph.node.extend(graph.node)
+        self.build_index()
 
     def remove_unused_nodes(self):
-        node_inputs = []
-        unused_node = []
-        for n in self.model.graph.node:
-            node_inputs.extend(n.input)
-        node_inputs.extend([out.name for out in self.model.graph.output])
-        node_inputs = set(node_inputs)
-
-        for n in self.model.graph.node:
-            if len(set(n.output).intersection(node_inputs)) == 0:
-                unused_node.append(n)
-        for n in unused_node:
-            self.model.graph.node.remove(n)
+        node_inputs = set(self.consumers.keys())
+        node_inputs.update(out.name for out in self.model.graph.output)
+        used_nodes = [n for n in self.model.graph.node if not node_inputs.isdisjoint(n.output)]
+        if len(used_nodes) != len(self.model.graph.node):
+            self.replace_nodes(used_nodes)
 
     def infer_shapes(self):
         try:
             self.model = onnx.shape_inference.infer_shapes(self.model)
         except:
             pass
+        self.build_index()
         # self.model = onnx.shape_inference.infer_shapes(self.model, strict_mode =True, data_prop=True)
 
 
     def folding(self, infer_shapes=True):
+        # one fold level: all the constant nodes by one onnxruntime session,
+        # nothing to run when no node is left to fold
         const_nodes = self.get_constant_nodes()
+        if len(const_nodes) == 0:
+            # value_info was cleared by __init__, the shapes are still inferred
+            if infer_shapes and not self.model.graph.value_info:
+                self.infer_shapes()
+            return False
         res = self.forward_for_node_outputs(const_nodes)
-        const_node = [node for node in const_nodes if node.output[0] in res]
+        nodes = self.model.graph.node
+        const_node = [i for i in const_nodes if nodes[i].output[0] in res]
         do_eliminate = self.eliminate_const_nodes(const_node, res)
         if infer_shapes:
             self.infer_shapes()
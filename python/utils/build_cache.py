@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# ==============================================================================
+#
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+
+import os
+import re
+import json
+import shutil
+import hashlib
+import tempfile
+from .log_setting import setup_logger
+
+logger = setup_logger("cache")
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "tpu_mlir", "build")
+
+# layout of the cache directory, shared by model_transform.py and model_deploy.py:
+# <cache_dir>/<key[:2]>/<key>/manifest.json
+# <cache_dir>/<key[:2]>/<key>/<index>_<basename>
+# key: hash of the stage name, its parameters and the contents of its input
+# files; an entry holds the output files of the stage, in the order given
+# to store, and extra files such as the weights of an output mlir, which are
+# restored by name next to the output they were stored next to, or next to
+# the first output.
+
+
+def hash_file(md, file: str, chunk_size=1 << 20):
+    with open(file, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            md.update(chunk)
+    return md
+
+
+def mlir_weight_attr(mlir_file: str):
+    """module.weight_file of a mlir file, as written in it"""
+    with open(mlir_file, "r") as f:
+        header = f.read(4096)
+    weight = re.search(r'module\.weight_file\s*=\s*"([^"]+)"', header)
+    return weight.group(1) if weight else None
+
+
+def mlir_weight_file(mlir_file: str):
+    """weight npz of a mlir file, next to it or in the current directory"""
+    weight = mlir_weight_attr(mlir_file)
+    if not weight:
+        return None
+    weight_file = os.path.join(os.path.dirname(os.path.abspath(mlir_file)), weight)
+    if not os.path.exists(weight_file):
+        weight_file = weight
+    return weight_file
+
+
+def mlir_files(mlir_file: str):
+    # a mlir file goes with its weights
+    files = [mlir_file]
+    weight_file = mlir_weight_file(mlir_file)
+    if weight_file and os.path.exists(weight_file):
+        files.append(weight_file)
+    return files
+
+
+class BuildCache:
+    """Content-addressed cache of the output files of build stages.
+
+    A stage is identified by key(stage, inputs, params); store copies its
+    outputs into a new entry, made visible by a rename so concurrent builds
+    sharing the directory never see a partial entry, and restore copies them
+    back to where the stage would have written them. The directory is shared
+    by all the builds on the host: once it grows beyond max_size bytes, the
+    least recently used entries are evicted.
+    """
+
+    def __init__(self, cache_dir: str, max_size: float = 50 * 1024**3, version: str = ""):
+        self.cache_dir = os.path.abspath(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_size = max_size
+        # toolchain version, entries of other versions are never hit
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, stage: str, inputs: list = [], params: dict = {}):
+        md = hashlib.md5()
+        md.update(self.version.encode())
+        md.update(stage.encode())
+        md.update(json.dumps(params, sort_keys=True, default=str).encode())
+        for file in inputs:
+            if file is None:
+                md.update(b"\0")
+            elif os.path.isdir(file):
+                for root, dirs, names in os.walk(file):
+                    dirs.sort()
+                    for n in sorted(names):
+                        path = os.path.join(root, n)
+                        md.update(os.path.relpath(path, file).encode())
+                        hash_file(md, path)
+            else:
+                hash_file(md, file)
+        return md.hexdigest()
+
+    def entry_dir(self, key: str):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def contains(self, key: str):
+        return os.path.exists(os.path.join(self.entry_dir(key), "manifest.json"))
+
+    def restore(self, key: str, outputs: list = []):
+        """copy the outputs of the entry to the given paths, False on a miss"""
+        entry = self.entry_dir(key)
+        manifest_file = os.path.join(entry, "manifest.json")
+        try:
+            with open(manifest_file, "r") as f:
+                manifest = json.load(f)
+            if len(manifest["files"]) != len(outputs):
+                raise ValueError("outputs of {} changed".format(manifest["stage"]))
+            for name, dst in zip(manifest["files"], outputs):
+                os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+                shutil.copyfile(os.path.join(entry, name), dst)
+            if outputs:
+                extras = manifest.get("extras", [])
+                for name, idx in zip(extras, manifest.get("extra_dirs", [0] * len(extras))):
+                    extra_dir = os.path.dirname(os.path.abspath(outputs[idx]))
+                    dst = os.path.join(extra_dir, name.split("_", 1)[1])
+                    shutil.copyfile(os.path.join(entry, name), dst)
+            # mtime of the manifest is the lru clock
+            os.utime(manifest_file, None)
+        except (OSError, ValueError, KeyError):
+            # no entry, or evicted while being read
+            self.misses += 1
+            return False
+        self.hits += 1
+        logger.info("cache hit {}: {}".format(manifest["stage"], ", ".join(outputs)))
+        return True
+
+    def store(self, key: str, stage: str, outputs: list = [], extras: list = []):
+        entry = self.entry_dir(key)
+        if self.contains(key):
+            return
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(entry), suffix=".tmp")
+        try:
+            names = []
+            for i, file in enumerate(list(outputs) + list(extras)):
+                name = "{}_{}".format(i, os.path.basename(file))
+                shutil.copyfile(file, os.path.join(tmp, name))
+                names.append(name)
+            # the output each extra is next to
+            output_dirs = [os.path.dirname(os.path.abspath(f)) for f in outputs]
+            extra_dirs = []
+            for file in extras:
+                extra_dir = os.path.dirname(os.path.abspath(file))
+                extra_dirs.append(output_dirs.index(extra_dir) if extra_dir in output_dirs else 0)
+            manifest = {
+                "stage": stage,
+                "files": names[:len(outputs)],
+                "extras": names[len(outputs):],
+                "extra_dirs": extra_dirs,
+            }
+            with open(os.path.join(tmp, "manifest.json"), "w") as f:
+                json.dump(manifest, f)
+            os.rename(tmp, entry)
+        except OSError:
+            # another build stored the same entry first
+            if not self.contains(key):
+                raise
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp)
+        if self.max_size > 0:
+            self.evict()
+
+    def run_stage(self, stage: str, inputs: list, params: dict, outputs: list, run, extras=None):
+        """run() makes the outputs, unless the cache has them; True on a hit.
+        extras() lists more files made by run() to keep in the entry."""
+        key = self.key(stage, inputs, params)
+        if self.restore(key, outputs):
+            return True
+        run()
+        self.store(key, stage, outputs, extras() if extras else [])
+        return False
+
+    def scan(self):
+        entries = []
+        for sub in os.listdir(self.cache_dir):
+            sub_dir = os.path.join(self.cache_dir, sub)
+            if not os.path.isdir(sub_dir):
+                continue
+            for key in os.listdir(sub_dir):
+                if key.endswith((".tmp", ".del")):
+                    continue
+                entry = os.path.join(sub_dir, key)
+                try:
+                    mtime = os.stat(os.path.join(entry, "manifest.json")).st_mtime
+                    size = sum(e.stat().st_size for e in os.scandir(entry))
+                except OSError:
+                    # being written or removed
+                    continue
+                entries.append((mtime, size, entry))
+        return entries
+
+    def evict(self):
+        # drop the least recently used entries down to 80% of max_size
+        entries = sorted(self.scan())
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_size:
+            return
+        target = self.max_size * 0.8
+        for _, size, entry in entries:
+            if total <= target:
+                break
+            # rename first, a concurrent restore sees all the entry or nothing
+            trash = entry + ".{}.del".format(os.getpid())
+            try:
+                os.rename(entry, trash)
+            except OSError:
+                continue
+            shutil.rmtree(trash, ignore_errors=True)
+            total -= size
+
+    def summary(self):
+        return "build cache {}: {} hits, {} misses".format(self.cache_dir, self.hits, self.misses)
+
+
+def create_build_cache(args):
+    """BuildCache of --build_cache, or of the default directory if --cache_skip
+
+    CACHE_SKIP=True in the environment is the same as --cache_skip.
+    """
+    cache_dir = getattr(args, 'build_cache', None) or os.environ.get("BUILD_CACHE", None)
+    cache_skip = getattr(args, 'cache_skip', False) or os.environ.get("CACHE_SKIP") == "True"
+    if not cache_dir and cache_skip:
+        cache_dir = DEFAULT_CACHE_DIR
+    if not cache_dir:
+        return None
+    import pymlir
+    max_size = getattr(args, 'build_cache_size', 50) * 1024**3
+    return BuildCache(cache_dir, max_size, pymlir.module().version)
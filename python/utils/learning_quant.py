@@ -12,8 +12,10 @@ from scipy.special import expit
 
 from datetime import datetime
 import time
+import multiprocessing
 from multiprocessing.pool import ThreadPool
 from multiprocessing import Lock
+from multiprocessing import shared_memory, resource_tracker
 
 
 import pymlir
@@ -106,14 +108,6 @@ def cal_loss(target, ref):
     mse_diff = ((target - ref)**2).mean()
     return mse_diff
 
-def learning_adaweight_wrap(reqs):
-    cls, epoch, op, total = reqs
-    return cls.learning_one(epoch, op, total)
-
-def learning_gptweight_wrap(reqs):
-    cls, epoch, op, total = reqs
-    return cls.learning_one(epoch, op, total)
-
 def learning_scale_wrap(reqs):
     cls, op, total = reqs
     return cls.learning_one(op, total)
@@ -157,6 +151,112 @@ def into_groups(parser, layers):
             group_idx += 1
     return groups
 
+class op_ref_tensors:
+    # the ref tensors needed to learn one op, stacked over the samples
+    def __init__(self, arrays):
+        self.arrays = arrays
+
+    def get(self, op, idx, quant=False, symetric=True):
+        return self.arrays[op][idx]
+
+def ref_names(learner, op):
+    # the op, its inputs, and the inputs of the reshapes not in the module
+    names = [op]
+    for pop in learner.parser.get_pre_op_by_op_name(op):
+        names.append(pop)
+        if pop not in learner.module.all_tensor_names and learner.parser.get_op_type_by_op_name(pop) == 'top.Reshape':
+            names.append(learner.parser.get_pre_op_by_op_name(pop)[0])
+    return list(dict.fromkeys(names))
+
+def gather_refs(learner, layers):
+    # one array per tensor of the group, the layers sharing an input share its array
+    names = {op: ref_names(learner, op) for op in layers}
+    arrays = {}
+    for op in layers:
+        for name in names[op]:
+            if name not in arrays:
+                arrays[name] = np.stack([learner.ref_tensors.get(name, loop) for loop in range(learner.num_sample)])
+    return names, arrays
+
+def share_arrays(arrays):
+    # copy the arrays into shared memory, workers map them instead of unpickling
+    descs, shms = {}, []
+    for name, array in arrays.items():
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+        descs[name] = (shm.name, array.shape, array.dtype.str)
+        shms.append(shm)
+    return descs, shms
+
+def attach_arrays(descs):
+    arrays, shms = {}, []
+    for name, (shm_name, shape, dtype) in descs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        # owned by the learner which unlinks it, not by the tracker of the worker
+        resource_tracker.unregister(shm._name, "shared_memory")
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        shms.append(shm)
+    return arrays, shms
+
+learner = None
+
+def init_learning_worker(cls):
+    # forked from the learner, the worker has its own copy of the module
+    global learner
+    learner = cls
+
+def learning_op_worker(reqs):
+    op, total, descs = reqs
+    arrays, shms = attach_arrays(descs)
+    try:
+        state = learner.learn_op(op, total, op_ref_tensors(arrays))
+    finally:
+        del arrays
+        for shm in shms:
+            shm.close()
+        loger.log_file.flush()
+    return state
+
+def learning_in_groups(cls, workers):
+    # layers of a group have no data dependency, they are learned in parallel;
+    # all the epochs of a layer run together, a layer only changes its own state
+    total = len(cls.finetune_layers)
+    groups = into_groups(cls.parser, cls.finetune_layers)
+    pool = None
+    if workers > 1 and max(len(g) for g in groups.values()) > 1:
+        loger.log_file.flush()
+        pool = multiprocessing.get_context('fork').Pool(workers, init_learning_worker, (cls,))
+    try:
+        learned = 0
+        for idx in groups:
+            layers = groups[idx]
+            # references of the group are computed before any of its weights changes
+            names, refs = gather_refs(cls, layers)
+            if pool is None or len(layers) == 1:
+                for op in layers:
+                    cls.learn_op(op, total, op_ref_tensors(refs))
+            else:
+                descs, shms = share_arrays(refs)
+                try:
+                    reqs = [(op, total, {n: descs[n] for n in names[op]}) for op in layers]
+                    for op, state in zip(layers, pool.map(learning_op_worker, reqs)):
+                        cls.set_op_state(op, state)
+                finally:
+                    for shm in shms:
+                        shm.close()
+                        shm.unlink()
+            del refs
+            learned += len(layers)
+            print("")
+            print("=================================================")
+            print(f"  End group {idx}, learned {learned}/{total} layers")
+            print("=================================================")
+            print("")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
 class logging:
     def __init__(self, filename = "logging"):
         self.file_name = filename
@@ -518,6 +618,7 @@ class LearningGptqWeight:
         self.get_finetune_ops(args.excepts)
         self.backup_weights()
         self.H = {}
+        self.workers = getattr(args, 'workers', 1)
         if self.mini_batch <= self.batch_size:
             self.mini_batch = 1
         else:
@@ -716,9 +817,9 @@ class LearningGptqWeight:
         s = [int(x) for x in s]
         return s
 
-    def update_H(self, op, input, output):
-        shape = input.shape
-        in_num = shape[0]
+    def update_H(self, op, inputs):
+        # H of the inputs of all the samples, rescaled once
+        shape = inputs[0].shape
         if op not in self.H:
             weight_shape = self.orig_weights[op].shape
             print(f'input shape {shape} weight shape {weight_shape}')
@@ -731,33 +832,37 @@ class LearningGptqWeight:
                 sys.exit(1)
             self.H[op] = np.zeros((weight_shape[1],weight_shape[1]))
             self.samples[op] = 0
-        else:
-            # do the add batch update to H
+        in_num = sum(input.shape[0] for input in inputs)
+        if self.parser.get_op_type_by_op_name(op) == 'top.Conv':
+            op_ = self.parser.get_op_by_op_name(op)
+            if op_ == None:
+                print(f'error find op {op}')
+                sys.exit(1)
+            k_shape = self.shape_str_to_list(op_.attrs['kernel_shape'])
+            dia = self.shape_str_to_list(op_.attrs['dilations'])
+            pads = self.shape_str_to_list(op_.attrs['pads'])
+            #group = int(op_.attrs['group'].split(':')[0])
+            if len(pads) == 4:
+                pads = [pads[0], pads[2]]
+            strides = self.shape_str_to_list(op_.attrs['strides'])
+            ufold = torch.nn.Unfold(tuple(k_shape), dilation=dia, padding = pads, stride=strides)
+        elif self.parser.get_op_type_by_op_name(op) != 'top.MatMul':
+            print("not support!")
+            sys.exit(1)
+        # sum of x * x.T sample by sample, only one sample is unfolded at a time
+        xxt = np.zeros_like(self.H[op])
+        for input in inputs:
             if self.parser.get_op_type_by_op_name(op) == 'top.Conv':
-                op_ = self.parser.get_op_by_op_name(op)
-                if op_ == None:
-                    print(f'error find op {op}')
-                    sys.exit(1)
-                k_shape = self.shape_str_to_list(op_.attrs['kernel_shape'])
-                dia = self.shape_str_to_list(op_.attrs['dilations'])
-                pads = self.shape_str_to_list(op_.attrs['pads'])
-                #group = int(op_.attrs['group'].split(':')[0])
-                if len(pads) == 4:
-                    pads = [pads[0], pads[2]]
-                strides = self.shape_str_to_list(op_.attrs['strides'])
-                ufold = torch.nn.Unfold(tuple(k_shape), dilation=dia, padding = pads, stride=strides)
                 inp = ufold(torch.Tensor(input)).permute([1,0,2]).numpy()
                 #inp = inp.reshape(inp.shape[0]//group,-1)
                 inp = inp.reshape(inp.shape[0],-1)
-            elif self.parser.get_op_type_by_op_name(op) == 'top.MatMul':
-                inp = input.reshape(-1,shape[-1]).transpose()
             else:
-                print("not support!")
-                sys.exit(1)
-            self.H[op] *= self.samples[op]/(self.samples[op]+in_num)
-            self.samples[op] = self.samples[op]+in_num
-            inp = np.sqrt(2/self.samples[op])*inp
-            self.H[op] += np.matmul(inp, inp.transpose())
+                inp = input.reshape(-1,shape[-1]).transpose()
+            xxt += np.matmul(inp, inp.transpose())
+        # same as the running update sample by sample, H = 2/n * sum(x * x.T)
+        self.H[op] *= self.samples[op]/(self.samples[op]+in_num)
+        self.samples[op] = self.samples[op]+in_num
+        self.H[op] += (2/self.samples[op])*xxt
 
     def learning_one(self, epoch, op, total):
         loger.logging(f"now to learn {op} in epoch {epoch}")
@@ -803,14 +908,13 @@ class LearningGptqWeight:
                     self.pre_loss[op] = pre_loss
             self.restore_weight(op)
 
+        inputs = []
         for loop in np.arange(self.num_sample):
             pbar_detail.set_postfix_str(
                 f"Learning {epoch}.{loop+1}/{self.epoch}.{self.num_sample} [Total: {total}]")
             pbar_detail.update()
-            input = self.get_op_input0(op, loop, bitwidth=input_bw,quanted=False)
-            if epoch == 0 and loop == 0:
-                self.update_H(op, input, None) # init H
-            self.update_H(op, input, None)
+            inputs.append(self.get_op_input0(op, loop, bitwidth=input_bw,quanted=False))
+        self.update_H(op, inputs)
 
         if epoch == self.epoch-1:
             self.quant_requant_weight(op, bitwidth = weight_bw)
@@ -846,48 +950,33 @@ class LearningGptqWeight:
         os.rename(self.weight_file, self.weight_file.replace(".npz",".bak.npz"))
         np.savez(self.weight_file, **self.param_back)
 
-    def learning(self):
-        total = len(self.finetune_layers)
-        '''
-        can_parallel = True
-        for l in self.finetune_layers:
-            if self.parser.get_op_type_by_op_name(l) != 'top.MatMul':
-                can_parallel = False
-                break
-        if can_parallel:
-            groups = into_groups(self.parser, self.finetune_layers)
+    def learn_op(self, op, total, refs):
+        ref_tensors = self.ref_tensors
+        self.ref_tensors = refs
+        try:
             for epoch in np.arange(self.epoch):
-                for layers in groups:
-                    reqs = [(self, epoch, x, total) for x in groups[layers]]
-                    learned = 0
-                    for result in pool.map(learning_gptweight_wrap, reqs):
-                        learned += 1
-                print("")
-                print("=================================================")
-                print(f"  End epoch {epoch}, learned {learned} layers")
-                print("=================================================")
-                print("")
-        else:
-            for epoch in np.arange(self.epoch):
-                for l in self.finetune_layers:
-                    self.learning_one(epoch, l, total)
-                print("")
-                print("=================================================")
-                print(f"  End epoch {epoch}, learned {total} layers")
-                print("=================================================")
-                print("")
-        '''
-        for epoch in np.arange(self.epoch):
-            for l in self.finetune_layers:
-                self.learning_one(epoch, l, total)
-            print("")
-            print("=================================================")
-            print(f"  End epoch {epoch}, learned {total} layers")
-            print("=================================================")
-            print("")
+                self.learning_one(epoch, op, total)
+        finally:
+            self.ref_tensors = ref_tensors
+        return self.op_state(op)
+
+    def op_state(self, op):
+        weight = self.finetune_layer_weights[op]
+        return {'H': self.H[op], 'samples': self.samples[op], 'pre_loss': self.pre_loss[op],
+                'post_loss': self.post_loss[op], 'weight': self.param_back[weight]}
+
+    def set_op_state(self, op, state):
+        self.H[op] = state['H']
+        self.samples[op] = state['samples']
+        self.pre_loss[op] = state['pre_loss']
+        self.post_loss[op] = state['post_loss']
+        self.param_back[self.finetune_layer_weights[op]] = state['weight']
 
+    def learning(self):
+        learning_in_groups(self, self.workers)
         self.save_weights()
 
+
 class LearningAdaWeight:
     class SgdWeightOpt:
         def __init__(self,lr, momentum=0.0,nesterov=False, weight_decay=0.0, support_unsigned = False):
@@ -978,6 +1067,7 @@ class LearningAdaWeight:
             f'Learning Weight, momentum is {self.momentum} nesterov is {self.nesterov} weight_decay is {self.weight_decay}')
         self.v = {}
         self.support_unsigned = False
+        self.workers = getattr(args, 'workers', 1)
         self.get_finetune_ops(args.excepts)
         self.backup_weights()
         if self.mini_batch <= self.batch_size:
@@ -1312,48 +1402,37 @@ class LearningAdaWeight:
         os.rename(self.weight_file, self.weight_file.replace(".npz",".bak.npz"))
         np.savez(self.weight_file, **self.param_back)
 
-    def learning(self):
-        total = len(self.finetune_layers)
-        '''
-        can_parallel = True
-        for l in self.finetune_layers:
-            if self.parser.get_op_type_by_op_name(l) != 'top.MatMul':
-                can_parallel = False
-                break
-        if can_parallel:
-            groups = into_groups(self.parser, self.finetune_layers)
+    def learn_op(self, op, total, refs):
+        ref_tensors = self.ref_tensors
+        self.ref_tensors = refs
+        try:
             for epoch in np.arange(self.epoch):
-                for layers in groups:
-                    reqs = [(self, epoch, x, total) for x in groups[layers]]
-                    learned = 0
-                    for result in pool.map(learning_adaweight_wrap, reqs):
-                        learned += 1
-                print("")
-                print("=================================================")
-                print(f"  End epoch {epoch}, learned {learned} layers")
-                print("=================================================")
-                print("")
-        else:
-            for epoch in np.arange(self.epoch):
-                for l in self.finetune_layers:
-                    self.learning_one(epoch, l, total)
-                print("")
-                print("=================================================")
-                print(f"  End epoch {epoch}, learned {total} layers")
-                print("=================================================")
-                print("")
-        '''
-        for epoch in np.arange(self.epoch):
-            for l in self.finetune_layers:
-                self.learning_one(epoch, l, total)
-            print("")
-            print("=================================================")
-            print(f"  End epoch {epoch}, learned {total} layers")
-            print("=================================================")
-            print("")
+                self.learning_one(epoch, op, total)
+        finally:
+            self.ref_tensors = ref_tensors
+        return self.op_state(op)
+
+    def op_state(self, op):
+        weight = self.finetune_layer_weights[op]
+        return {'alpha': self.alpha[op], 'v': self.opt.v.get(op), 'loss': self.opt.loss.get(op),
+                'pre_loss': self.pre_loss[op], 'post_loss': self.post_loss[op],
+                'weight': self.param_back[weight]}
+
+    def set_op_state(self, op, state):
+        self.alpha[op] = state['alpha']
+        if state['v'] is not None:
+            self.opt.v[op] = state['v']
+        if state['loss'] is not None:
+            self.opt.loss[op] = state['loss']
+        self.pre_loss[op] = state['pre_loss']
+        self.post_loss[op] = state['post_loss']
+        self.param_back[self.finetune_layer_weights[op]] = state['weight']
 
+    def learning(self):
+        learning_in_groups(self, self.workers)
         self.save_weights()
 
+
 class LearningScale:
     class SgdScaleOpt:
         def __init__(self,lr, momentum=0.0,nesterov=False, weight_decay=0.0, support_unsigned=False):
@@ -1775,6 +1854,8 @@ if __name__ == '__main__':
                         help='batch size for learning')
     parser.add_argument('--threads', required=False, type=int, default=4,
                         help='number of working threads')
+    parser.add_argument('--workers', required=False, type=int, default=1,
+                        help='number of processes learning the independent layers of AdaWeight and GptWeight in parallel')
     parser.add_argument('--momentum', required=False, type=float, default=0.9,
                         help='momentum of learning')
     parser.add_argument('--nesterov', required=False, action='store_true', dest='nesterov',
@@ -1,5 +1,5 @@
 import numpy as np
-import struct
+from utils.numeric import bf16_to_fp32, fp32_to_bf16
 
 equal_dtypes = {
     "i4": "int4",
@@ -62,24 +62,3 @@ def lowering(input, pdtype, pshape, pzero_point=0, pscale=1):
 def round_away_from_zero(x):
     a = np.floor(np.abs(x) + 0.5)
     return np.sign(x) * a
-
-
-def bf16_to_fp32(d_bf16):
-    s = d_bf16.shape
-    d_bf16 = d_bf16.flatten()
-    assert d_bf16.dtype == np.uint16
-    d_fp32 = np.empty_like(d_bf16, dtype=np.float32)
-    for i in range(len(d_bf16)):
-        d_fp32[i] = struct.unpack("<f", struct.pack("<HH", 0, d_bf16[i]))[0]
-    return d_fp32.reshape(s)
-
-
-def fp32_to_bf16(d_fp32):
-    s = d_fp32.shape
-    d_fp32 = d_fp32.flatten()
-    assert d_fp32.dtype == np.float32
-    d_bf16 = np.empty_like(d_fp32, dtype=np.uint16)
-    for i in range(len(d_bf16)):
-        bytes = struct.pack("f", d_fp32[i])
-        d_bf16[i] = struct.unpack("<H", struct.pack("BB", bytes[2], bytes[3]))[0]
-    return d_bf16.reshape(s)
@@ -7,7 +7,7 @@
 # third-party components.
 #
 # ==============================================================================
-from typing import List
+from typing import Dict, List
 from itertools import chain
 import sys
 import mlir
@@ -209,6 +209,28 @@ class MlirParser:
         for op in self.ops:
             if op.type == "top.Input":
                 self.inputs.append(op)
+        self.build_index()
+
+    def build_index(self):
+        # name -> ops, output -> producer, tensor -> consumers and use counts, so
+        # that the queries below do not scan the ops; call it again if ops change
+        self._ops_by_name: Dict[str, List[Operation]] = {}
+        self._op_index: Dict[str, int] = {}
+        self._producers: Dict[str, Operation] = {}
+        self._consumers: Dict[str, List[Operation]] = {}
+        self._use_counts: Dict[str, int] = {}
+        for i, op in enumerate(self.ops):
+            self._ops_by_name.setdefault(op.name, []).append(op)
+            self._op_index.setdefault(op.name, i)
+            for output in op.outputs or []:
+                self._producers.setdefault(output, op)
+            for opd in op.opds:
+                self._use_counts[opd] = self._use_counts.get(opd, 0) + 1
+            # an op using a tensor twice is one consumer
+            for opd in dict.fromkeys(op.opds):
+                self._consumers.setdefault(opd, []).append(op)
+        self._all_pre_ops: Dict[str, List[str]] = {}
+        self._all_next_ops: Dict[str, List[str]] = {}
 
     def get_op_name_list(self):
         return [op.name for op in self.ops]
@@ -241,45 +263,55 @@ class MlirParser:
 
     def get_pre_op_by_op_name(self, op_name):
         op_input_tensor = []
-        for op in self.ops:
-            if op.name == op_name:
-                for opd in op.opds:
-                    if opd in self.get_op_output_name_list():
-                        op_input_tensor.append(opd)
+        for op in self._ops_by_name.get(op_name, []):
+            for opd in op.opds:
+                if opd in self._producers:
+                    op_input_tensor.append(opd)
         return op_input_tensor
 
     def get_next_op_by_op_name(self, op_name):
         op_output_tensor = []
-        for op in self.ops:
-            if op_name in op.opds:
-                if op.name in self.get_op_output_name_list():
-                    op_output_tensor.append(op.name)
+        for op in self._consumers.get(op_name, []):
+            if op.name in self._producers:
+                op_output_tensor.append(op.name)
         return op_output_tensor
 
+    def _closure(self, op_name, neighbours):
+        # names reachable from op_name, by an iterative dfs
+        visited = set()
+        stack = list(neighbours(op_name))
+        while stack:
+            name = stack.pop()
+            if name in visited:
+                continue
+            visited.add(name)
+            stack.extend(neighbours(name))
+        return visited
+
+    def _in_topo_order(self, names):
+        # ops of a block are in topological order, operands defined before use
+        return sorted(names, key=lambda name: self._op_index.get(name, len(self._op_index)))
+
     def get_all_pre_ops_by_op_name(self, op_name):
-        all_pre_ops = [op_name] + self.get_pre_op_by_op_name(op_name)
-        cur_pre_ops = self.get_pre_op_by_op_name(op_name)
-        while cur_pre_ops:
-            tmp = cur_pre_ops.pop(0)
-            new_pre_ops = self.get_pre_op_by_op_name(tmp)
-            for new_pre_op in new_pre_ops:
-                if new_pre_op not in all_pre_ops:
-                    cur_pre_ops.append(new_pre_op)
-                    if self.get_pre_op_by_op_name(new_pre_op):
-                        all_pre_ops.append(new_pre_op)
-        return all_pre_ops
+        # op_name, its inputs, and the ancestors that are not graph inputs
+        if op_name not in self._all_pre_ops:
+            pre_ops = self.get_pre_op_by_op_name(op_name)
+            ancestors = self._closure(op_name, self.get_pre_op_by_op_name)
+            ancestors.difference_update(pre_ops)
+            ancestors.discard(op_name)
+            ancestors = [name for name in ancestors if self.get_pre_op_by_op_name(name)]
+            self._all_pre_ops[op_name] = [op_name] + pre_ops + self._in_topo_order(ancestors)
+        return list(self._all_pre_ops[op_name])
 
     def get_all_next_ops_by_op_name(self, op_name):
-        all_next_ops = [op_name] + self.get_next_op_by_op_name(op_name)
-        cur_next_ops = self.get_next_op_by_op_name(op_name)
-        while cur_next_ops:
-            tmp = cur_next_ops.pop(0)
-            new_next_ops = self.get_next_op_by_op_name(tmp)
-            for new_next_op in new_next_ops:
-                if new_next_op not in all_next_ops:
-                    cur_next_ops.append(new_next_op)
-                    all_next_ops.append(new_next_op)
-        return all_next_ops
+        # op_name and all its descendants
+        if op_name not in self._all_next_ops:
+            next_ops = self.get_next_op_by_op_name(op_name)
+            descendants = self._closure(op_name, self.get_next_op_by_op_name)
+            descendants.difference_update(next_ops)
+            descendants.discard(op_name)
+            self._all_next_ops[op_name] = [op_name] + next_ops + self._in_topo_order(descendants)
+        return list(self._all_next_ops[op_name])
 
     def get_block_ops_by_op_name(self, name_list1, name_list2):
         all_pre_ops = set(self.get_all_pre_ops_by_op_name(name_list2))
@@ -293,41 +325,32 @@ class MlirParser:
         return list(block_ops)
 
     def get_user_count_by_op_name(self, op_name):
-        count = 0
-        for op in self.ops:
-            if op_name in op.opds:
-                count += 1
-        return count
+        return len(self._consumers.get(op_name, []))
 
     def get_use_count_by_op_name(self, op_name):
-        count = 0
-        for op in self.ops:
-            count += op.opds.count(op_name)
-        return count
+        return self._use_counts.get(op_name, 0)
+
+    def get_producer_by_tensor_name(self, tensor_name):
+        return self._producers.get(tensor_name, None)
+
+    def get_consumers_by_tensor_name(self, tensor_name):
+        return list(self._consumers.get(tensor_name, []))
 
     def get_outputs_by_op_name(self, op_name):
-        for op in self.ops:
-            if op.name == op_name:
-                return op.outputs
-        return None
+        op = self.get_op_by_op_name(op_name)
+        return op.outputs if op is not None else None
 
     def get_op_by_op_name(self, op_name):
-        for op in self.ops:
-            if op.name == op_name:
-                return op
-        return None
+        ops = self._ops_by_name.get(op_name)
+        return ops[0] if ops else None
 
     def get_opds_by_op_name(self, op_name):
-        for op in self.ops:
-            if op.name == op_name:
-                return op.opds
-        return None
+        op = self.get_op_by_op_name(op_name)
+        return op.opds if op is not None else None
 
     def get_op_type_by_op_name(self, op_name):
-        for op in self.ops:
-            if op.name == op_name:
-                return op.type
-        return None
+        op = self.get_op_by_op_name(op_name)
+        return op.type if op is not None else None
 
     # the func is to get a dict with output names and corresponding shapes
     def get_output_op_names_n_shapes(self):
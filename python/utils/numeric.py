@@ -0,0 +1,63 @@
+# ==============================================================================
+#
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+
+# Vectorized conversions between fp32 and the low precision formats stored
+# as raw bits: bf16 in uint16, fp8 e4m3/e5m2 in uint8.
+
+import numpy as np
+
+
+def bf16_to_fp32(d_bf16):
+    assert d_bf16.dtype == np.uint16
+    return (d_bf16.astype(np.uint32) << 16).view(np.float32)
+
+
+def fp32_to_bf16(d_fp32, rounding=False):
+    # truncate by default, round to nearest even if rounding
+    assert d_fp32.dtype == np.float32
+    u32 = np.ascontiguousarray(d_fp32).view(np.uint32)
+    if rounding:
+        bias = np.uint32(0x7FFF) + ((u32 >> 16) & 1)
+        rounded = u32 + bias
+        # keep nan a quiet nan instead of rounding it into inf
+        u32 = np.where(np.isnan(d_fp32), u32 | 0x400000, rounded)
+    return (u32 >> 16).astype(np.uint16)
+
+
+def _fp8_table(exp_bits, man_bits, bias, fn):
+    # fp32 value of all the 256 codes
+    code = np.arange(256, dtype=np.int64)
+    sign = np.where(code & 0x80, -1.0, 1.0)
+    exp = (code >> man_bits) & ((1 << exp_bits) - 1)
+    man = code & ((1 << man_bits) - 1)
+    frac = man / float(1 << man_bits)
+    value = np.where(exp == 0, frac * 2.0**(1 - bias), (1.0 + frac) * 2.0**(exp - bias))
+    value = sign * value
+    max_exp = (1 << exp_bits) - 1
+    if fn:
+        # e4m3fn: no inf, only s.1111.111 is nan
+        value[(code & 0x7F) == 0x7F] = np.nan
+    else:
+        value[(exp == max_exp) & (man == 0)] = sign[(exp == max_exp) & (man == 0)] * np.inf
+        value[(exp == max_exp) & (man != 0)] = np.nan
+    return value.astype(np.float32)
+
+
+FP8E4M3_TABLE = _fp8_table(4, 3, 7, True)
+FP8E5M2_TABLE = _fp8_table(5, 2, 15, False)
+
+
+def fp8e4m3_to_fp32(d_fp8):
+    assert d_fp8.dtype == np.uint8
+    return FP8E4M3_TABLE[d_fp8]
+
+
+def fp8e5m2_to_fp32(d_fp8):
+    assert d_fp8.dtype == np.uint8
+    return FP8E5M2_TABLE[d_fp8]